@@ -1,153 +1,1626 @@
-from flask import Flask, request, jsonify, Response
-import requests
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import os
 import re
+import io
+import gzip
+import sys
 import time
-from dotenv import load_dotenv
+import math
+import random
+import json
+import types
+import inspect
+import importlib.util
+import uuid
+import queue
+import mmap
+import bisect
+import struct
+import hashlib
+import functools
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from array import array
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed, wait, FIRST_COMPLETED
 
-# Load environment variables from .env file
-load_dotenv()
+class LazyModule(types.ModuleType):
+    """A module whose code runs on first attribute access.
+
+    importlib.util.LazyLoader swaps the module's class before running its code,
+    so a second thread touching the module mid-load sees it half-initialized.
+    Here the first access loads it under a per-module lock and the class only
+    changes once the code has run: other threads wait, then re-check and skip
+    the load. The loading thread itself (a submodule import reading __path__)
+    gets whatever is defined so far, as with a normal import.
+    """
+    _locks = {}
+    _loading = set()
+
+    def __getattribute__(self, attr):
+        with LazyModule._locks[self]:
+            if type(self) is LazyModule and self not in LazyModule._loading:
+                LazyModule._loading.add(self)
+                try:
+                    types.ModuleType.__getattribute__(self, "__spec__").loader.exec_module(self)
+                    self.__class__ = types.ModuleType
+                finally:
+                    LazyModule._loading.discard(self)
+        return types.ModuleType.__getattribute__(self, attr)
+
+def lazy_import(name):
+    """Return a module that is only executed on first attribute access.
+
+    Keeps imports that only some requests need off the cold-start path.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    module = importlib.util.module_from_spec(spec)
+    LazyModule._locks[module] = threading.RLock()
+    module.__class__ = LazyModule
+    sys.modules[name] = module
+    return module
+
+requests = lazy_import("requests")
+asyncio = lazy_import("asyncio")
+sqlite3 = lazy_import("sqlite3")
+tempfile = lazy_import("tempfile")
+socket = lazy_import("socket")
+ipaddress = lazy_import("ipaddress")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def find_env_file():
+    """The nearest .env file above this module, as python-dotenv would find it."""
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(path, ".env")
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+# Load environment variables from .env file (deployments usually have none, so dotenv is imported only if one exists)
+ENV_FILE = find_env_file()
+if ENV_FILE:
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 
 app = Flask(__name__)
 
-# API URL - configurable via environment variable
-# For OpenRouter: https://openrouter.ai/api/v1/chat/completions
-# For Gemini: https://generativelanguage.googleapis.com/v1beta/openai/chat/completions
-# For apirouter.ai: check their documentation for the correct endpoint
-API_BASE_URL = os.getenv("API_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+# Startup - "lazy" defers work only some requests need (the upstream HTTP session, page
+# compression) to first use, for serverless cold starts; "eager" does it at import so the
+# first request doesn't pay for it. Defaults to lazy on Vercel.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy" if os.getenv("VERCEL") else "eager")
+
+DEFAULT_API_MODELS = (
+    "anthropic/claude-sonnet-4",
+    "google/gemini-2.0-flash-exp:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+)
+
+@dataclass(frozen=True)
+class Settings:
+    """Upstream configuration, parsed from the environment once at import."""
+    api_base_url: str
+    api_key: str
+    models: tuple
+    headers: types.MappingProxyType
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        # For OpenRouter: https://openrouter.ai/api/v1/chat/completions
+        # For Gemini: https://generativelanguage.googleapis.com/v1beta/openai/chat/completions
+        # For apirouter.ai: check their documentation for the correct endpoint
+        api_base_url = environ.get("API_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+        api_key = environ.get("OPENROUTER_API_KEY", "")
+        # For OpenRouter: anthropic/claude-sonnet-4,google/gemini-2.0-flash-exp:free
+        # For Gemini: gemini-2.0-flash,gemini-1.5-flash
+        models = tuple(m.strip() for m in environ.get("API_MODELS", "").split(",") if m.strip())
+
+        # Base headers (work with all OpenAI-compatible APIs)
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        # Add OpenRouter-specific headers only if using OpenRouter
+        if "openrouter.ai" in api_base_url:
+            headers["HTTP-Referer"] = "https://linkedin-post-generator.vercel.app"
+            headers["X-Title"] = "LinkedIn Post Generator"
+        return cls(api_base_url, api_key, models or DEFAULT_API_MODELS, types.MappingProxyType(headers))
+
+settings = Settings.from_env()
+
+# API URL - configurable via the API_BASE_URL environment variable
+API_BASE_URL = settings.api_base_url
+
+# Concurrent generation - post, hooks and hashtags run in parallel for text posts
+# Timeouts are in seconds and measured from the moment the request fans out
+PARALLEL_GENERATION = os.getenv("PARALLEL_GENERATION", "1") != "0"
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "32"))
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "60"))
+HASHTAG_TIMEOUT = float(os.getenv("HASHTAG_TIMEOUT", "10"))
+
+# Text generation mode: "separate" makes three upstream calls (post, hooks, hashtags),
+# "combined" asks for all three as one JSON object and falls back to separate calls on bad output
+GENERATION_MODE = os.getenv("GENERATION_MODE", "separate")
+
+# Shared worker pool for upstream calls (threads spend their time waiting on I/O)
+executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generate")
+
+# Upstream rate limiting - one scheduler per model shared by every request in the process
+# RATE_LIMIT_RPS = 0 means no steady-state cap; 429 responses still pause the model for everyone
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", "16"))
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", "30"))
+
+# Model routing - order the API_MODELS chain by health and skip models whose circuit is open
+# ROUTER_STRATEGY: "healthiest" (lowest error rate, then configured order),
+# "fastest" (lowest latency among healthy models) or "ordered" (configured order)
+ROUTER_STRATEGY = os.getenv("ROUTER_STRATEGY", "healthiest")
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+ROUTER_HEDGE_AFTER = float(os.getenv("ROUTER_HEDGE_AFTER", "0"))
+
+# Async serving mode - `uvicorn index:asgi_app` (needs requirements-async.txt)
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "200"))
+
+# Batch generation - /generate/batch and `python index.py batch`
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# Job queue - POST /jobs returns at once and a worker pool runs the generation in the background
+# JOB_STORE_PATH keeps job records in SQLite (shared by processes, survives restarts); empty = in memory
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "")
+JOB_TTL = float(os.getenv("JOB_TTL", "86400"))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+# Callback URLs must resolve to public addresses, so a client cannot make the server call
+# loopback, private-network or cloud-metadata endpoints. CALLBACK_ALLOWED_HOSTS
+# (comma-separated host names) replaces that check with an allowlist.
+CALLBACK_ALLOWED_HOSTS = frozenset(h.strip().lower() for h in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip())
+
+# Pools are layered so no task waits on work queued behind itself: `executor` runs
+# generators, `variant_executor` the single calls that fill in variant samples (each
+# a call_api, which may hedge), and `hedge_executor` the model attempts themselves,
+# which never submit further work
+variant_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="variant")
+hedge_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="hedge")
+
+def submit_task(fn, *args, pool=None):
+    """Run fn on a worker pool, carrying over the caller's context (usage tracking, request IDs)."""
+    return (pool or executor).submit(contextvars.copy_context().run, fn, *args)
+
+# Observability - counters and histograms served at /metrics in the Prometheus text format
+# LOG_FORMAT=json prints one JSON object per event, tagged with the ID of the request that caused it
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._families = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self._families[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        # First bucket whose upper bound is >= value; len(buckets) is +Inf
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            histogram["buckets"][slot] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self, gauges=()):
+        """Exposition text. `gauges` adds (name, labels dict, value) samples read at scrape time."""
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram["buckets"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+
+        output = []
+        for name in sorted(samples):
+            kind, help_text = self._families.get(name, ("untyped", ""))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(sorted(samples[name]) if kind != "histogram" else samples[name])
+        return "\n".join(output) + "\n"
+
+metrics = Metrics()
+metrics.describe("linkedin_http_request_duration_seconds", "histogram", "Time to produce a response, by route and status (streamed bodies: time to first byte).")
+metrics.describe("linkedin_stage_duration_seconds", "histogram", "Time spent in each generation and post-processing stage.")
+metrics.describe("linkedin_upstream_attempt_duration_seconds", "histogram", "Duration of each upstream HTTP attempt, by model and outcome.")
+metrics.describe("linkedin_upstream_wait_seconds", "histogram", "Time slept before an upstream attempt (rate-limit slots and network backoff).")
+metrics.describe("linkedin_upstream_retries_total", "counter", "Upstream attempts after the first one for the same call.")
+metrics.describe("linkedin_upstream_tokens_total", "counter", "Tokens reported in the upstream usage field.")
+metrics.describe("linkedin_cache_hits_total", "counter", "Response cache hits (memory and SQLite).")
+metrics.describe("linkedin_cache_misses_total", "counter", "Response cache misses.")
+metrics.describe("linkedin_cache_entries", "gauge", "Entries in the in-memory response cache.")
+metrics.describe("linkedin_model_circuit_open", "gauge", "1 while a model's circuit breaker is open.")
+metrics.describe("linkedin_job_wait_seconds", "histogram", "Time jobs spent queued before a worker picked them up.")
+metrics.describe("linkedin_job_run_seconds", "histogram", "Time workers spent generating a job.")
+metrics.describe("linkedin_jobs_total", "counter", "Jobs by final status (succeeded, failed, rejected).")
+metrics.describe("linkedin_job_queue_depth", "gauge", "Jobs waiting for a worker.")
+metrics.describe("linkedin_coalesced_requests_total", "counter", "Generations that joined an identical one in flight instead of calling upstream.")
+metrics.describe("linkedin_templates", "gauge", "Templates in the template store.")
+metrics.describe("linkedin_admission_total", "counter", "Generation requests admitted, queued, or shed (by reason: quota, queue_full, deadline, timeout).")
+metrics.describe("linkedin_admission_wait_seconds", "histogram", "Time admitted requests waited in the admission queue.")
+metrics.describe("linkedin_admission_in_flight", "gauge", "Generations holding an admission slot.")
+metrics.describe("linkedin_admission_queue_depth", "gauge", "Requests waiting for an admission slot.")
+metrics.describe("linkedin_hashtag_suggestions_total", "counter", "Hashtag suggestions answered from the local index or sent to the model.")
+metrics.describe("linkedin_similar_topic_lookups_total", "counter", "Hook and carousel lookups in the similar-topic index, by kind and outcome (hit, miss).")
+metrics.describe("linkedin_http_pool_requests_total", "counter", "Upstream HTTP requests sent through the pooled session.")
+metrics.describe("linkedin_http_pool_connections_new_total", "counter", "Upstream connections opened by the pooled session.")
+metrics.describe("linkedin_http_pool_connections_reused_total", "counter", "Upstream requests that reused a pooled keep-alive connection.")
+metrics.describe("linkedin_rate_limit_rejected_total", "counter", "Calls refused because a model's next slot was past their deadline.")
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_log_lock = threading.Lock()
+
+def log_event(tag, message=None, **fields):
+    """Log an event.
+
+    In text mode this prints `[TAG] message` and events without a message are
+    skipped. In JSON mode every event is printed with its fields and request ID.
+    """
+    if LOG_FORMAT == "json":
+        record = {"ts": round(time.time(), 3), "event": tag.lower().replace(" ", "_"), "request_id": _request_id.get()}
+        if message:
+            record["message"] = message
+        record.update(fields)
+        line = json.dumps(record, default=str) + "\n"
+        # One write per record so lines from concurrent workers never interleave
+        with _log_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    elif message:
+        print(f"[{tag}] {message}")
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("linkedin_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+def timed_stage(stage):
+    """Decorator form of `timed` for sync and async functions."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with timed(stage):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return run
+    return decorate
+
+def record_upstream_attempt(model, outcome, seconds, attempt=0, usage=None):
+    """Metrics and log line for one upstream HTTP attempt."""
+    metrics.observe("linkedin_upstream_attempt_duration_seconds", seconds, model=model, outcome=str(outcome))
+    if attempt > 0:
+        metrics.inc("linkedin_upstream_retries_total", model=model)
+    if usage:
+        cached = cached_prompt_tokens(usage)
+        metrics.inc("linkedin_upstream_tokens_total", usage.get("prompt_tokens") or 0, model=model, kind="prompt")
+        metrics.inc("linkedin_upstream_tokens_total", cached, model=model, kind="prompt_cached")
+        metrics.inc("linkedin_upstream_tokens_total", (usage.get("prompt_tokens") or 0) - cached, model=model, kind="prompt_uncached")
+        metrics.inc("linkedin_upstream_tokens_total", usage.get("completion_tokens") or 0, model=model, kind="completion")
+        prompt_token_stats.record(model, usage)
+    log_event("UPSTREAM CALL", model=model, outcome=outcome, seconds=round(seconds, 4), attempt=attempt + 1, usage=usage)
+
+def record_upstream_wait(model, reason, seconds):
+    metrics.observe("linkedin_upstream_wait_seconds", seconds, reason=reason)
+    log_event("UPSTREAM WAIT", model=model, reason=reason, seconds=round(seconds, 4))
+
+# Upstream HTTP connection pool - keep-alive connections are reused across calls
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", str(GENERATION_WORKERS)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_WARMUP = os.getenv("HTTP_WARMUP", "0") == "1"
+
+def create_http_session():
+    """Build a keep-alive session with a bounded connection pool per upstream host."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """The shared session, created (and requests imported) on first use."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = create_http_session()
+    return _http_session
+
+def http_pool_stats():
+    """Connection counters summed over every upstream host pool.
+
+    urllib3 counts each new connection and each request sent; the difference
+    is the number of requests that reused a pooled keep-alive connection.
+    """
+    new_connections = 0
+    total_requests = 0
+    adapters = _http_session.adapters.values() if _http_session is not None else ()
+    for adapter in set(adapters):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections
+            total_requests += pool.num_requests
+    return {
+        "requests": total_requests,
+        "new_connections": new_connections,
+        "reused_connections": max(0, total_requests - new_connections),
+    }
+
+def warm_up_http_pool():
+    """Open a connection to the upstream host ahead of the first LLM call.
+
+    Pays the TCP/TLS handshake at startup instead of on a user request. Any
+    response status is fine; failures are logged and otherwise ignored.
+    """
+    try:
+        get_http_session().head(API_BASE_URL, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_CONNECT_TIMEOUT))
+    except requests.exceptions.RequestException as e:
+        log_event("NETWORK ERROR", f"Warm-up failed: {str(e)}")
+
+if HTTP_WARMUP:
+    warm_up_http_pool()
+elif STARTUP_MODE == "eager":
+    get_http_session()
+
+# Response cache - identical prompts are answered locally instead of re-calling the paid upstream
+# RESPONSE_CACHE_RULES overrides the TTL per generator, e.g. "hooks=0,hashtags=86400" (0 = always bypass)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+
+# Request coalescing - identical /generate payloads in flight at the same time share one generation
+# A payload with "fresh": true skips both coalescing and the response cache; the web form
+# sends it when Generate is clicked again with unchanged inputs, so a retry is a new sample
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") != "0"
+
+def parse_cache_rules(value):
+    rules = {}
+    for item in value.split(","):
+        name, _, ttl = item.partition("=")
+        if name.strip() and ttl.strip():
+            try:
+                rules[name.strip()] = float(ttl)
+            except ValueError:
+                pass
+    return rules
+
+RESPONSE_CACHE_RULES = parse_cache_rules(os.getenv("RESPONSE_CACHE_RULES", ""))
+
+def cache_key(model, messages, max_tokens, temperature):
+    """Content-addressed key for one upstream request."""
+    raw = json.dumps([model, messages, max_tokens, temperature], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+_fresh_sample = contextvars.ContextVar("fresh_sample", default=False)
+
+@contextmanager
+def fresh_sample(enabled=True):
+    """Bypass the response cache for upstream calls made inside the block."""
+    token = _fresh_sample.set(enabled)
+    try:
+        yield
+    finally:
+        _fresh_sample.reset(token)
+
+def cache_ttl_for(endpoint):
+    """TTL in seconds for a generator's responses; 0 means bypass the cache."""
+    if not RESPONSE_CACHE_ENABLED or endpoint is None or _fresh_sample.get():
+        return 0
+    return RESPONSE_CACHE_RULES.get(endpoint, RESPONSE_CACHE_TTL)
+
+class SQLiteCacheBackend:
+    """Shared second-level cache in a SQLite file, usable by several processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(key)
+            return None
+        return row[0], row[1]
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO response_cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+class ResponseCache:
+    """Thread-safe LRU of upstream responses with per-entry expiry.
+
+    Entries live in memory first; when a backend is configured, writes also go
+    to it and memory misses fall through to it, so other processes benefit.
+    """
+
+    def __init__(self, max_entries, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get_local(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < now:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_local(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def lookup(self, keys):
+        """Return the cached value for the first key that hits, or None."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                value = self._get_local(key, now)
+                if value is not None:
+                    self.hits += 1
+                    return value
+        if self.backend is not None:
+            for key in keys:
+                entry = self.backend.get(key)
+                if entry is not None:
+                    with self._lock:
+                        self._set_local(key, entry[0], entry[1])
+                        self.backend_hits += 1
+                    return entry[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        with self._lock:
+            self._set_local(key, value, expires)
+        if self.backend is not None:
+            self.backend.set(key, value, expires)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round((self.hits + self.backend_hits) / lookups, 4) if lookups else 0.0,
+                "backend": self.backend.path if self.backend is not None else None,
+            }
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class ModelRateLimiter:
+    """Process-wide token buckets per model, shared by all in-flight requests.
+
+    Callers reserve a send slot before each upstream request. Reservations are
+    handed out in order, so waiting requests queue behind each other instead of
+    retrying independently. A 429 pauses the model for every caller until its
+    Retry-After (or an exponential backoff) has passed. A request whose slot
+    would come after its deadline is refused immediately rather than waiting.
+    """
+
+    def __init__(self, rate, burst, max_backoff):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _state(self, model, now):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = {
+                "tokens": self.burst, "updated": now, "blocked_until": 0.0,
+                "strikes": 0, "throttled": 0, "rejected": 0, "waited": 0.0,
+            }
+        elif self.rate > 0:
+            state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated"]) * self.rate)
+        state["updated"] = now
+        return state
+
+    def reserve(self, model, deadline):
+        """Reserve the next slot for `model`.
+
+        Returns the seconds to wait before sending, or None if the slot would
+        come after `deadline` (a time.monotonic() value).
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(model, now)
+            ready_at = max(now, state["blocked_until"])
+            if self.rate > 0 and state["tokens"] < 1:
+                ready_at = max(ready_at, now + (1 - state["tokens"]) / self.rate)
+            if ready_at > deadline:
+                state["rejected"] += 1
+                return None
+            if self.rate > 0:
+                state["tokens"] -= 1
+            wait = ready_at - now
+            if wait > 0:
+                state["throttled"] += 1
+                state["waited"] += wait
+            return wait
+
+    def pause_remaining(self, model, deadline):
+        """Seconds a caller holding a slot must still wait out a 429 pause.
+
+        Returns None, and hands the slot back, if the pause ends after `deadline`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(model, now)
+            wait = state["blocked_until"] - now
+            if wait <= 0:
+                return 0.0
+            if state["blocked_until"] > deadline:
+                state["rejected"] += 1
+                if self.rate > 0:
+                    state["tokens"] = min(self.burst, state["tokens"] + 1)
+                return None
+            state["waited"] += wait
+            return wait
+
+    def acquire(self, model, deadline):
+        """Wait for a slot for `model`. Returns False without waiting if the deadline cannot be met.
+
+        The slot is reserved once; if another request hits a 429 while we wait,
+        we keep it and wait out the pause instead of reserving (and paying) again.
+        """
+        wait = self.reserve(model, deadline)
+        while wait is not None:
+            if wait == 0:
+                return True
+            record_upstream_wait(model, "rate_limit", wait)
+            time.sleep(wait)
+            wait = self.pause_remaining(model, deadline)
+        return False
+
+    async def acquire_async(self, model, deadline):
+        """Same as acquire, but waits without holding the event loop."""
+        wait = self.reserve(model, deadline)
+        while wait is not None:
+            if wait == 0:
+                return True
+            record_upstream_wait(model, "rate_limit", wait)
+            await asyncio.sleep(wait)
+            wait = self.pause_remaining(model, deadline)
+        return False
+
+    def penalize(self, model, retry_after=None):
+        """Record a 429: pause `model` for Retry-After seconds, or back off exponentially."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(model, now)
+            state["strikes"] += 1
+            delay = retry_after if retry_after is not None else min(self.max_backoff, 2 ** (state["strikes"] - 1))
+            state["blocked_until"] = max(state["blocked_until"], now + delay)
+
+    def record_success(self, model):
+        with self._lock:
+            state = self._models.get(model)
+            if state is not None:
+                state["strikes"] = 0
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                model: {
+                    "blocked_for": round(max(0.0, state["blocked_until"] - now), 3),
+                    "tokens": round(state["tokens"], 2),
+                    "throttled": state["throttled"],
+                    "rejected": state["rejected"],
+                    "waited_seconds": round(state["waited"], 3),
+                }
+                for model, state in self._models.items()
+            }
 
-# Templates
-templates = {
+rate_limiter = ModelRateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_MAX_BACKOFF)
+
+class ModelRouter:
+    """Per-model health tracking with circuit breakers.
+
+    Each model keeps moving averages of its latency and error rate. After
+    `failure_threshold` consecutive failures its circuit opens and the model is
+    skipped for `cooldown` seconds. After that one trial call is let through
+    (half-open); success closes the circuit, failure opens it again.
+    """
+    ALPHA = 0.2
+
+    def __init__(self, strategy, failure_threshold, cooldown):
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _state(self, model):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = {
+                "circuit": "closed", "opened_at": 0.0, "trial_started": None,
+                "consecutive_failures": 0, "error_rate": 0.0, "latency": None,
+                "successes": 0, "failures": 0, "hedged": 0, "last_error": None,
+            }
+        return state
+
+    def _available(self, state, now):
+        if state["circuit"] == "closed":
+            return True
+        if state["circuit"] == "open" and now - state["opened_at"] >= self.cooldown:
+            state["circuit"] = "half_open"
+        # One trial at a time; a trial that never reported back expires after a cooldown
+        trial = state["trial_started"]
+        return state["circuit"] == "half_open" and (trial is None or now - trial >= self.cooldown)
+
+    def order(self, models):
+        """Return the models to try, healthiest first. Open circuits are left out
+        unless every model is open, in which case the configured order is used."""
+        with self._lock:
+            now = time.monotonic()
+            available = []
+            for position, model in enumerate(models):
+                state = self._state(model)
+                if self._available(state, now):
+                    if state["circuit"] == "half_open":
+                        state["trial_started"] = now
+                    available.append((position, model, state))
+            if not available:
+                return list(models)
+            if self.strategy == "fastest":
+                available.sort(key=lambda item: (item[2]["error_rate"] >= 0.5, item[2]["latency"] or 0.0, item[0]))
+            elif self.strategy == "healthiest":
+                available.sort(key=lambda item: (round(item[2]["error_rate"], 1), item[0]))
+            return [model for _, model, _ in available]
+
+    def record_success(self, model, latency):
+        with self._lock:
+            state = self._state(model)
+            state["successes"] += 1
+            state["consecutive_failures"] = 0
+            state["error_rate"] *= (1 - self.ALPHA)
+            state["latency"] = latency if state["latency"] is None else (1 - self.ALPHA) * state["latency"] + self.ALPHA * latency
+            state["circuit"] = "closed"
+            state["trial_started"] = None
+
+    def record_failure(self, model, error):
+        with self._lock:
+            state = self._state(model)
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            state["error_rate"] = (1 - self.ALPHA) * state["error_rate"] + self.ALPHA
+            state["last_error"] = error
+            state["trial_started"] = None
+            if state["circuit"] == "half_open" or state["consecutive_failures"] >= self.failure_threshold:
+                if state["circuit"] != "open":
+                    log_event("CIRCUIT OPEN", f"Model: {model}, Error: {error}", model=model)
+                state["circuit"] = "open"
+                state["opened_at"] = time.monotonic()
+
+    def record_hedge(self, model):
+        with self._lock:
+            self._state(model)["hedged"] += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                model: {
+                    "circuit": state["circuit"],
+                    "retry_in": round(max(0.0, state["opened_at"] + self.cooldown - now), 3) if state["circuit"] == "open" else 0.0,
+                    "consecutive_failures": state["consecutive_failures"],
+                    "error_rate": round(state["error_rate"], 4),
+                    "latency_ms": round(state["latency"] * 1000, 1) if state["latency"] is not None else None,
+                    "successes": state["successes"],
+                    "failures": state["failures"],
+                    "hedged": state["hedged"],
+                    "last_error": state["last_error"],
+                }
+                for model, state in self._models.items()
+            }
+
+model_router = ModelRouter(ROUTER_STRATEGY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN)
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_SIZE,
+    backend=SQLiteCacheBackend(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_PATH else None,
+)
+
+# Post templates
+# Built-in templates are always available. TEMPLATE_STORE_PATH adds more (replacing
+# built-ins of the same name) from a directory of JSON files or a SQLite database.
+# The store loads on first use and checks for changes at most every
+# TEMPLATE_RELOAD_INTERVAL seconds, so edits go live without a restart.
+TEMPLATE_STORE_PATH = os.getenv("TEMPLATE_STORE_PATH", "")
+TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "5"))
+TEMPLATE_PAGE_SIZE = 100
+TEMPLATE_MAX_PAGE_SIZE = 500
+TEMPLATE_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,100}$")
+
+BUILTIN_TEMPLATES = {
     "personal_story": {
+        "category": "story",
+        "tags": ["career", "failure", "lessons"],
         "hook": "I failed at X — and it turned out to be the best thing that happened to my career.",
         "body": "Context: [Describe the situation]\nMistake: [What went wrong]\nLesson: [What I learned]\nTakeaway: [Actionable advice]",
         "cta": "What's one mistake you learned from? I'll read and reply."
     },
     "mini_list": {
+        "category": "list",
+        "tags": ["growth", "tips"],
         "hook": "5 quick things that improved our onboarding conversion by 30%.",
         "body": "- Tip 1\n- Tip 2\n- Tip 3\n- Tip 4\n- Tip 5",
         "cta": "Want the template? DM me."
     },
     "results_breakdown": {
+        "category": "case-study",
+        "tags": ["metrics", "results"],
         "hook": "How we cut support tickets by 42% in 6 weeks.",
         "body": "Problem: [Describe issue]\nApproach: [What we did]\nMetrics: [Results]\nChart: [Suggestion for image]",
         "cta": "If you want the playbook, comment 'playbook'."
     },
     "opinion": {
+        "category": "opinion",
+        "tags": ["debate", "hot-take"],
         "hook": "Opinion: [Controversial statement].",
         "body": "Reason 1: [Explanation]\nReason 2: [Explanation]\nCounterpoint: [Address objection]",
         "cta": "Agree or disagree — what would you do differently?"
     }
 }
 
+def normalize_template(name, data):
+    """A template record with its ETag, or None if `data` is not a usable template."""
+    if not isinstance(data, dict):
+        return None
+    name = data.get("name", name)
+    if not isinstance(name, str) or not TEMPLATE_NAME_RE.match(name):
+        return None
+    fields = {key: data.get(key) for key in ("hook", "body", "cta")}
+    if not all(isinstance(value, str) for value in fields.values()):
+        return None
+    tags = data.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    record = {
+        "name": name,
+        "category": str(data.get("category") or "general").strip().lower(),
+        "tags": sorted({str(tag).strip().lower() for tag in tags if str(tag).strip()}),
+        **fields,
+    }
+    record["etag"] = hashlib.sha256(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+    return record
+
+class TemplateIndex:
+    """Read-only lookup structure over a set of template records.
+
+    Names are kept sorted, and each category and tag maps to the sorted names
+    carrying it, so filtered listings never scan the whole set. A new index is
+    built on every reload and swapped in whole; readers never see a partial one.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.names = sorted(records)
+        self.by_category = {}
+        self.by_tag = {}
+        for name in self.names:
+            record = records[name]
+            self.by_category.setdefault(record["category"], []).append(name)
+            for tag in record["tags"]:
+                self.by_tag.setdefault(tag, []).append(name)
+        self._sets = {}
+        digest = hashlib.sha256()
+        for name in self.names:
+            digest.update(f"{name}:{records[name]['etag']};".encode("utf-8"))
+        self.etag = digest.hexdigest()[:20]
+
+    def _members(self, key, names):
+        members = self._sets.get(key)
+        if members is None:
+            members = self._sets[key] = frozenset(names)
+        return members
+
+    def query(self, category=None, tags=(), q=None):
+        """Sorted names matching every given filter; `q` is a substring of the name or hook."""
+        postings = []
+        if category:
+            postings.append((("category", category), self.by_category.get(category, [])))
+        for tag in tags:
+            postings.append((("tag", tag), self.by_tag.get(tag, [])))
+        if not postings:
+            names = self.names
+        else:
+            # Walk the shortest posting list and probe the others
+            postings.sort(key=lambda posting: len(posting[1]))
+            (_, names), rest = postings[0], postings[1:]
+            if rest:
+                others = [self._members(key, other) for key, other in rest]
+                names = [name for name in names if all(name in members for members in others)]
+        if q:
+            q = q.lower()
+            names = [name for name in names
+                     if q in name.lower() or q in self.records[name]["hook"].lower()]
+        return names
+
+class FileTemplateSource:
+    """Templates from *.json files in a directory.
+
+    A file holds one template object (named after the file unless it has a
+    "name") or a list of them. Files are re-read only when their size or
+    modification time changes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}   # path -> ((mtime_ns, size), {name: record})
+        self._loaded = False
+
+    def refresh(self):
+        """All records, or None if no file was added, removed or changed since the last call."""
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json") and entry.is_file():
+                    stat = entry.stat()
+                    seen[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        changed = [path for path, signature in seen.items()
+                   if path not in self._files or self._files[path][0] != signature]
+        removed = [path for path in self._files if path not in seen]
+        if not changed and not removed and self._loaded:
+            return None
+        self._loaded = True
+        for path in removed:
+            del self._files[path]
+        for path in changed:
+            self._files[path] = (seen[path], self._read(path))
+        records = {}
+        for path in sorted(self._files):
+            records.update(self._files[path][1])
+        return records
+
+    def _read(self, path):
+        default_name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log_event("TEMPLATE ERROR", f"Could not read {path}: {str(e)}")
+            return {}
+        records = {}
+        for item in data if isinstance(data, list) else [data]:
+            record = normalize_template(default_name, item)
+            if record is None:
+                log_event("TEMPLATE ERROR", f"Skipping invalid template in {path}")
+                continue
+            records[record["name"]] = record
+        return records
+
+class SQLiteTemplateSource:
+    """Templates from a SQLite table, re-read when another connection commits a change."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS templates (name TEXT PRIMARY KEY, category TEXT, "
+                           "tags TEXT, hook TEXT NOT NULL, body TEXT NOT NULL, cta TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS templates_category ON templates (category)")
+        self._conn.commit()
+        self._version = None
+
+    def refresh(self):
+        with self._lock:
+            # data_version changes whenever another connection commits to the database
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version:
+                return None
+            rows = self._conn.execute("SELECT name, category, tags, hook, body, cta FROM templates").fetchall()
+            self._version = version
+        records = {}
+        for name, category, tags, hook, body, cta in rows:
+            try:
+                tags = json.loads(tags) if tags and tags.startswith("[") else tags
+            except ValueError:
+                pass
+            record = normalize_template(name, {"category": category, "tags": tags, "hook": hook, "body": body, "cta": cta})
+            if record is None:
+                log_event("TEMPLATE ERROR", f"Skipping invalid template {name!r} in {self.path}")
+                continue
+            records[record["name"]] = record
+        return records
+
+class TemplateStore:
+    """Built-in templates plus an optional source, indexed and reloaded on change."""
+
+    def __init__(self, source=None, reload_interval=TEMPLATE_RELOAD_INTERVAL):
+        self.source = source
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self._builtin = {name: normalize_template(name, data) for name, data in BUILTIN_TEMPLATES.items()}
+        self._index = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        # Background reloads get their own thread rather than a generation worker
+        self._reloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="templates")
+        self._reload = None
+
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._refresh()
+        elif self.source is not None and time.monotonic() - self._checked >= self.reload_interval:
+            # Checking thousands of files takes a while, so it runs in the background
+            # while requests keep using the current index; one reload at a time
+            self._checked = time.monotonic()
+            if self._reload is None or self._reload.done():
+                self._reload = self._reloader.submit(self.refresh)
+        return self._index
+
+    def refresh(self):
+        """Check the source for changes now and swap in a new index if there are any."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        self._checked = time.monotonic()
+        try:
+            records = self.source.refresh() if self.source is not None else {}
+        except (OSError, sqlite3.Error) as e:
+            log_event("TEMPLATE ERROR", f"Could not load templates: {str(e)}")
+            records = None if self._index is not None else {}
+        if records is None:
+            return
+        with timed("template_index"):
+            self._index = TemplateIndex({**self._builtin, **records})
+        self.reloads += 1
+
+    def get(self, name):
+        return self.index().records.get(name)
+
+    def stats(self):
+        index = self.index()
+        return {"templates": len(index.names), "categories": len(index.by_category),
+                "tags": len(index.by_tag), "reloads": self.reloads}
+
+def create_template_store():
+    if not TEMPLATE_STORE_PATH:
+        return TemplateStore()
+    if os.path.isdir(TEMPLATE_STORE_PATH):
+        return TemplateStore(FileTemplateSource(TEMPLATE_STORE_PATH))
+    return TemplateStore(SQLiteTemplateSource(TEMPLATE_STORE_PATH))
+
+template_store = create_template_store()
+
+class UsageTracker:
+    """Token usage of every upstream call made on behalf of one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.upstream_calls = 0
+        self.cache_hits = 0
+
+    def record(self, usage):
+        usage = usage or {}
+        with self._lock:
+            self.upstream_calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.cached_prompt_tokens += cached_prompt_tokens(usage)
+            self.completion_tokens += usage.get("completion_tokens") or 0
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "upstream_calls": self.upstream_calls,
+                "cache_hits": self.cache_hits,
+            }
+
+_usage_tracker = contextvars.ContextVar("usage_tracker", default=None)
+
+@contextmanager
+def track_usage():
+    """Collect token usage for upstream calls made inside the block (including via submit_task)."""
+    tracker = UsageTracker()
+    token = _usage_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _usage_tracker.reset(token)
+
+def record_usage(usage):
+    tracker = _usage_tracker.get()
+    if tracker is not None:
+        tracker.record(usage)
+
+def record_cache_hit():
+    tracker = _usage_tracker.get()
+    if tracker is not None:
+        tracker.record_cache_hit()
+
 def get_template(name):
-    return templates.get(name, None)
+    """The template's hook, body and call to action, or None if there is no such template."""
+    record = template_store.get(name)
+    if record is None:
+        return None
+    return {key: record[key] for key in ("hook", "body", "cta", "category", "tags")}
 
-def call_api(messages, max_tokens=600, temperature=0.7, max_retries=5):
-    """Call LLM API with retry logic for rate limits. Supports OpenRouter, Gemini, etc."""
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
+def api_headers():
+    """Request headers for the configured upstream. Raises if no API key is set."""
+    if not settings.api_key:
         raise ValueError("OPENROUTER_API_KEY environment variable not set")
+    return settings.headers
+
+def api_models():
+    """Models to try, in order of preference - configurable via the API_MODELS environment variable."""
+    return list(settings.models)
+
+class ModelCallError(Exception):
+    """A model in the fallback chain failed; the next one should be tried."""
 
-    api_url = API_BASE_URL
+def _call_model(model, messages, max_tokens, temperature, headers, max_retries, deadline, n=1):
+    """Call a single model with retries. Returns (content, usage) or raises ModelCallError.
 
-    # Base headers (work with all OpenAI-compatible APIs)
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
+    With n > 1 the upstream is asked for n completions and content is the list of
+    choices it returned - possibly fewer than n.
+    """
+    data = {
+        "model": model,
+        "messages": upstream_messages(model, messages),
+        "max_tokens": max_tokens,
+        "temperature": temperature
     }
+    if n > 1:
+        data["n"] = n
 
-    # Add OpenRouter-specific headers only if using OpenRouter
-    if "openrouter.ai" in api_url:
-        headers["HTTP-Referer"] = "https://linkedin-post-generator.vercel.app"
-        headers["X-Title"] = "LinkedIn Post Generator"
-
-    # Try models in order of preference - configurable via environment variable
-    # For OpenRouter: anthropic/claude-sonnet-4,google/gemini-2.0-flash-exp:free
-    # For Gemini: gemini-2.0-flash,gemini-1.5-flash
-    models_env = os.getenv("API_MODELS", "")
-    if models_env:
-        models = [m.strip() for m in models_env.split(",") if m.strip()]
-    else:
-        # Default to OpenRouter models
-        models = [
-            "anthropic/claude-sonnet-4",
-            "google/gemini-2.0-flash-exp:free",
-            "meta-llama/llama-3.2-3b-instruct:free"
-        ]
+    last_error = None
+    # Retry loop - waits for rate limits are scheduled by the shared limiter
+    for attempt in range(max_retries):
+        if not rate_limiter.acquire(model, deadline):
+            # The model is paused past our deadline - fail fast and try the next one
+            raise ModelCallError("Rate limit exceeded - please try again in a moment")
+        started = time.perf_counter()
+        try:
+            response = get_http_session().post(API_BASE_URL, headers=headers, json=data,
+                                         timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+            if response.status_code != 200:
+                record_upstream_attempt(model, response.status_code, time.perf_counter() - started, attempt)
+
+            # Rate limited - pause this model for every request, then retry
+            if response.status_code == 429:
+                rate_limiter.penalize(model, parse_retry_after(response.headers.get('Retry-After')))
+                last_error = "Rate limit exceeded - please try again in a moment"
+                continue
+
+            if response.status_code == 402:
+                # Payment required - try next model
+                raise ModelCallError("Credits exhausted")
+
+            # Check for other errors
+            if response.status_code >= 400:
+                error_detail = ""
+                try:
+                    error_json = response.json()
+                    error_detail = error_json.get("error", {}).get("message", str(error_json))
+                except:
+                    error_detail = response.text[:200]
+                log_event("API ERROR", f"Model: {model}, Status: {response.status_code}, Response: {error_detail}", model=model, status=response.status_code)
+                raise ModelCallError(f"API error {response.status_code}: {error_detail}")
+
+            response.raise_for_status()
+            rate_limiter.record_success(model)
+            result = response.json()
+            record_upstream_attempt(model, 200, time.perf_counter() - started, attempt, result.get("usage"))
+            if n > 1:
+                return [choice["message"]["content"] for choice in result["choices"]], result.get("usage")
+            return result["choices"][0]["message"]["content"], result.get("usage")
+
+        except requests.exceptions.RequestException as e:
+            # Network error, timeout, etc. - retry with backoff
+            record_upstream_attempt(model, "network_error", time.perf_counter() - started, attempt)
+            log_event("NETWORK ERROR", f"Model: {model}, Error: {str(e)}", model=model)
+            last_error = f"Request failed: {str(e)}"
+            wait_time = (2 ** attempt)
+            if attempt < max_retries - 1 and time.monotonic() + wait_time < deadline:
+                record_upstream_wait(model, "backoff", wait_time)
+                time.sleep(wait_time)
+                continue
+            break
+
+    raise ModelCallError(last_error)
+
+def _race(futures, deadline):
+    """Return (result, model) from the first future to succeed; raise the last error if all fail.
+
+    Gives up at `deadline` (monotonic) even if attempts are still running.
+    """
+    last_error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            raise ModelCallError("Timed out waiting for hedged attempts")
+        for future in done:
+            try:
+                return future.result(), futures[future]
+            except ModelCallError as e:
+                last_error = e
+    raise last_error
+
+def attempt_deadline(deadline):
+    """When an attempt started before the upstream `deadline` must have answered by."""
+    return deadline + HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT
+
+def _call_models(models, attempt, deadline):
+    """Try `attempt(model)` down the chain until one succeeds. Returns (result, model).
+
+    With hedging enabled, a model that has not answered after ROUTER_HEDGE_AFTER
+    seconds gets the next model raced against it; the first answer wins.
+    Attempts start before `deadline`, so the race stops waiting once the last of
+    them would have timed out.
+    """
+    last_error = ModelCallError("No models configured")
+    i = 0
+    while i < len(models):
+        model = models[i]
+        if ROUTER_HEDGE_AFTER > 0 and i + 1 < len(models):
+            primary = submit_task(attempt, model, pool=hedge_executor)
+            try:
+                return primary.result(timeout=ROUTER_HEDGE_AFTER), model
+            except FutureTimeoutError:
+                backup = models[i + 1]
+                model_router.record_hedge(model)
+                try:
+                    return _race({primary: model, submit_task(attempt, backup, pool=hedge_executor): backup},
+                                 attempt_deadline(deadline))
+                except ModelCallError as e:
+                    last_error = e
+                    i += 2
+                    continue
+            except ModelCallError as e:
+                last_error = e
+                i += 1
+                continue
+        try:
+            return attempt(model), model
+        except ModelCallError as e:
+            last_error = e
+            i += 1
+    raise last_error
+
+def call_api(messages, max_tokens=600, temperature=0.7, max_retries=5, endpoint=None):
+    """Call LLM API with retry logic for rate limits. Supports OpenRouter, Gemini, etc.
+
+    `endpoint` names the calling generator; it selects the response-cache rule.
+    Models are tried in the order chosen by the health-aware router.
+    """
+    headers = api_headers()
+    models = api_models()
+
+    # Serve identical requests from cache - any model in the chain may have answered before
+    cache_ttl = cache_ttl_for(endpoint)
+    if cache_ttl > 0:
+        cached = response_cache.lookup([cache_key(m, messages, max_tokens, temperature) for m in models])
+        if cached is not None:
+            record_cache_hit()
+            return cached
 
+    deadline = time.monotonic() + UPSTREAM_DEADLINE
+
+    def attempt(model):
+        started = time.monotonic()
+        try:
+            result = _call_model(model, messages, max_tokens, temperature, headers, max_retries, deadline)
+        except ModelCallError as e:
+            model_router.record_failure(model, str(e))
+            raise
+        model_router.record_success(model, time.monotonic() - started)
+        return result
+
+    try:
+        (content, usage), model = _call_models(model_router.order(models), attempt, deadline)
+    except ModelCallError as e:
+        raise ValueError(f"All models failed. {e}. Please check your API key and credits.")
+
+    record_usage(usage)
+    if cache_ttl > 0 and content:
+        response_cache.set(cache_key(model, messages, max_tokens, temperature), content, cache_ttl)
+    return content
+
+# Models that answered an `n` request with a single choice or rejected `n`, mapped to
+# when that is forgotten (monotonic); until then their samples are requested one call
+# each. Providers add support, so the mark expires and `n` is tried again.
+SINGLE_CHOICE_TTL = float(os.getenv("VARIANTS_SINGLE_CHOICE_TTL", "3600"))
+single_choice_models = {}
+# A 400 about the `n` parameter: "n must be 1", "Unsupported parameter: 'n'" ...
+N_PARAMETER_RE = re.compile(r"(?<![\w'-])['\"`]?n['\"`]?(?![\w'-])")
+
+def is_single_choice(model):
+    expires = single_choice_models.get(model)
+    if expires is None:
+        return False
+    if time.monotonic() < expires:
+        return True
+    single_choice_models.pop(model, None)
+    return False
+
+def _note_single_choice(model, returned):
+    if not is_single_choice(model):
+        single_choice_models[model] = time.monotonic() + SINGLE_CHOICE_TTL
+        log_event("VARIANTS", f"Model {model} returned {returned} choice(s) for n > 1; sampling it with separate calls",
+                  model=model)
+
+def n_rejected(error):
+    """Whether a ModelCallError is a 400 that names the `n` parameter."""
+    message = str(error)
+    return message.startswith("API error 400") and bool(N_PARAMETER_RE.search(message.partition(":")[2]))
+
+def call_api_n(messages, n, max_tokens=600, temperature=0.7, max_retries=5):
+    """`n` sampled completions of one prompt, as a list of up to n contents.
+
+    One request asks for all of them with the `n` parameter. If the chosen model
+    is known not to support it, or returns fewer choices, the missing samples are
+    requested concurrently with one call each. The response cache is bypassed:
+    every sample should be a new draft.
+    """
+    headers = api_headers()
+    models = model_router.order(api_models())
+    if not models or is_single_choice(models[0]):
+        return _call_api_each(messages, n, max_tokens, temperature, max_retries)
+
+    deadline = time.monotonic() + UPSTREAM_DEADLINE
+
+    def attempt(model):
+        started = time.monotonic()
+        try:
+            try:
+                result = _call_model(model, messages, max_tokens, temperature, headers, max_retries, deadline, n=n)
+            except ModelCallError as e:
+                if n_rejected(e):
+                    # Providers that don't accept `n` reject the whole request
+                    _note_single_choice(model, 0)
+                    return [], None
+                if not str(e).startswith("API error 400"):
+                    raise
+                # Some other 400: if the same request without `n` works, `n` was the problem
+                content, usage = _call_model(model, messages, max_tokens, temperature, headers, max_retries, deadline)
+                _note_single_choice(model, 0)
+                result = [content], usage
+        except ModelCallError as e:
+            model_router.record_failure(model, str(e))
+            raise
+        model_router.record_success(model, time.monotonic() - started)
+        return result
+
+    try:
+        (contents, usage), model = _call_models(models, attempt, deadline)
+    except ModelCallError as e:
+        raise ValueError(f"All models failed. {e}. Please check your API key and credits.")
+
+    if usage is not None:
+        record_usage(usage)
+    contents = [content for content in contents if content]
+    if len(contents) < n:
+        if contents:
+            _note_single_choice(model, len(contents))
+        contents += _call_api_each(messages, n - len(contents), max_tokens, temperature, max_retries)
+    return contents
+
+def _call_api_each(messages, n, max_tokens, temperature, max_retries):
+    """`n` concurrent single-completion calls; failed ones are left out unless all fail."""
+    futures = [submit_task(call_api, messages, max_tokens, temperature, max_retries, pool=variant_executor)
+               for _ in range(n)]
+    contents, last_error = [], None
+    for future in futures:
+        try:
+            contents.append(future.result())
+        except ValueError as e:
+            last_error = e
+    if not contents:
+        raise last_error
+    return contents
+
+def stream_api(messages, max_tokens=600, temperature=0.7, endpoint=None):
+    """Stream completion text from the upstream, yielding deltas as they arrive.
+
+    Models are tried in order until one starts streaming. A cached response is
+    yielded as a single delta. The complete text is cached once the stream ends.
+    """
+    headers = api_headers()
+    models = api_models()
+
+    cache_ttl = cache_ttl_for(endpoint)
+    if cache_ttl > 0:
+        cached = response_cache.lookup([cache_key(m, messages, max_tokens, temperature) for m in models])
+        if cached is not None:
+            record_cache_hit()
+            yield cached
+            return
+
+    deadline = time.monotonic() + UPSTREAM_DEADLINE
     last_error = None
-    for model in models:
+    for model in model_router.order(models):
         data = {
             "model": model,
-            "messages": messages,
+            "messages": upstream_messages(model, messages),
             "max_tokens": max_tokens,
-            "temperature": temperature
+            "temperature": temperature,
+            "stream": True,
+            # OpenAI-style providers only report usage on a stream when asked
+            "stream_options": {"include_usage": True}
         }
-
-        # Retry logic with exponential backoff for rate limits
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(api_url, headers=headers, json=data)
-
-                # Handle rate limiting with exponential backoff
+        if not rate_limiter.acquire(model, deadline):
+            last_error = "Rate limit exceeded - please try again in a moment"
+            model_router.record_failure(model, last_error)
+            continue
+        started = time.monotonic()
+        parts = []
+        usage = None
+        try:
+            with get_http_session().post(API_BASE_URL, headers=headers, json=data, stream=True,
+                                   timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)) as response:
+                if response.status_code != 200:
+                    record_upstream_attempt(model, response.status_code, time.monotonic() - started)
                 if response.status_code == 429:
-                    if attempt < max_retries - 1:
-                        # Exponential backoff: 1s, 2s, 4s, 8s, 16s
-                        wait_time = (2 ** attempt)
-                        # Check for Retry-After header
-                        retry_after = response.headers.get('Retry-After')
-                        if retry_after:
-                            try:
-                                wait_time = max(wait_time, int(retry_after))
-                            except ValueError:
-                                pass
-                        time.sleep(wait_time)
+                    rate_limiter.penalize(model, parse_retry_after(response.headers.get('Retry-After')))
+                    last_error = "Rate limit exceeded - please try again in a moment"
+                    model_router.record_failure(model, last_error)
+                    continue
+                if response.status_code >= 400:
+                    last_error = f"API error {response.status_code}: {response.text[:200]}"
+                    log_event("API ERROR", f"Model: {model}, Status: {response.status_code}, Response: {response.text[:200]}", model=model, status=response.status_code)
+                    model_router.record_failure(model, last_error)
+                    continue
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    # Server-Sent Events: "data: {json}" lines, comments start with ":"
+                    if not line or not line.startswith("data:"):
                         continue
-                    else:
-                        last_error = "Rate limit exceeded - please try again in a moment"
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
                         break
+                    try:
+                        chunk = json.loads(payload)
+                    except ValueError:
+                        continue
+                    # Providers that report usage on a stream send it with the last chunk
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    choices = chunk.get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except requests.exceptions.RequestException as e:
+            record_upstream_attempt(model, "network_error", time.monotonic() - started)
+            log_event("NETWORK ERROR", f"Model: {model}, Error: {str(e)}", model=model)
+            model_router.record_failure(model, f"Request failed: {str(e)}")
+            if parts:
+                raise ValueError(f"Stream interrupted: {str(e)}")
+            last_error = f"Request failed: {str(e)}"
+            continue
 
-                if response.status_code == 402:
-                    # Payment required - try next model
-                    last_error = "Credits exhausted"
-                    break
+        record_usage(usage)
+        record_upstream_attempt(model, 200, time.monotonic() - started, usage=usage)
+        content = "".join(parts)
+        if content:
+            model_router.record_success(model, time.monotonic() - started)
+            if cache_ttl > 0:
+                response_cache.set(cache_key(model, messages, max_tokens, temperature), content, cache_ttl)
+            return
+        last_error = "Empty response"
+        model_router.record_failure(model, last_error)
 
-                # Check for other errors
-                if response.status_code >= 400:
-                    error_detail = ""
-                    try:
-                        error_json = response.json()
-                        error_detail = error_json.get("error", {}).get("message", str(error_json))
-                    except:
-                        error_detail = response.text[:200]
-                    last_error = f"API error {response.status_code}: {error_detail}"
-                    print(f"[API ERROR] Model: {model}, Status: {response.status_code}, Response: {error_detail}")
-                    break
-
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
+    raise ValueError(f"All models failed. {last_error}. Please check your API key and credits.")
 
-            except requests.exceptions.RequestException as e:
-                # Network error, timeout, etc. - retry with backoff
-                print(f"[NETWORK ERROR] Model: {model}, Error: {str(e)}")
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt)
-                    time.sleep(wait_time)
-                    continue
-                last_error = f"Request failed: {str(e)}"
-                break
+# Prompt prefixes
+# Every generator opens with a constant system prompt. Each is built once as a
+# prefix block: the plain system message, and a variant with a cache_control
+# breakpoint for providers that only cache prompts marked that way (Anthropic
+# models, also through OpenRouter). Providers with automatic prefix caching
+# (OpenAI, DeepSeek, ...) get the plain message, which is identical on every call.
+# PROMPT_STYLE=compact swaps in shorter prompts with the same rules.
+PROMPT_STYLE = "compact" if os.getenv("PROMPT_STYLE", "full") == "compact" else "full"
+# Model-name fragments that get cache_control markers; empty disables them
+PROMPT_CACHE_HINTS = tuple(p.strip().lower() for p in os.getenv("PROMPT_CACHE_HINTS", "anthropic/,claude").split(",") if p.strip())
 
-        # If we got a successful response, we would have returned already
-        # If we're here, try the next model
-        if last_error != "Credits exhausted" and last_error != "Rate limit exceeded":
-            continue
+class PromptPrefix:
+    """A generator's system prompt in both styles, with its messages built once.
 
-    raise ValueError(f"All models failed. {last_error}. Please check your API key and credits.")
+    Callers must not modify the returned message dicts; they are shared.
+    """
 
-def generate_linkedin_post(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
-    system_prompt = """You are an expert LinkedIn content creator. Generate posts that are IMMEDIATELY COPY-PASTE READY for LinkedIn.
+    def __init__(self, name, full, compact):
+        self.name = name
+        self.texts = {"full": full, "compact": compact}
+        self._messages = {style: {"role": "system", "content": text} for style, text in self.texts.items()}
+        for text in self.texts.values():
+            _cached_prefix_messages[text] = {"role": "system", "content": [
+                {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}},
+            ]}
+
+    def message(self):
+        return self._messages[PROMPT_STYLE]
+
+_cached_prefix_messages = {}
+
+def wants_cache_hints(model):
+    model = model.lower()
+    return any(fragment in model for fragment in PROMPT_CACHE_HINTS)
+
+def upstream_messages(model, messages):
+    """`messages` as sent to `model`: a known system prefix gets its cache_control variant where that helps."""
+    if not messages or not PROMPT_CACHE_HINTS or not wants_cache_hints(model):
+        return messages
+    content = messages[0].get("content")
+    cached = _cached_prefix_messages.get(content) if isinstance(content, str) else None
+    return [cached, *messages[1:]] if cached is not None else messages
+
+def cached_prompt_tokens(usage):
+    """Prompt tokens served from the provider's cache (OpenAI-style details, or DeepSeek's field)."""
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+
+class PromptTokenStats:
+    """Prompt tokens per model, split into cached and uncached, as reported by the upstream."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, usage):
+        prompt = usage.get("prompt_tokens") or 0
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            counts = self._models.setdefault(model, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            counts["calls"] += 1
+            counts["prompt_tokens"] += prompt
+            counts["cached_tokens"] += cached
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: dict(counts,
+                            uncached_tokens=counts["prompt_tokens"] - counts["cached_tokens"],
+                            cached_ratio=round(counts["cached_tokens"] / counts["prompt_tokens"], 4) if counts["prompt_tokens"] else 0.0)
+                for model, counts in self._models.items()
+            }
+
+prompt_token_stats = PromptTokenStats()
+
+POST_SYSTEM_PROMPT = """You are an expert LinkedIn content creator. Generate posts that are IMMEDIATELY COPY-PASTE READY for LinkedIn.
 
 CRITICAL FORMATTING RULES:
 1. NO markdown formatting (no **, no #, no ---, no headers)
@@ -171,6 +1644,15 @@ STRUCTURE:
 
 Output ONLY the post content. Nothing else."""
 
+POST_COMPACT_PROMPT = """You are an expert LinkedIn content creator. Write a post that is ready to paste as is.
+No markdown, labels, word counts or introductions.
+Short paragraphs separated by blank lines; 1-3 emojis; → • ✓ for bullets.
+Hook in the first 140 characters, then the body, a call-to-action question, and 3-5 hashtags at the very end.
+Output only the post."""
+
+POST_PROMPT = PromptPrefix("post", POST_SYSTEM_PROMPT, POST_COMPACT_PROMPT)
+
+def post_messages(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
     user_prompt = f"""Write a LinkedIn post about: {topic}
 
 Target audience: {audience}
@@ -182,26 +1664,282 @@ Call-to-action: {cta}
 
 Remember: Output ONLY the ready-to-paste post content."""
 
+    return [
+        POST_PROMPT.message(),
+        {"role": "user", "content": user_prompt},
+    ]
+
+# Output post-processing
+# Model output is normalized by one precompiled pipeline per output type. The
+# generators, combined mode and the streaming endpoint all use it, so a given messy
+# response is cleaned the same way whichever path produced it.
+# This is a correctness change, not a speed-up: the old per-generator prefix strips
+# were cheaper (bench_postprocess.py: about 2.5us vs 5us per post, 3.5us vs 7us per
+# hook list) but left artifacts behind. Lines that cannot be rewritten skip the
+# regexes, so the gap is a few microseconds per output, next to an upstream call of
+# hundreds of milliseconds.
+
+# "Here's your LinkedIn post about X:", "LinkedIn Post:", "**Draft 2:**" ...
+POST_LEAD_IN_RE = re.compile(r"""
+    ^[*_"\s]*
+    (?:
+        (?:
+            here(?:'s|’s|[ \t]+is)\b[^\n:]{0,80}?\b(?:post|draft|version)s?\b[^\n:]{0,40}?(?::|[.!]?(?=[*_"\s]*\n))
+          | (?:linkedin[ \t]+)?(?:post|draft)(?:[ \t]*\#?\d+)?[ \t]*:
+        )
+        [*_" \t]*
+    )+
+""", re.IGNORECASE | re.VERBOSE)
+POST_LEAD_IN_STARTS = ("here's", "here’s", "here is", "linkedin post", "post", "draft")
+POST_SPACES_RE = re.compile(r"[ \t]+")
+POST_DROP_LINE_RE = re.compile(r"""
+    ^(?:
+        [-*_=]{3,}                                                  # horizontal rules
+      | [\[(]?\s*(?:word|character)\s*count\b.*                     # (Word count: 180)
+      | [\[(]?\s*\d+\s+(?:words|characters)\s*[\])]?\.?             # 180 words
+    )$
+""", re.IGNORECASE | re.VERBOSE)
+POST_HEADER_RE = re.compile(r"^#{1,6}(?:\s+|$)")
+# Header and bullet in one pass: "## - point" -> "• point"
+POST_LINE_PREFIX_RE = re.compile(r"^(?:#{1,6}(?:\s+|$))?([-*+]\s+)?")
+# Only lines starting with one of these, a digit or "word"/"char" can be dropped or rewritten;
+# the rest skip the regexes
+POST_REWRITE_CHARS = frozenset("-*_=#+[(")
+# While streaming, lines that start like something above are held back until they are complete
+POST_HOLD_LINE_CHARS = "-*_=#+[(0123456789"
+POST_HOLD_LINE_WORDS = ("word count", "wordcount", "character count", "charactercount")
+
+HOOK_PREFIX_RE = re.compile(r"""
+    ^(?:
+        (?:hook\s*)?\(?\d{1,3}\s*(?:[.):\]](?!\d)|[-–—](?=\s))\s*   # 1. 12) (3) Hook 4: 5 - (not 1.5 or 5-minute)
+      | [-*+•·–—>]\s*                            # bullets and quote markers
+    )
+""", re.IGNORECASE | re.VERBOSE)
+HOOK_PREFIX_CHARS = frozenset("(hH-*+•·–—>")
+HOOK_LEAD_IN_RE = re.compile(r"^(?:here\s+(?:are|is)\b.*|[\w\s-]{0,40}\bhooks?\s*:)$", re.IGNORECASE)
+WRAPPING_QUOTES_RE = re.compile(r'^(["“”\'])(.*)(["“”\'])$')
+QUOTE_CHARS = frozenset('"“”\'')
+
+HASHTAG_RE = re.compile(r"#(\w*[^\W\d]\w*)")
+DEFAULT_HASHTAGS = ["#LinkedIn", "#Networking", "#CareerGrowth"]
+
+SLIDE_HEADER_RE = re.compile(r"^[*_#\s]*slide\s*(\d{1,2})(?:\s*/\s*\d{1,2})?\s*[:.)\-–—]?[*_\s]*(.*?)[*_\s]*$", re.IGNORECASE)
+SLIDE_POINT_RE = re.compile(r"^(?:[-*+•·→✓]|\d{1,2}[.)](?!\d))\s*")
+SLIDE_POINT_CHARS = frozenset("-*+•·→✓")
+SLIDE_TITLE_LABEL_RE = re.compile(r"^(?:title|headline)\s*:\s*", re.IGNORECASE)
+
+class PostStreamCleaner:
+    """Incremental version of normalize_post for a streamed post.
+
+    The concatenated output is exactly what normalize_post returns for the
+    whole text. Ordinary prose is released as it arrives; only the start of
+    the stream and lines that begin like something the pipeline rewrites are
+    held until they can be decided.
+    """
+    HOLD_CHARS = 200
+
+    def __init__(self):
+        self._buffer = ""
+        self._lead_in_done = False
+        self._line_emitted = None   # normalized chars of the current line already released
+        self._has_content = False
+        self._blank_pending = False
+
+    def _lead_in_decided(self):
+        head = self._buffer[:self.HOLD_CHARS + 16].lstrip(' \t\r\n*_"').lower()
+        if not head:
+            return False
+        flat = POST_SPACES_RE.sub(" ", head)
+        if not any(flat.startswith(start) or start.startswith(flat) for start in POST_LEAD_IN_STARTS):
+            return True
+        return "\n" in head or len(head) >= self.HOLD_CHARS
+
+    def _separator(self):
+        if not self._has_content:
+            self._has_content = True
+            return ""
+        separator = "\n\n" if self._blank_pending else "\n"
+        self._blank_pending = False
+        return separator
+
+    def _complete_line(self, line):
+        line = line.strip()
+        emitted, self._line_emitted = self._line_emitted, None
+        if emitted is not None:
+            return line.replace("**", "").strip()[emitted:]
+        if not line:
+            self._blank_pending = self._has_content
+            return ""
+        line = clean_post_line(line)
+        return self._separator() + line if line else ""
+
+    def _partial_line(self):
+        text = self._buffer.lstrip()
+        if self._line_emitted is None:
+            if not text or text[0] in POST_HOLD_LINE_CHARS:
+                return ""
+            head = text[:16].lower()
+            if any(word.startswith(head) or head.startswith(word) for word in POST_HOLD_LINE_WORDS):
+                return ""
+            self._line_emitted = 0
+            prefix = self._separator()
+        else:
+            prefix = ""
+        # Trailing spaces and asterisks may still turn into a line end or a bold marker
+        safe = text.rstrip(" \t\r*").replace("**", "")
+        released, self._line_emitted = safe[self._line_emitted:], max(self._line_emitted, len(safe))
+        return prefix + released
+
+    def _strip_lead_in(self):
+        self._buffer = POST_LEAD_IN_RE.sub("", self._buffer, count=1)
+        self._lead_in_done = True
+
+    def _complete_lines(self):
+        if "\n" not in self._buffer:
+            return ""
+        *lines, self._buffer = self._buffer.split("\n")
+        return "".join(self._complete_line(line) for line in lines)
+
+    def feed(self, delta):
+        self._buffer += delta
+        if not self._lead_in_done:
+            if not self._lead_in_decided():
+                return ""
+            self._strip_lead_in()
+        return self._complete_lines() + self._partial_line()
+
+    def finish(self):
+        if not self._lead_in_done:
+            self._strip_lead_in()
+        out = self._complete_lines()
+        text, self._buffer = self._buffer, ""
+        return out + self._complete_line(text)
+
+def clean_post_line(line):
+    """A stripped, non-empty post line after the line rules; "" if it is dropped."""
+    if line[0] in POST_REWRITE_CHARS or line[0].isdigit() or line[:4].lower() in ("word", "char"):
+        if POST_DROP_LINE_RE.match(line):
+            return ""
+        prefix = POST_LINE_PREFIX_RE.match(line)
+        if prefix.end():
+            line = ("• " if prefix.group(1) else "") + line[prefix.end():]
+    if "**" in line:
+        line = line.replace("**", "")
+    return line.strip()
+
+def normalize_post(text):
+    """Clean a generated post line by line.
+
+    Lead-ins such as "Here's your post:" are removed, markdown headers, rules
+    and word counts are dropped, "- " bullets become "•", bold markers are
+    removed and blank-line runs are collapsed.
+    """
+    lines = []
+    blank = False
+    for line in POST_LEAD_IN_RE.sub("", text or "", count=1).split("\n"):
+        line = line.strip()
+        if not line:
+            blank = bool(lines)
+            continue
+        line = clean_post_line(line)
+        if line:
+            if blank:
+                lines.append("")
+                blank = False
+            lines.append(line)
+    return "\n".join(lines)
+
+def normalize_hooks(lines, limit=None):
+    """Hook lines without numbering, bullets, wrapping quotes, lead-ins or duplicates."""
+    hooks = []
+    seen = set()
+    for line in lines:
+        hook = line.strip()
+        if "**" in hook:
+            hook = hook.replace("**", "")
+        if hook[:1] in HOOK_PREFIX_CHARS or hook[:1].isdigit():
+            hook = HOOK_PREFIX_RE.sub("", hook)
+        hook = hook.strip()
+        if not hook:
+            continue
+        if hook[0] in QUOTE_CHARS:
+            quoted = WRAPPING_QUOTES_RE.match(hook)
+            if quoted:
+                hook = quoted.group(2).strip()
+                if not hook:
+                    continue
+        if (hook[-1] == ":" or hook[:4].lower() == "here") and HOOK_LEAD_IN_RE.match(hook):
+            continue
+        if hook.lower() in seen:
+            continue
+        seen.add(hook.lower())
+        hooks.append(hook)
+        if limit is not None and len(hooks) == limit:
+            break
+    return hooks
+
+def extract_hashtags(text, limit=7):
+    """Unique hashtags in order of appearance (tags that are only digits, like #1, are skipped)."""
+    tags = []
+    seen = set()
+    for tag in HASHTAG_RE.findall(text or ""):
+        if tag.lower() not in seen:
+            seen.add(tag.lower())
+            tags.append("#" + tag)
+            if len(tags) == limit:
+                break
+    return tags
+
+def parse_carousel(text):
+    """Split carousel output into [{"number", "title", "points"}].
+
+    Slides are introduced by "SLIDE n:" headers (in any case, with markdown
+    decoration); text before the first header is ignored. Output without any
+    headers, including error messages, gives an empty list.
+    """
+    slides = []
+    current = None
+    for raw in (text or "").split("\n"):
+        header = SLIDE_HEADER_RE.match(raw)
+        if header:
+            current = {"title": "", "points": []}
+            slides.append(current)
+            line = header.group(2).replace("**", "").strip()
+        else:
+            line = raw.strip()
+            if "**" in line:
+                line = line.replace("**", "")
+        if not line or current is None:
+            continue
+        point = (line[0] in SLIDE_POINT_CHARS or line[0].isdigit()) and SLIDE_POINT_RE.match(line)
+        if point:
+            current["points"].append(line[point.end():].strip())
+        elif not current["title"]:
+            current["title"] = SLIDE_TITLE_LABEL_RE.sub("", POST_HEADER_RE.sub("", line)).strip()
+        else:
+            current["points"].append(line)
+    slides = [slide for slide in slides if slide["title"] or slide["points"]]
+    return [{"number": number, **slide} for number, slide in enumerate(slides, 1)]
+
+def render_carousel(slides):
+    return "\n\n".join(
+        "\n".join([f"SLIDE {slide['number']}: {slide['title']}".rstrip()] + ["• " + point for point in slide["points"]])
+        for slide in slides
+    )
+
+@timed_stage("post_cleanup")
+def finish_post(post):
+    return normalize_post(post) or "Error: No content generated."
+
+@timed_stage("post")
+def generate_linkedin_post(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-        post = call_api(messages, max_tokens=600, temperature=0.7)
-        if post:
-            post = post.strip()
-            unwanted_prefixes = ["Here's", "Here is", "LinkedIn Post:", "Post:", "Draft:"]
-            for prefix in unwanted_prefixes:
-                if post.lower().startswith(prefix.lower()):
-                    post = post[len(prefix):].strip()
-                    if post.startswith(":"):
-                        post = post[1:].strip()
-        return post if post else "Error: No content generated."
+        messages = post_messages(topic, audience, goal, tone, length, keywords, cta)
+        return finish_post(call_api(messages, max_tokens=600, temperature=0.7, endpoint="post"))
     except Exception as e:
         return f"Error generating post: {str(e)}"
 
-def generate_hooks(topic, num=5):
-    system_prompt = """You are a LinkedIn hook specialist. Generate attention-grabbing opening lines.
+HOOKS_SYSTEM_PROMPT = """You are a LinkedIn hook specialist. Generate attention-grabbing opening lines.
 
 RULES:
 - Each hook must be under 140 characters (LinkedIn "See more" cutoff)
@@ -214,37 +1952,528 @@ RULES:
 
 Output ONLY the hooks, one per line. Nothing else."""
 
+HOOKS_COMPACT_PROMPT = """You are a LinkedIn hook specialist. Write opening lines, one per line, each under 140 characters.
+No numbering, quotation marks or markdown. Punchy, curious or contrarian; mix questions, bold statements, statistics and stories.
+Output only the hooks."""
+
+HOOKS_PROMPT = PromptPrefix("hooks", HOOKS_SYSTEM_PROMPT, HOOKS_COMPACT_PROMPT)
+
+def hooks_messages(topic, num=5):
     user_prompt = f"Generate {num} scroll-stopping hooks for a LinkedIn post about: {topic}"
 
+    return [
+        HOOKS_PROMPT.message(),
+        {"role": "user", "content": user_prompt},
+    ]
+
+@timed_stage("hooks_cleanup")
+def finish_hooks(content, num=5):
+    hooks = normalize_hooks((content or "").split('\n'), num)
+    return hooks if hooks else ["Hook generation failed."]
+
+@timed_stage("hooks")
+def generate_hooks(topic, num=5):
+    hooks = similar_topics.find("hooks", topic, num)
+    if hooks is not None:
+        return hooks
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-        content = call_api(messages, max_tokens=1300, temperature=0.8)
-        if content:
-            hooks = content.strip().split('\n')
-            cleaned_hooks = []
-            for h in hooks:
-                h = h.strip()
-                if h and len(h) > 2:
-                    if h[0].isdigit() and h[1] in '.):':
-                        h = h[2:].strip()
-                    elif h[0].isdigit() and h[1].isdigit() and h[2] in '.):':
-                        h = h[3:].strip()
-                if h.startswith('-') or h.startswith('•'):
-                    h = h[1:].strip()
-                if h.startswith('"') and h.endswith('"'):
-                    h = h[1:-1]
-                if h:
-                    cleaned_hooks.append(h)
-            return cleaned_hooks[:num] if cleaned_hooks else ["Hook generation failed."]
-        return ["Hook generation failed."]
+        content = call_api(hooks_messages(topic, num), max_tokens=1300, temperature=0.8, endpoint="hooks")
+        hooks = finish_hooks(content, num)
+        if hooks != ["Hook generation failed."]:
+            similar_topics.add("hooks", topic, hooks, num)
+        return hooks
     except Exception as e:
         return [f"Error generating hooks: {str(e)}"]
 
-def suggest_hashtags(topic):
-    system_prompt = """You are a LinkedIn hashtag strategist. Generate relevant, high-engagement hashtags.
+# Hashtag engine
+# Hashtags for common topics come from a local index instead of an upstream call.
+# The index maps topic terms (words and two-word phrases) to weighted hashtags. It
+# is built from the bundled corpus plus hashtags the model suggested before, written
+# to HASHTAG_INDEX_PATH in a compact binary format and memory-mapped, so a lookup is
+# a handful of binary searches. Topics the index isn't confident about still go to
+# the model, and its answer is learned for next time.
+# HASHTAG_ENGINE: "auto" (index first, model on low confidence), "local" (index only) or "llm"
+HASHTAG_ENGINE = os.getenv("HASHTAG_ENGINE", "auto")
+HASHTAG_CORPUS_PATH = os.getenv("HASHTAG_CORPUS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashtag_corpus.json"))
+# Empty = a file in the temp directory (the only writable place on Vercel); rebuilt when the sources change
+HASHTAG_INDEX_PATH = os.getenv("HASHTAG_INDEX_PATH", "")
+# JSONL file the model's hashtags are appended to and indexed from; empty = remembered in memory only
+HASHTAG_LEARNED_PATH = os.getenv("HASHTAG_LEARNED_PATH", "")
+# Share of the topic's words (weighted by rarity) the index must know to answer without the model
+HASHTAG_MIN_CONFIDENCE = float(os.getenv("HASHTAG_MIN_CONFIDENCE", "0.6"))
+HASHTAG_INDEX_FORMAT = b"LHI1"
+HASHTAG_HEADER = struct.Struct("=4s?3x16sIIId4x")
+HASHTAG_MAX_POSTINGS = 32
+HASHTAG_LEARNED_MAX = 10000
+HASHTAG_WORD_RE = re.compile(r"[a-z0-9]+")
+HASHTAG_STOPWORDS = frozenset("""
+a about actually after again all also always an and any are as at be because been before being best better between
+big both but by can could did do does doing don during each even every ever few for from get gets getting
+go going good great had has have how i if in into is it its just keep know learned like look looks lot make makes
+making many may me mean means more most much must my need needs never no not nothing now of off on only or other
+our out over own really same say see should since so some still take taught tell than that the their them then there
+these they thing things think this those through to too top under up us use using very vs versus want was
+way ways we well were what when where which while who why will with without work works would year years yet you your
+""".split())
+NUMBER_VALUES = {word: value for value, word in enumerate("one two three four five six seven eight nine ten".split(), 1)}
+NUMBER_WORDS = frozenset(NUMBER_VALUES)
+
+def topic_words(text, stopwords=HASHTAG_STOPWORDS):
+    """Lowercased words of a text without stopwords, plurals reduced to the singular. Numbers are kept."""
+    words = []
+    for word in HASHTAG_WORD_RE.findall(text.lower()):
+        if word in stopwords or (len(word) < 2 and not word.isdigit()):
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+def hashtag_terms(text):
+    """Index keys for a text: its words except numbers, and phrases of two or three adjacent words."""
+    words = [word for word in topic_words(text) if not word.isdigit() and word not in NUMBER_WORDS]
+    phrases = [" ".join(words[i:i + n]) for n in (2, 3) for i in range(len(words) - n + 1)]
+    return words, phrases
+
+def _hashtag_key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _hashtag_rank_weight(rank):
+    return 1.0 / (1.0 + 0.3 * rank)
+
+def hashtag_sources_signature(corpus_path, learned_path):
+    """Changes whenever the corpus or the learned file does, so a stale index is rebuilt."""
+    digest = hashlib.blake2b(HASHTAG_INDEX_FORMAT, digest_size=16)
+    for path in (corpus_path, learned_path):
+        try:
+            st = os.stat(path)
+            digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+        except OSError:
+            digest.update(f"{path}:-;".encode("utf-8"))
+    return digest.digest()
+
+def _hashtag_documents(corpus_path, learned_path):
+    """(index keys, ranked hashtags) for every corpus cluster and learned topic."""
+    documents = []
+    with open(corpus_path, encoding="utf-8") as f:
+        for cluster in json.load(f)["clusters"]:
+            keys = set()
+            for term in cluster["terms"]:
+                # A multi-word term matches as a phrase only ("time management" says nothing about "time")
+                words, _ = hashtag_terms(term)
+                if 0 < len(words) <= 3:
+                    keys.add(" ".join(words))
+            documents.append((keys, extract_hashtags(" ".join(cluster["hashtags"]), limit=None)))
+    if learned_path and os.path.exists(learned_path):
+        with open(learned_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    words, phrases = hashtag_terms(entry["topic"])
+                    tags = extract_hashtags(" ".join(entry["hashtags"]))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+                if words and tags:
+                    documents.append((set(words).union(phrases), tags))
+    return documents
+
+def build_hashtag_index(corpus_path, learned_path, path, signature):
+    """Write the index file for the given sources to `path` (atomically). Returns its sizes.
+
+    Layout after the header: sorted 64-bit key hashes, postings offsets and idf
+    per key, then (hashtag id, weight) postings, then the hashtag strings.
+    """
+    documents = _hashtag_documents(corpus_path, learned_path)
+    frequency = {}
+    for keys, _ in documents:
+        for key in keys:
+            frequency[key] = frequency.get(key, 0) + 1
+
+    tag_ids, tags, postings = {}, [], {}
+    for keys, ranked in documents:
+        for rank, tag in enumerate(ranked):
+            tag_id = tag_ids.get(tag.lower())
+            if tag_id is None:
+                tag_id = tag_ids[tag.lower()] = len(tags)
+                tags.append(tag)
+            weight = _hashtag_rank_weight(rank)
+            for key in keys:
+                bucket = postings.setdefault(key, {})
+                bucket[tag_id] = bucket.get(tag_id, 0.0) + weight
+
+    hashes, offsets, idfs = array("Q"), array("I", [0]), array("f")
+    post_tags, post_weights = array("I"), array("f")
+    for key_hash, key in sorted((_hashtag_key_hash(key), key) for key in postings):
+        best = sorted(postings[key].items(), key=lambda item: -item[1])[:HASHTAG_MAX_POSTINGS]
+        hashes.append(key_hash)
+        idfs.append(math.log(1 + len(documents) / frequency[key]))
+        post_tags.extend(tag_id for tag_id, _ in best)
+        post_weights.extend(weight for _, weight in best)
+        offsets.append(len(post_tags))
+    encoded = [tag.encode("utf-8") for tag in tags]
+    tag_offsets = array("I", [0])
+    for data in encoded:
+        tag_offsets.append(tag_offsets[-1] + len(data))
+
+    header = HASHTAG_HEADER.pack(HASHTAG_INDEX_FORMAT, sys.byteorder == "little", signature, len(hashes),
+                                 len(tags), len(post_tags), math.log(1 + len(documents)))
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for section in (hashes, offsets, idfs, post_tags, post_weights, tag_offsets):
+            f.write(section.tobytes())
+        f.write(b"".join(encoded))
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return {"documents": len(documents), "terms": len(hashes), "hashtags": len(tags),
+            "postings": len(post_tags), "bytes": size}
+
+class HashtagIndex:
+    """An index file, memory-mapped and read in place."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, little, self.signature, terms, tags, postings, self.max_idf = HASHTAG_HEADER.unpack_from(view)
+        if magic != HASHTAG_INDEX_FORMAT or little != (sys.byteorder == "little"):
+            raise ValueError(f"{path} is not a hashtag index for this platform")
+        offset = HASHTAG_HEADER.size
+        sections = []
+        for fmt, count in (("Q", terms), ("I", terms + 1), ("f", terms), ("I", postings), ("f", postings), ("I", tags + 1)):
+            size = struct.calcsize(fmt) * count
+            sections.append(view[offset:offset + size].cast(fmt))
+            offset += size
+        self.hashes, self.offsets, self.idf, self.post_tags, self.post_weights, tag_offsets = sections
+        blob = view[offset:]
+        self.tags = tuple(str(blob[tag_offsets[i]:tag_offsets[i + 1]], "utf-8") for i in range(tags))
+        self.size = len(self._mmap)
+
+    def postings(self, key):
+        """(idf, [(hashtag id, weight), ...]) for an index key, or None if it isn't indexed."""
+        key_hash = _hashtag_key_hash(key)
+        i = bisect.bisect_left(self.hashes, key_hash)
+        if i == len(self.hashes) or self.hashes[i] != key_hash:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.idf[i], zip(self.post_tags[start:end], self.post_weights[start:end])
+
+class HashtagEngine:
+    """Hashtag suggestions from the local index and from what the model taught it since startup."""
+
+    def __init__(self, corpus_path=HASHTAG_CORPUS_PATH, index_path=HASHTAG_INDEX_PATH,
+                 learned_path=HASHTAG_LEARNED_PATH, mode=HASHTAG_ENGINE, min_confidence=HASHTAG_MIN_CONFIDENCE):
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self.learned_path = learned_path
+        self.mode = mode
+        self.min_confidence = min_confidence
+        self.answered = 0
+        self.deferred = 0
+        self.learned = 0
+        self.builds = 0
+        self._index = None
+        self._loaded = False
+        # key -> {hashtag: weight}; inner dicts are replaced, never changed, so lookups need no lock
+        self._learned = {}
+        self._lock = threading.Lock()
+
+    def path(self):
+        return self.index_path or os.path.join(tempfile.gettempdir(), "linkedin-hashtags.idx")
+
+    def index(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._index = self._load()
+                    self._loaded = True
+        return self._index
+
+    def _load(self):
+        path = self.path()
+        signature = hashtag_sources_signature(self.corpus_path, self.learned_path)
+        try:
+            index = HashtagIndex(path)
+            if index.signature == signature:
+                return index
+        except (OSError, ValueError, struct.error):
+            pass
+        try:
+            with timed("hashtag_index_build"):
+                info = build_hashtag_index(self.corpus_path, self.learned_path, path, signature)
+            self.builds += 1
+            log_event("HASHTAG INDEX", f"Built {path}: {info['terms']} terms, {info['hashtags']} hashtags, {info['bytes']} bytes", **info)
+            return HashtagIndex(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log_event("HASHTAG ERROR", f"Could not build the hashtag index: {str(e)}")
+            return None
+
+    def lookup(self, topic):
+        """(hashtags, confidence) for a topic. Confidence is the idf-weighted share of its words the index knows."""
+        index = self.index()
+        words, phrases = hashtag_terms(topic)
+        if index is None or not words:
+            return [], 0.0
+        scores, spelling, known, rarity = {}, {}, set(), {}
+        for key in itertools.chain(words, phrases):
+            found = index.postings(key)
+            idf = found[0] if found else index.max_idf
+            rarity.setdefault(key, idf)
+            # A matched phrase accounts for all of its words
+            idf *= key.count(" ") + 1
+            if found:
+                for tag_id, weight in found[1]:
+                    tag = index.tags[tag_id]
+                    lower = tag.lower()
+                    spelling.setdefault(lower, tag)
+                    scores[lower] = scores.get(lower, 0.0) + idf * weight
+            learned = self._learned.get(key)
+            if learned:
+                for tag, weight in learned.items():
+                    lower = tag.lower()
+                    spelling.setdefault(lower, tag)
+                    scores[lower] = scores.get(lower, 0.0) + idf * weight
+            if found or learned:
+                known.update(key.split(" "))
+        if not scores:
+            return [], 0.0
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        cutoff = ranked[0][1] * 0.3
+        tags = [spelling[tag] for tag, score in ranked[:7] if score >= cutoff]
+        if len(tags) < 5:
+            tags = [spelling[tag] for tag, _ in ranked[:5]]
+        confidence = sum(rarity[word] for word in words if word in known) / sum(rarity[word] for word in words)
+        return tags, (confidence if len(tags) >= 5 else 0.0)
+
+    def suggest(self, topic):
+        """Hashtags for the topic from the index, or None when the model should be asked."""
+        if self.mode == "llm":
+            return None
+        with timed("hashtags_local"):
+            tags, confidence = self.lookup(topic)
+        if self.mode == "local" or (tags and confidence >= self.min_confidence):
+            with self._lock:
+                self.answered += 1
+            metrics.inc("linkedin_hashtag_suggestions_total", source="local")
+            return tags or list(DEFAULT_HASHTAGS)
+        with self._lock:
+            self.deferred += 1
+        metrics.inc("linkedin_hashtag_suggestions_total", source="llm")
+        return None
+
+    def learn(self, topic, hashtags):
+        """Remember the hashtags the model suggested for a topic."""
+        if self.mode == "llm" or not hashtags or hashtags == DEFAULT_HASHTAGS:
+            return
+        words, phrases = hashtag_terms(topic)
+        if not words:
+            return
+        with self._lock:
+            if self.learned < HASHTAG_LEARNED_MAX:
+                for key in set(words).union(phrases):
+                    bucket = dict(self._learned.get(key, ()))
+                    for rank, tag in enumerate(hashtags):
+                        bucket[tag] = bucket.get(tag, 0.0) + _hashtag_rank_weight(rank)
+                    self._learned[key] = bucket
+            self.learned += 1
+            if self.learned_path:
+                try:
+                    with open(self.learned_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps({"topic": topic, "hashtags": hashtags}, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    log_event("HASHTAG ERROR", f"Could not save learned hashtags: {str(e)}")
+
+    def stats(self):
+        index = self.index()
+        return {
+            "mode": self.mode,
+            "answered_locally": self.answered,
+            "sent_to_model": self.deferred,
+            "learned": self.learned,
+            "terms": len(index.hashes) if index else 0,
+            "hashtags": len(index.tags) if index else 0,
+            "index_bytes": index.size if index else 0,
+            "builds": self.builds,
+        }
+
+hashtag_engine = HashtagEngine()
+
+# Similar topics
+# Paraphrased topics ("remote work tips", "tips for remote work") make different
+# prompts, so the response cache misses them. Hooks and carousels are also kept
+# in a MinHash/LSH index of their topic's words. A new topic under the same
+# audience, goal and tone (and with the same numbers and stance words in it) reuses the stored
+# output when the word sets' Jaccard similarity reaches SIMILAR_TOPIC_THRESHOLD,
+# with the old topic's wording swapped for the new one where it appears verbatim.
+SIMILAR_TOPICS_ENABLED = os.getenv("SIMILAR_TOPICS", "1") != "0"
+SIMILAR_TOPIC_THRESHOLD = float(os.getenv("SIMILAR_TOPIC_THRESHOLD", "0.75"))
+SIMILAR_TOPIC_SIZE = int(os.getenv("SIMILAR_TOPIC_SIZE", "2048"))
+SIMILAR_TOPIC_TTL = float(os.getenv("SIMILAR_TOPIC_TTL", "3600"))
+# 16 bands of 2 rows: topics with similarity 0.5 share a band 99% of the time
+SIMILAR_TOPIC_BANDS = 16
+SIMILAR_TOPIC_ROWS = 2
+MINHASH_PRIME = (1 << 61) - 1
+# Only filler words are ignored. The hashtag stopwords also drop "not", "never",
+# "always", "better" ..., which would make opposite takes on a topic look identical.
+SIMILAR_TOPIC_STOPWORDS = frozenset("""
+a about an and are as at be been being by can do does for from how i in into is it its my of on or our so that the
+their this to was we were what when where which who why will with you your
+""".split())
+# Words that set a topic's stance or comparison: topics only match when they use the same ones
+SIMILAR_TOPIC_STANCE_WORDS = frozenset(topic_words("""
+not no never nothing none without always every only must should best better worse worst good great bad more most less
+least vs versus than
+""", frozenset()))
+NEGATION_RE = re.compile(r"n['’]t\b")
+_minhash_rng = random.Random(20240601)
+MINHASH_PERMUTATIONS = tuple((_minhash_rng.randrange(1, MINHASH_PRIME), _minhash_rng.randrange(MINHASH_PRIME))
+                             for _ in range(SIMILAR_TOPIC_BANDS * SIMILAR_TOPIC_ROWS))
+
+def topic_shingles(topic):
+    """(word set, numbers, stance words) of a topic; "-ing" forms count as the base word."""
+    words, numbers, stance = set(), [], set()
+    for word in topic_words(NEGATION_RE.sub(" not", topic.lower()), SIMILAR_TOPIC_STOPWORDS):
+        if word.isdigit():
+            numbers.append(word)
+        elif word in NUMBER_WORDS:
+            numbers.append(str(NUMBER_VALUES[word]))
+        elif word in SIMILAR_TOPIC_STANCE_WORDS:
+            stance.add(word)
+        else:
+            word = word[:-3] if len(word) > 5 and word.endswith("ing") else word
+            if word not in HASHTAG_STOPWORDS:
+                words.add(word)
+    return frozenset(words), tuple(sorted(numbers)), tuple(sorted(stance))
+
+def minhash_bands(shingles):
+    """LSH band keys of a word set's MinHash signature."""
+    hashes = [int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little") for word in shingles]
+    signature = [min((a * x + b) % MINHASH_PRIME for x in hashes) for a, b in MINHASH_PERMUTATIONS]
+    rows = SIMILAR_TOPIC_ROWS
+    return [(band, hash(tuple(signature[band * rows:(band + 1) * rows]))) for band in range(SIMILAR_TOPIC_BANDS)]
+
+def adapt_to_topic(value, old_topic, new_topic):
+    """Stored output with the old topic's exact wording replaced by the new topic."""
+    if old_topic.lower() == new_topic.lower():
+        return value
+    # Whole words only: an old topic "AI" must not rewrite "maintain" or "said"
+    pattern = re.compile(r"(?<!\w)" + re.escape(old_topic) + r"(?!\w)", re.IGNORECASE)
+    if isinstance(value, list):
+        return [pattern.sub(lambda m: new_topic, item) for item in value]
+    return pattern.sub(lambda m: new_topic, value)
+
+_similar_scope = contextvars.ContextVar("similar_scope", default=None)
+
+@contextmanager
+def similar_topic_scope(params):
+    """Let hooks and carousels generated inside the block be reused for this audience, goal and tone."""
+    scope = (params['audience'].lower(), params['goal'].lower(), str(params['tone']).lower())
+    token = _similar_scope.set(scope)
+    try:
+        yield
+    finally:
+        _similar_scope.reset(token)
+
+class SimilarTopicIndex:
+    """Stored hooks and carousels, found again by near-duplicate topic (MinHash + LSH)."""
+
+    def __init__(self, threshold=SIMILAR_TOPIC_THRESHOLD, size=SIMILAR_TOPIC_SIZE, ttl=SIMILAR_TOPIC_TTL,
+                 enabled=SIMILAR_TOPICS_ENABLED):
+        self.threshold = threshold
+        self.size = size
+        self.ttl = ttl
+        self.enabled = enabled and size > 0
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._entries = OrderedDict()   # id -> (partition, topic, shingles, value, expires, bands)
+        self._buckets = {}              # (partition, band, key) -> {id, ...}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _partition(self, kind, topic, variant):
+        scope = _similar_scope.get()
+        if scope is None or not self.enabled:
+            return None, None
+        shingles, numbers, stance = topic_shingles(topic)
+        if not shingles:
+            return None, None
+        return (kind, variant, numbers, stance) + scope, shingles
+
+    def find(self, kind, topic, variant=None):
+        """Output stored for a similar topic in the current scope, or None."""
+        if _fresh_sample.get():
+            return None
+        started = time.perf_counter()
+        partition, shingles = self._partition(kind, topic, variant)
+        if partition is None:
+            return None
+        bands = minhash_bands(shingles)
+        now = time.monotonic()
+        best, best_similarity = None, 0.0
+        with self._lock:
+            candidates = set()
+            for band, key in bands:
+                candidates.update(self._buckets.get((partition, band, key), ()))
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry[4] < now:
+                    continue
+                similarity = len(shingles & entry[2]) / len(shingles | entry[2])
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is not None:
+                self._entries.move_to_end(best)
+                _, old_topic, _, value, _, _ = self._entries[best]
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.lookup_seconds += time.perf_counter() - started
+        metrics.observe("linkedin_stage_duration_seconds", time.perf_counter() - started, stage="similar_topic_lookup")
+        metrics.inc("linkedin_similar_topic_lookups_total", kind=kind, outcome="hit" if best is not None else "miss")
+        if best is None:
+            return None
+        record_cache_hit()
+        log_event("SIMILAR TOPIC", kind=kind, topic=topic, matched=old_topic, similarity=round(best_similarity, 3))
+        return adapt_to_topic(value, old_topic, topic)
+
+    def add(self, kind, topic, value, variant=None):
+        partition, shingles = self._partition(kind, topic, variant)
+        if partition is None:
+            return
+        bands = [(partition, band, key) for band, key in minhash_bands(shingles)]
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (partition, topic, shingles, value, time.monotonic() + self.ttl, bands)
+            for bucket in bands:
+                self._buckets.setdefault(bucket, set()).add(entry_id)
+            while len(self._entries) > self.size:
+                old_id, old = self._entries.popitem(last=False)
+                for bucket in old[5]:
+                    ids = self._buckets.get(bucket)
+                    if ids is not None:
+                        ids.discard(old_id)
+                        if not ids:
+                            del self._buckets[bucket]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "mean_lookup_us": round(self.lookup_seconds / lookups * 1e6, 1) if lookups else 0.0,
+            }
+
+similar_topics = SimilarTopicIndex()
+
+HASHTAGS_SYSTEM_PROMPT = """You are a LinkedIn hashtag strategist. Generate relevant, high-engagement hashtags.
 
 RULES:
 - Return ONLY hashtags, nothing else
@@ -257,24 +2486,37 @@ RULES:
 
 Output format: #hashtag1 #hashtag2 #hashtag3 #hashtag4 #hashtag5"""
 
+HASHTAGS_COMPACT_PROMPT = """You are a LinkedIn hashtag strategist. Output only 5-7 hashtags on one line, separated by spaces.
+Each starts with #, has no spaces and is lowercase or CamelCase; mix 2-3 broad with 2-3 niche ones."""
+
+HASHTAGS_PROMPT = PromptPrefix("hashtags", HASHTAGS_SYSTEM_PROMPT, HASHTAGS_COMPACT_PROMPT)
+
+def hashtags_messages(topic):
     user_prompt = f"Generate 5-7 LinkedIn hashtags for a post about: {topic}"
 
+    return [
+        HASHTAGS_PROMPT.message(),
+        {"role": "user", "content": user_prompt},
+    ]
+
+@timed_stage("hashtags_cleanup")
+def finish_hashtags(content):
+    return extract_hashtags(content) or list(DEFAULT_HASHTAGS)
+
+@timed_stage("hashtags")
+def suggest_hashtags(topic):
+    hashtags = hashtag_engine.suggest(topic)
+    if hashtags is not None:
+        return hashtags
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-        content = call_api(messages, max_tokens=100, temperature=0.5)
-        if content:
-            hashtags = re.findall(r'#\w+', content)
-            cleaned = [h for h in hashtags if len(h) > 1][:7]
-            return cleaned if cleaned else ["#LinkedIn", "#Networking", "#CareerGrowth"]
-        return ["#LinkedIn", "#Networking", "#CareerGrowth"]
+        content = call_api(hashtags_messages(topic), max_tokens=100, temperature=0.5, endpoint="hashtags")
+        hashtags = finish_hashtags(content)
+        hashtag_engine.learn(topic, hashtags)
+        return hashtags
     except Exception as e:
-        return ["#LinkedIn", "#Networking", "#CareerGrowth"]
+        return list(DEFAULT_HASHTAGS)
 
-def generate_carousel(topic, slides=5):
-    system_prompt = """You are a LinkedIn carousel content creator. Generate slide content that's ready to copy into Canva or any design tool.
+CAROUSEL_SYSTEM_PROMPT = """You are a LinkedIn carousel content creator. Generate slide content that's ready to copy into Canva or any design tool.
 
 FORMAT FOR EACH SLIDE:
 SLIDE 1: [Title]
@@ -295,18 +2537,335 @@ RULES:
 
 Output ONLY the slide content. No introductions or explanations."""
 
+CAROUSEL_COMPACT_PROMPT = """You are a LinkedIn carousel content creator. Format every slide as:
+SLIDE 1: [Title]
+• Point
+Slide 1 is the hook headline only, the last slide a CTA with the key takeaway, the others a headline and 2-3 bullets.
+Headlines under 10 words, bullets under 15. No markdown. Blank line between slides. Output only the slides."""
+
+CAROUSEL_PROMPT = PromptPrefix("carousel", CAROUSEL_SYSTEM_PROMPT, CAROUSEL_COMPACT_PROMPT)
+
+def carousel_messages(topic, slides=5):
     user_prompt = f"Create a {slides}-slide LinkedIn carousel about: {topic}"
 
+    return [
+        CAROUSEL_PROMPT.message(),
+        {"role": "user", "content": user_prompt},
+    ]
+
+@timed_stage("carousel_cleanup")
+def finish_carousel(content):
+    """Carousel text in the canonical "SLIDE n: Title" / "• point" layout."""
+    slides = parse_carousel(content)
+    if slides:
+        return render_carousel(slides)
+    return content.strip() if content and content.strip() else "Error generating carousel content."
+
+@timed_stage("carousel")
+def generate_carousel(topic, slides=5):
+    carousel = similar_topics.find("carousel", topic, slides)
+    if carousel is not None:
+        return carousel
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-        content = call_api(messages, max_tokens=800, temperature=0.7)
-        return content.strip() if content else "Error generating carousel content."
+        messages = carousel_messages(topic, slides)
+        carousel = finish_carousel(call_api(messages, max_tokens=800, temperature=0.7, endpoint="carousel"))
+        if carousel != "Error generating carousel content.":
+            similar_topics.add("carousel", topic, carousel, slides)
+        return carousel
     except Exception as e:
         return f"Error generating carousel: {str(e)}"
 
+COMBINED_SYSTEM_PROMPT = """You are an expert LinkedIn content creator. Return a single JSON object and nothing else:
+{"post": "...", "hooks": ["...", ...], "hashtags": ["#...", ...]}
+
+"post": a LinkedIn post that is IMMEDIATELY COPY-PASTE READY
+- NO markdown (no **, no #, no ---, no headers), NO labels, NO word counts, NO introductions
+- Short paragraphs (1-2 lines) separated by blank lines (use \\n in the JSON string)
+- 1-3 simple emojis total; → or • or ✓ for bullet points
+- Hook in the first 140 characters, then body, then a call-to-action question
+- End with 3-5 relevant hashtags separated by spaces
+
+"hooks": alternative opening lines for the same post
+- Each under 140 characters, no numbering, no quotation marks, no markdown
+- Punchy, curiosity-inducing or contrarian; mix questions, bold statements, statistics, stories
+
+"hashtags": 5-7 hashtags, each starting with #, no spaces
+- Mix 2-3 broad/popular with 2-3 niche/specific, lowercase or CamelCase
+
+Output ONLY valid JSON. No code fences, no commentary."""
+
+COMBINED_COMPACT_PROMPT = """You are an expert LinkedIn content creator. Return a single JSON object and nothing else:
+{"post": "...", "hooks": ["...", ...], "hashtags": ["#...", ...]}
+post: ready to paste; no markdown, labels or introductions; short paragraphs separated by blank lines (\\n); 1-3 emojis; → • ✓ bullets; hook in the first 140 characters, a call-to-action question, 3-5 hashtags at the end.
+hooks: alternative opening lines under 140 characters; no numbering, quotes or markdown.
+hashtags: 5-7, each starting with #, mixing broad and niche."""
+
+COMBINED_PROMPT = PromptPrefix("combined", COMBINED_SYSTEM_PROMPT, COMBINED_COMPACT_PROMPT)
+
+def combined_messages(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta="", num_hooks=5):
+    user_prompt = f"""Topic: {topic}
+
+Target audience: {audience}
+Goal: {goal}
+Tone: {tone}
+Approximate post length: {length} words
+Keywords to include: {keywords}
+Call-to-action: {cta}
+Number of hooks: {num_hooks}"""
+
+    return [
+        COMBINED_PROMPT.message(),
+        {"role": "user", "content": user_prompt},
+    ]
+
+def _escape_control_chars_in_strings(text):
+    """Escape raw newlines/tabs that models often leave inside JSON string values."""
+    out = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            elif ch == "\r":
+                ch = "\\r"
+            elif ch == "\t":
+                ch = "\\t"
+        elif ch == '"':
+            in_string = True
+        out.append(ch)
+    return "".join(out)
+
+def parse_json_object(text):
+    """Parse a JSON object out of model output, repairing common mistakes.
+
+    Handles code fences, commentary around the object, trailing commas and raw
+    newlines inside strings. Returns None if no object can be recovered.
+    """
+    if not text:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    candidate = text[start:end + 1]
+    attempts = (
+        lambda t: t,
+        lambda t: re.sub(r",\s*([}\]])", r"\1", t),
+        lambda t: re.sub(r",\s*([}\]])", r"\1", _escape_control_chars_in_strings(t)),
+    )
+    for repair in attempts:
+        try:
+            value = json.loads(repair(candidate))
+        except ValueError:
+            continue
+        return value if isinstance(value, dict) else None
+    return None
+
+@timed_stage("combined")
+def generate_combined(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta="", num_hooks=5):
+    """Generate post, hooks and hashtags with a single upstream call.
+
+    Returns (post, hooks, hashtags), or None when the call fails or the
+    response cannot be turned into a usable result.
+    """
+    try:
+        messages = combined_messages(topic, audience, goal, tone, length, keywords, cta, num_hooks)
+        content = call_api(messages, max_tokens=1400, temperature=0.7, endpoint="combined")
+    except Exception as e:
+        log_event("COMBINED ERROR", str(e))
+        return None
+    result = finish_combined(content, num_hooks)
+    if result is not None:
+        hashtag_engine.learn(topic, result[2])
+    return result
+
+@timed_stage("combined_cleanup")
+def finish_combined(content, num_hooks=5):
+    """Turn a combined JSON response into (post, hooks, hashtags), or None if unusable."""
+    result = parse_json_object(content)
+    if result is None:
+        log_event("COMBINED ERROR", "Response was not a JSON object, falling back to separate calls")
+        return None
+
+    post = result.get("post")
+    if not isinstance(post, str) or not post.strip():
+        return None
+    post = normalize_post(post)
+    if not post:
+        return None
+
+    hooks = result.get("hooks")
+    if isinstance(hooks, str):
+        hooks = hooks.split("\n")
+    hooks = normalize_hooks([h for h in hooks if isinstance(h, str)], num_hooks) if isinstance(hooks, list) else []
+
+    hashtags = result.get("hashtags")
+    if isinstance(hashtags, list):
+        hashtags = " ".join(h if h.startswith("#") else "#" + h for h in hashtags if isinstance(h, str))
+    hashtags = extract_hashtags(hashtags if isinstance(hashtags, str) else "")
+
+    return (
+        post,
+        hooks if hooks else ["Hook generation failed."],
+        hashtags if hashtags else list(DEFAULT_HASHTAGS),
+    )
+
+# Variants
+# "variants": N on /generate returns N drafts of a text post or carousel, best
+# first. All N are sampled in one upstream request with the `n` parameter (models
+# that don't support it get concurrent single calls, see call_api_n). Every draft
+# goes through the usual cleanup, repeats are dropped, and the rest are ranked by
+# how many of the prompt's own rules they follow.
+GENERATION_MAX_VARIANTS = int(os.getenv("GENERATION_MAX_VARIANTS", "5"))
+POST_BULLETS = ("→", "•", "✓")
+
+def variant_count(value):
+    """Number of drafts a payload asks for, or None unless it is a whole number from 1 to GENERATION_MAX_VARIANTS."""
+    if value is None:
+        return 1
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if 1 <= number <= GENERATION_MAX_VARIANTS else None
+
+def _length_fit(words, length):
+    """1 within the requested word count (a number gets +-25%), falling to 0 at twice the distance."""
+    numbers = [int(n) for n in re.findall(r"\d+", str(length))] or [150, 200]
+    if len(numbers) == 1:
+        low, high = numbers[0] * 0.75, numbers[0] * 1.25
+    else:
+        low, high = min(numbers), max(numbers)
+    target = (low + high) / 2
+    if low <= words <= high:
+        return 1.0
+    return max(0.0, 1 - (low - words if words < low else words - high) / target)
+
+def score_post(post, length=150):
+    """Share of the post prompt's rules a cleaned draft follows, from 0 to 1.
+
+    Checked: word count, a hook within 140 characters, a question after the
+    opening, 3-5 hashtags on the last line, and prose paragraphs of at most two
+    lines (bullet lines don't count).
+    """
+    if not post or post.startswith(("Error:", "Error generating post:")):
+        return 0.0
+    paragraphs = [p for p in post.split("\n\n") if p.strip()]
+    last_line = post.rsplit("\n", 1)[-1].split()
+    tags = len(last_line) if last_line and all(word.startswith("#") for word in last_line) else 0
+    checks = [
+        _length_fit(sum(not word.startswith("#") for word in post.split()), length),
+        len(post.split("\n", 1)[0]) <= 140,
+        "?" in "\n".join(paragraphs[1:]),
+        3 <= tags <= 5,
+        all(sum(not line.startswith(POST_BULLETS) for line in p.split("\n")) <= 2 for p in paragraphs),
+    ]
+    return round(sum(checks) / len(checks), 3)
+
+def score_carousel(text, slides=5):
+    """Share of the carousel prompt's rules a cleaned draft follows, from 0 to 1.
+
+    Checked: the slide count, 2-3 points on each middle slide, headlines under
+    10 words and points under 15.
+    """
+    parsed = parse_carousel(text)
+    if not parsed:
+        return 0.0
+    middle = parsed[1:-1]
+    points = [point for slide in parsed for point in slide["points"]]
+    checks = [
+        max(0.0, 1 - abs(len(parsed) - slides) / slides),
+        sum(2 <= len(slide["points"]) <= 3 for slide in middle) / len(middle) if middle else 0.0,
+        sum(len(slide["title"].split()) < 10 for slide in parsed) / len(parsed),
+        sum(len(point.split()) < 15 for point in points) / len(points) if points else 0.0,
+    ]
+    return round(sum(checks) / len(checks), 3)
+
+def rank_variants(drafts, score):
+    """[(draft, score)] best first, without repeats; ties keep sampling order."""
+    seen = set()
+    ranked = []
+    for draft in drafts:
+        key = " ".join(draft.split()).lower()
+        if key not in seen:
+            seen.add(key)
+            ranked.append((draft, score(draft)))
+    ranked.sort(key=lambda item: -item[1])
+    return ranked
+
+def post_variants(contents, length):
+    ranked = rank_variants([finish_post(content) for content in contents], lambda post: score_post(post, length))
+    return [{"post": post, "score": score} for post, score in ranked]
+
+def carousel_variants(contents, slides=5):
+    ranked = rank_variants([finish_carousel(content) for content in contents], lambda text: score_carousel(text, slides))
+    return [{"slides": text, "carousel": parse_carousel(text), "score": score} for text, score in ranked]
+
+@timed_stage("post")
+def generate_post_variants(n, topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
+    """Up to n cleaned post drafts as [{"post", "score"}], best first."""
+    try:
+        messages = post_messages(topic, audience, goal, tone, length, keywords, cta)
+        return post_variants(call_api_n(messages, n, max_tokens=600, temperature=0.7), length)
+    except Exception as e:
+        return [{"post": f"Error generating post: {str(e)}", "score": 0.0}]
+
+@timed_stage("carousel")
+def generate_carousel_variants(n, topic, slides=5):
+    """Up to n cleaned carousel drafts as [{"slides", "carousel", "score"}], best first."""
+    try:
+        return carousel_variants(call_api_n(carousel_messages(topic, slides), n, max_tokens=800, temperature=0.7), slides)
+    except Exception as e:
+        return [{"slides": f"Error generating carousel: {str(e)}", "carousel": [], "score": 0.0}]
+
+def _result_within(future, started, timeout, fallback):
+    """Wait for a future until `started + timeout`, returning `fallback` on timeout or failure."""
+    remaining = max(0.0, started + timeout - time.monotonic())
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        future.cancel()
+        return fallback
+    except Exception:
+        return fallback
+
+@timed_stage("text_post")
+def generate_text_post(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta="", variants=1):
+    """Generate post, hooks and hashtags for a text post.
+
+    The three upstream calls are independent, so they run concurrently and the
+    request takes as long as the slowest one instead of the sum of all three.
+    Hooks and hashtags are optional extras: if they time out or fail the post is
+    still returned with a fallback value in their place. With variants > 1 the
+    post is the ranked draft list from generate_post_variants.
+    """
+    generate_post = functools.partial(generate_post_variants, variants) if variants > 1 else generate_linkedin_post
+    timed_out = "Error generating post: timed out"
+    if variants > 1:
+        timed_out = [{"post": timed_out, "score": 0.0}]
+
+    if not PARALLEL_GENERATION:
+        post = generate_post(topic, audience, goal, tone, length, keywords, cta)
+        return post, generate_hooks(topic), suggest_hashtags(topic)
+
+    started = time.monotonic()
+    post_future = submit_task(generate_post, topic, audience, goal, tone, length, keywords, cta)
+    hooks_future = submit_task(generate_hooks, topic)
+    hashtags_future = submit_task(suggest_hashtags, topic)
+
+    post = _result_within(post_future, started, GENERATION_TIMEOUT, timed_out)
+    hooks = _result_within(hooks_future, started, GENERATION_TIMEOUT, ["Error generating hooks: timed out"])
+    hashtags = _result_within(hashtags_future, started, HASHTAG_TIMEOUT, list(DEFAULT_HASHTAGS))
+    return post, hooks, hashtags
+
 # Enable CORS
 @app.after_request
 def after_request(response):
@@ -315,6 +2874,25 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
     return response
 
+# Request timing and IDs - an incoming X-Request-ID is kept, otherwise one is generated
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    _request_id.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        record_request_metrics(request.method, route, response.status_code, time.perf_counter() - started)
+    response.headers['X-Request-ID'] = _request_id.get() or ""
+    return response
+
+def record_request_metrics(method, route, status, seconds):
+    metrics.observe("linkedin_http_request_duration_seconds", seconds, method=method, route=route, status=status)
+    log_event("REQUEST", method=method, route=route, status=status, seconds=round(seconds, 4))
+
 # Embedded HTML Template
 HTML_TEMPLATE = '''<!DOCTYPE html>
 <html lang="en">
@@ -477,13 +3055,15 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     </div>
     <div class="toast" id="toast"><svg class="toast-icon" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M22 11.08V12a10 10 0 1 1-5.93-9.14"/><polyline points="22 4 12 14.01 9 11.01"/></svg><span id="toastMessage">Copied to clipboard!</span></div>
     <script>
-        const state={postType:'text',selectedTemplate:'',isLoading:false};
+        const state={postType:'text',selectedTemplate:'',isLoading:false,lastRequest:null};
         const postForm=document.getElementById('postForm'),postTypeInput=document.getElementById('post_type'),templateNameInput=document.getElementById('template_name'),templateSelector=document.getElementById('templateSelector'),topicGroup=document.getElementById('topicGroup'),textOptions=document.getElementById('textOptions'),outputContainer=document.getElementById('outputContainer'),submitBtn=document.getElementById('submitBtn'),toast=document.getElementById('toast'),toastMessage=document.getElementById('toastMessage');
         document.querySelectorAll('.post-type-btn').forEach(btn=>{btn.addEventListener('click',()=>{document.querySelectorAll('.post-type-btn').forEach(b=>b.classList.remove('active'));btn.classList.add('active');state.postType=btn.dataset.type;postTypeInput.value=state.postType;templateSelector.style.display=state.postType==='template'?'block':'none';textOptions.style.display=state.postType==='text'?'block':'none';topicGroup.style.display=state.postType==='template'?'none':'block';const btnText=submitBtn.querySelector('span');if(state.postType==='text')btnText.textContent='Generate Post';else if(state.postType==='carousel')btnText.textContent='Generate Carousel';else btnText.textContent='Get Template';});});
         document.querySelectorAll('.template-card').forEach(card=>{card.addEventListener('click',()=>{document.querySelectorAll('.template-card').forEach(c=>c.classList.remove('selected'));card.classList.add('selected');state.selectedTemplate=card.dataset.template;templateNameInput.value=state.selectedTemplate;});});
-        postForm.addEventListener('submit',async(e)=>{e.preventDefault();if(state.isLoading)return;if(state.postType==='template'&&!state.selectedTemplate){showToast('Please select a template','error');return;}if(state.postType!=='template'&&!document.getElementById('topic').value.trim()){showToast('Please enter a topic','error');return;}state.isLoading=true;setLoadingState(true);showSkeleton();const formData=new FormData(postForm);const data=Object.fromEntries(formData);data.keywords=data.keywords?data.keywords.split(',').map(k=>k.trim()):[];data.length=parseInt(data.length)||150;try{const response=await fetch('/generate',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)});if(!response.ok)throw new Error('Generation failed');const result=await response.json();if(result.error)throw new Error(result.error);displayResult(result);showToast('Content generated successfully!','success');}catch(error){displayError(error.message);showToast('Failed to generate content','error');}finally{state.isLoading=false;setLoadingState(false);}});
+        postForm.addEventListener('submit',async(e)=>{e.preventDefault();if(state.isLoading)return;if(state.postType==='template'&&!state.selectedTemplate){showToast('Please select a template','error');return;}if(state.postType!=='template'&&!document.getElementById('topic').value.trim()){showToast('Please enter a topic','error');return;}state.isLoading=true;setLoadingState(true);showSkeleton();const formData=new FormData(postForm);const data=Object.fromEntries(formData);data.keywords=data.keywords?data.keywords.split(',').map(k=>k.trim()):[];data.length=parseInt(data.length)||150;const request=JSON.stringify(data);if(request===state.lastRequest)data.fresh=true;state.lastRequest=request;try{let result=state.postType==='template'?null:await streamGenerate(data);if(!result){const response=await fetch('/generate',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)});if(!response.ok)throw new Error('Generation failed');result=await response.json();if(result.error)throw new Error(result.error);}displayResult(result);showToast('Content generated successfully!','success');}catch(error){displayError(error.message);showToast('Failed to generate content','error');}finally{state.isLoading=false;setLoadingState(false);}});
         function setLoadingState(loading){submitBtn.disabled=loading;submitBtn.innerHTML=loading?'<div class="spinner"></div><span>Generating...</span>':'<svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="12" cy="12" r="10"/><polygon points="10 8 16 12 10 16 10 8"/></svg><span>Generate Post</span>';}
         function showSkeleton(){outputContainer.innerHTML='<div class="output-section"><div class="skeleton skeleton-text"></div><div class="skeleton skeleton-text"></div><div class="skeleton skeleton-text"></div><div class="skeleton skeleton-box" style="margin-top:16px;"></div></div>';}
+        async function streamGenerate(data){let response;try{response=await fetch('/generate/stream',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)});}catch(e){return null;}if(response.status===404||response.status===405||!response.body)return null;if(!response.ok){const err=await response.json().catch(()=>({}));throw new Error(err.error||'Generation failed');}const reader=response.body.getReader(),decoder=new TextDecoder();let buffer='',text='',result=null;while(true){const{value,done}=await reader.read();if(done)break;buffer+=decoder.decode(value,{stream:true});let sep;while((sep=buffer.indexOf('\n\n'))>=0){const raw=buffer.slice(0,sep);buffer=buffer.slice(sep+2);let event='message',payload='';raw.split('\n').forEach(line=>{if(line.startsWith('event:'))event=line.slice(6).trim();else if(line.startsWith('data:'))payload+=line.slice(5).trim();});if(!payload)continue;const msg=JSON.parse(payload);if(event==='delta'){text+=msg.text;renderStreaming(text);}else if(event==='done')result=msg;else if(event==='error')throw new Error(msg.error);}}if(!result)throw new Error('Generation failed');return result;}
+        function renderStreaming(text){let preview=document.getElementById('streamContent');if(!preview){outputContainer.innerHTML='<div class="output-section"><div class="output-content"><div class="post-preview" id="streamContent"></div></div></div>';preview=document.getElementById('streamContent');}preview.textContent=text;}
         let currentResult=null;
         function displayResult(result){currentResult=result;let html='';if(result.post&&result.hashtags&&result.hashtags.length){html+='<div class="output-section" style="padding-bottom:0;margin-bottom:16px;"><button class="copy-all-btn" onclick="copyPostWithHashtags()"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>Copy Complete Post (with hashtags)</button></div>';}if(result.post){html+='<div class="output-section"><div class="output-header"><span class="output-label"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M14 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V8z"/><polyline points="14 2 14 8 20 8"/></svg>Your Post</span><button class="copy-btn" onclick="copyToClipboard(this,\\'post\\')"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>Copy</button></div><div class="output-content"><div class="post-preview" id="postContent">'+escapeHtml(result.post)+'</div></div></div>';}if(result.hooks&&result.hooks.length){html+='<div class="output-section"><div class="output-header"><span class="output-label"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M12 2L2 7l10 5 10-5-10-5z"/><path d="M2 17l10 5 10-5"/><path d="M2 12l10 5 10-5"/></svg>Alternative Hooks</span><span class="output-hint">Click any hook to copy</span></div><div class="output-content"><div class="hooks-list">';result.hooks.forEach((hook,i)=>{html+='<div class="hook-item" onclick="copyText(\\''+escapeHtml(hook).replace(/'/g,"\\\\'")+'\\')""><span class="hook-number">'+(i+1)+'</span><span>'+escapeHtml(hook)+'</span></div>';});html+='</div></div></div>';}if(result.hashtags&&result.hashtags.length){html+='<div class="output-section"><div class="output-header"><span class="output-label"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><line x1="4" y1="9" x2="20" y2="9"/><line x1="4" y1="15" x2="20" y2="15"/><line x1="10" y1="3" x2="8" y2="21"/><line x1="16" y1="3" x2="14" y2="21"/></svg>Hashtags</span><button class="copy-btn" onclick="copyHashtags()"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>Copy</button></div><div class="output-content"><div class="hashtags-container" id="hashtagsContainer">';result.hashtags.forEach(tag=>{html+='<span class="hashtag" onclick="copyText(\\''+tag+'\\')">'+escapeHtml(tag)+'</span>';});html+='</div></div></div>';}if(result.slides){html+='<div class="output-section"><div class="output-header"><span class="output-label"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="2" y="3" width="20" height="14" rx="2" ry="2"/><line x1="8" y1="21" x2="16" y2="21"/><line x1="12" y1="17" x2="12" y2="21"/></svg>Carousel Slides</span><button class="copy-btn" onclick="copyToClipboard(this,\\'slides\\')"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>Copy</button></div><div class="output-content"><div class="post-preview" id="slidesContent">'+escapeHtml(result.slides)+'</div></div></div>';}if(result.template){html+='<div class="output-section"><div class="output-header"><span class="output-label"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="3" y="3" width="18" height="18" rx="2" ry="2"/><line x1="3" y1="9" x2="21" y2="9"/><line x1="9" y1="21" x2="9" y2="9"/></svg>Template Structure</span><button class="copy-btn" onclick="copyTemplate()"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="9" y="9" width="13" height="13" rx="2" ry="2"/><path d="M5 15H4a2 2 0 0 1-2-2V4a2 2 0 0 1 2-2h9a2 2 0 0 1 2 2v1"/></svg>Copy</button></div><div class="output-content"><div class="template-preview" id="templateContent"><div class="template-section"><div class="template-section-label">Hook</div><div class="template-section-content">'+escapeHtml(result.template.hook||'')+'</div></div><div class="template-section"><div class="template-section-label">Body</div><div class="template-section-content">'+escapeHtml(result.template.body||'')+'</div></div><div class="template-section"><div class="template-section-label">Call to Action</div><div class="template-section-content">'+escapeHtml(result.template.cta||'')+'</div></div></div></div></div>';}outputContainer.innerHTML=html||'<div class="output-empty"><h3>No content generated</h3></div>';}
         function displayError(message){outputContainer.innerHTML='<div class="output-empty" style="color:var(--error);"><svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5"><circle cx="12" cy="12" r="10"/><line x1="12" y1="8" x2="12" y2="12"/><line x1="12" y1="16" x2="12.01" y2="16"/></svg><h3>Generation Failed</h3><p>'+escapeHtml(message)+'</p></div>';}
@@ -498,9 +3078,866 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
 </body>
 </html>'''
 
+# Page delivery
+# The page (and optionally its CSS/JS) is compressed once - at import, or on first use
+# with STARTUP_MODE=lazy; a request only picks the precomputed body for its
+# Accept-Encoding or answers 304 from the ETag.
+PAGE_MAX_AGE = int(os.getenv("PAGE_MAX_AGE", "3600"))
+PAGE_STATIC_ASSETS = os.getenv("PAGE_STATIC_ASSETS", "0") == "1"
+ASSET_MAX_AGE = 31536000
+
+class StaticBody:
+    """An in-memory response body with gzip/brotli variants and a strong ETag per encoding."""
+
+    PREFERRED_ENCODINGS = ("br", "gzip")
+
+    def __init__(self, body, mimetype, cache_control, lazy=False):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = {"identity": body}
+        # Encodings not compressed yet; with `lazy` each is compressed on first request, and
+        # brotli drops from quality 11 (~60ms for the page) to 5 (~1ms, about 10% larger)
+        self._pending = {encoding for encoding in self.PREFERRED_ENCODINGS if encoding != "br" or brotli is not None}
+        self._brotli_quality = 5 if lazy else 11
+        self._lock = threading.Lock()
+        if not lazy:
+            for encoding in list(self._pending):
+                self.variant(encoding)
+
+    def variant(self, encoding):
+        """The body for an encoding, or None if it isn't smaller than the identity body."""
+        if encoding in self._pending:
+            with self._lock:
+                if encoding in self._pending:
+                    body = self.variants["identity"]
+                    if encoding == "br":
+                        data = brotli.compress(body, quality=self._brotli_quality)
+                    else:
+                        data = gzip.compress(body, compresslevel=9, mtime=0)
+                    if len(data) < len(body):
+                        self.variants[encoding] = data
+                    self._pending.discard(encoding)
+        return self.variants.get(encoding)
+
+    def etag(self, encoding):
+        # Representations differ per encoding, so each gets its own strong validator; brotli
+        # bytes also differ per quality (lazy vs eager startup), so the quality is part of it
+        tag = self.digest[:20]
+        if encoding == "br":
+            return f"{tag}-br{self._brotli_quality}"
+        return tag if encoding == "identity" else f"{tag}-{encoding}"
+
+    def negotiate(self, accept_encodings):
+        best, best_quality = "identity", 0
+        for encoding in self.PREFERRED_ENCODINGS:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality and self.variant(encoding) is not None:
+                best, best_quality = encoding, quality
+        return best
+
+    def response(self):
+        encoding = self.negotiate(request.accept_encodings)
+        etag = self.etag(encoding)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.headers.pop('Content-Type', None)
+        else:
+            response = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != "identity":
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+def split_page_assets(html):
+    """Move the inline <style> and <script> blocks into content-hashed assets.
+
+    Returns the rewritten HTML and a {filename: StaticBody} map. The file names
+    change whenever the content does, so the assets can be cached forever.
+    """
+    assets = {}
+    cache_control = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    lazy = STARTUP_MODE == "lazy"
+
+    def extract(pattern, extension, mimetype, tag):
+        nonlocal html
+        match = re.search(pattern, html, re.S)
+        if not match:
+            return
+        body = StaticBody(match.group(1).strip() + "\n", mimetype, cache_control, lazy)
+        name = f"app.{body.digest[:12]}.{extension}"
+        assets[name] = body
+        html = html[:match.start()] + tag.format(url=f"/assets/{name}") + html[match.end():]
+
+    extract(r'<style>(.*?)</style>', "css", "text/css", '<link rel="stylesheet" href="{url}">')
+    extract(r'<script>(.*?)</script>', "js", "application/javascript", '<script src="{url}"></script>')
+    return html, assets
+
+def build_page():
+    html, assets = HTML_TEMPLATE, {}
+    if PAGE_STATIC_ASSETS:
+        html, assets = split_page_assets(html)
+    return StaticBody(html, "text/html", f"public, max-age={PAGE_MAX_AGE}", STARTUP_MODE == "lazy"), assets
+
+home_page, page_assets = build_page()
+
 @app.route('/')
 def home():
-    return Response(HTML_TEMPLATE, mimetype='text/html')
+    return home_page.response()
+
+@app.route('/assets/<name>')
+def page_asset(name):
+    asset = page_assets.get(name)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    return asset.response()
+
+def parse_generation_request(data):
+    """Normalize a /generate payload into generator arguments."""
+    keywords = data.get('keywords', [])
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(',') if k.strip()]
+    return {
+        'post_type': data.get('post_type', 'text'),
+        'topic': data.get('topic', '').strip(),
+        'audience': data.get('audience', 'professionals').strip() or 'professionals',
+        'goal': data.get('goal', 'educate').strip() or 'educate',
+        'tone': data.get('tone', 'professional'),
+        'length': data.get('length', 150),
+        'keywords': ', '.join(keywords) if keywords else '',
+        'cta': data.get('cta', '').strip(),
+        'template_name': data.get('template_name', 'personal_story'),
+        'mode': 'combined' if data.get('mode', GENERATION_MODE) == 'combined' else 'separate',
+        'fresh': data.get('fresh') is True,
+        'variants': variant_count(data.get('variants')),
+    }
+
+class SingleFlight:
+    """Deduplicates concurrent calls: while a call for a key is running, callers
+    with the same key wait for it and share its result instead of starting their own.
+
+    Threads and event-loop tasks are tracked separately; nothing is kept once a call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Run fn() or join the identical call in flight. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            return call.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+    async def do_async(self, key, coroutine_fn):
+        """Async version of do, for callers on one event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call = self._tasks.get((loop, key))
+            leader = call is None
+            if leader:
+                call = self._tasks[(loop, key)] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            return await asyncio.shield(call), True
+        try:
+            result = await coroutine_fn()
+        except BaseException as e:
+            call.set_exception(e)
+            # Mark the exception as retrieved when nobody was waiting for it
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._tasks[(loop, key)]
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": COALESCE_REQUESTS, "in_flight": len(self._calls) + len(self._tasks),
+                    "leaders": self.leaders, "followers": self.followers}
+
+single_flight = SingleFlight()
+
+def coalesce_key(params):
+    """Key identifying generations that may share one result, or None if this one must run alone."""
+    if not COALESCE_REQUESTS or params['fresh'] or params['post_type'] not in ('text', 'carousel'):
+        return None
+    def norm(value):
+        return " ".join(str(value).split()).lower()
+    keywords = sorted(norm(k) for k in params['keywords'].split(',') if k.strip())
+    fields = [params['post_type'], params['mode'], norm(params['topic']), norm(params['audience']),
+              norm(params['goal']), norm(params['tone']), norm(params['length']), keywords, norm(params['cta']),
+              params['variants']]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def shared_result(body):
+    """A follower's copy of a coalesced result: no upstream calls were made for it."""
+    body = dict(body)
+    if 'usage' in body:
+        body['usage'] = {key: 0 for key in body['usage']}
+    body['coalesced'] = True
+    return body
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_generation(params):
+    """Yield Server-Sent Events for a text or carousel generation.
+
+    `delta` events carry text as the upstream produces it; the final `done`
+    event carries the same result object that /generate returns, usage included.
+    The async mode serves this route through the WSGI bridge, so it is the same stream.
+    """
+    with fresh_sample(params['fresh']), track_usage() as usage:
+        yield from _stream_generation(params, usage)
+
+def _stream_generation(params, usage):
+    topic = params['topic']
+    if params['post_type'] == 'carousel':
+        parts = []
+        try:
+            for delta in stream_api(carousel_messages(topic), max_tokens=800, temperature=0.7, endpoint="carousel"):
+                parts.append(delta)
+                yield sse_event('delta', {'text': delta})
+            slides = finish_carousel("".join(parts))
+        except Exception as e:
+            slides = f"Error generating carousel: {str(e)}"
+        yield sse_event('done', {'slides': slides, 'carousel': parse_carousel(slides), 'usage': usage.as_dict(),
+                                 'success': True})
+        return
+
+    # Hooks and hashtags are not streamed; they run alongside the post
+    started = time.monotonic()
+    with similar_topic_scope(params):
+        hooks_future = submit_task(generate_hooks, topic)
+    hashtags_future = submit_task(suggest_hashtags, topic)
+
+    messages = post_messages(topic, params['audience'], params['goal'], params['tone'],
+                             params['length'], params['keywords'], params['cta'])
+    cleaner = PostStreamCleaner()
+    parts = []
+    try:
+        for delta in stream_api(messages, max_tokens=600, temperature=0.7, endpoint="post"):
+            parts.append(delta)
+            text = cleaner.feed(delta)
+            if text:
+                yield sse_event('delta', {'text': text})
+        text = cleaner.finish()
+        if text:
+            yield sse_event('delta', {'text': text})
+        post = finish_post("".join(parts))
+    except Exception as e:
+        post = f"Error generating post: {str(e)}"
+
+    hooks = _result_within(hooks_future, started, GENERATION_TIMEOUT, ["Error generating hooks: timed out"])
+    hashtags = _result_within(hashtags_future, started, HASHTAG_TIMEOUT, list(DEFAULT_HASHTAGS))
+    # The post is always streamed from its own call, so this is separate mode whatever was asked for
+    yield sse_event('done', {'post': post, 'hooks': hooks, 'hashtags': hashtags, 'mode': 'separate',
+                             'usage': usage.as_dict(), 'success': True})
+
+def run_generation(params):
+    """Generate content for a parsed payload. Returns (response body, HTTP status).
+
+    Identical payloads already being generated are joined rather than repeated.
+    """
+    key = coalesce_key(params)
+    if key is None:
+        with fresh_sample(params['fresh']):
+            return _run_generation(params)
+    (body, status), shared = single_flight.do(key, lambda: _run_generation(params))
+    return (shared_result(body) if shared else body), status
+
+def _run_generation(params):
+    post_type = params['post_type']
+    topic = params['topic']
+    audience, goal, tone, length = params['audience'], params['goal'], params['tone'], params['length']
+    keywords_str, cta = params['keywords'], params['cta']
+    variants = params['variants']
+    if variants is None:
+        return {'error': f'variants must be a whole number from 1 to {GENERATION_MAX_VARIANTS}'}, 400
+
+    if post_type == 'text':
+        if not topic:
+            return {'error': 'Topic is required'}, 400
+        # Combined mode has no multi-draft form; variants always use separate calls
+        mode = params['mode'] if variants == 1 else 'separate'
+        with track_usage() as usage, similar_topic_scope(params):
+            result = None
+            if mode == 'combined':
+                result = generate_combined(topic, audience, goal, tone, length, keywords_str, cta)
+                if result is None:
+                    mode = 'combined_fallback'
+            if result is None:
+                result = generate_text_post(topic, audience, goal, tone, length, keywords_str, cta, variants)
+        post, hooks, hashtags = result
+        body = {'post': post, 'hooks': hooks, 'hashtags': hashtags, 'mode': mode,
+                'usage': usage.as_dict(), 'success': True}
+        if variants > 1:
+            body['post'], body['variants'] = post[0]['post'], post
+        return body, 200
+
+    elif post_type == 'carousel':
+        if not topic:
+            return {'error': 'Topic is required'}, 400
+        with track_usage() as usage, similar_topic_scope(params):
+            if variants > 1:
+                drafts = generate_carousel_variants(variants, topic)
+                slides = drafts[0]['slides']
+            else:
+                drafts, slides = None, generate_carousel(topic)
+        body = {'slides': slides, 'carousel': parse_carousel(slides), 'usage': usage.as_dict(), 'success': True}
+        if drafts is not None:
+            body['variants'] = drafts
+        return body, 200
+
+    elif post_type == 'template':
+        template_name = params['template_name']
+        template = get_template(template_name)
+        if template is None:
+            return {'error': f'Template "{template_name}" not found'}, 404
+        return {'template': template, 'success': True}, 200
+
+    return {'error': 'Invalid post type'}, 400
+
+def run_admitted(params, wait=False):
+    """run_generation under a generation slot, for work admitted as a whole (batch items, jobs).
+
+    Their client quota was charged on submit, so only the in-flight limit
+    applies. A rejected slot (queue full or timed out) gives a 503 body, or
+    with `wait` is retried after its Retry-After.
+    """
+    if params['post_type'] == 'template':
+        return run_generation(params)
+    while True:
+        admitted = admission.enter(None)
+        if not admitted.status:
+            break
+        if not wait:
+            body, status, _ = admission_error(admitted)
+            return body, status
+        time.sleep(admitted.retry_after)
+    try:
+        return run_generation(params)
+    finally:
+        admitted.release()
+
+def _run_batch_item(index, item):
+    result = {'index': index}
+    if isinstance(item, dict) and 'id' in item:
+        result['id'] = item['id']
+    if not isinstance(item, dict) or not item:
+        result.update({'status': 400, 'error': 'No data provided'})
+        return result
+    try:
+        body, status = run_admitted(parse_generation_request(item))
+    except Exception as e:
+        body, status = {'error': str(e)}, 500
+    result['status'] = status
+    if status == 200:
+        result['result'] = body
+    else:
+        result['error'] = body.get('error')
+    return result
+
+def run_batch(items, concurrency=BATCH_CONCURRENCY):
+    """Generate every item with bounded concurrency, yielding results as they finish.
+
+    Each result carries the item's position (and its `id`, if given). A failing
+    item yields an error result instead of stopping the batch. Closing the
+    generator early (the client went away) cancels the items not started yet.
+    """
+    concurrency = max(1, min(int(concurrency), BATCH_MAX_CONCURRENCY))
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    try:
+        futures = [pool.submit(_run_batch_item, i, item) for i, item in enumerate(items)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class MemoryJobStore:
+    """Job records in a dict. Finished jobs are dropped JOB_TTL seconds after they finish."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+            self._purge(time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _purge(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] + self.ttl < now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+class SQLiteJobStore:
+    """Job records in a SQLite file, so any process sharing it can answer GET /jobs/<id>."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL)")
+        self._conn.commit()
+
+    def save(self, job):
+        expires = job["finished_at"] + self.ttl if job["finished_at"] is not None else None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO jobs (id, data, expires) VALUES (?, ?, ?)",
+                               (job["id"], json.dumps(job), expires))
+            self._conn.execute("DELETE FROM jobs WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+def callback_url_error(url):
+    """Why `url` may not receive job callbacks, or None if it may.
+
+    Checked when a job is submitted and again before each delivery, since the
+    host's DNS answer can change in between.
+    """
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        return 'callback_url must be an http(s) URL'
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return 'callback_url is not a valid URL'
+    if not host:
+        return 'callback_url must be an http(s) URL'
+    if CALLBACK_ALLOWED_HOSTS:
+        return None if host.lower() in CALLBACK_ALLOWED_HOSTS else 'callback_url host is not in CALLBACK_ALLOWED_HOSTS'
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        return 'callback_url host could not be resolved'
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            return 'callback_url must resolve to a public address'
+    return None
+
+class JobQueueFull(Exception):
+    """The job queue is at JOB_QUEUE_SIZE; the client should retry later."""
+
+class JobQueue:
+    """Bounded priority queue of generation jobs served by a pool of worker threads.
+
+    Lower priority numbers run first; equal priorities run in submission order.
+    Workers start on the first submission. A full queue rejects new jobs
+    instead of growing, so callers get backpressure (503) rather than timeouts.
+    """
+    PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+    def __init__(self, store, workers, max_size):
+        self.store = store
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = queue.PriorityQueue(maxsize=max_size)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def submit(self, payload, priority="normal", callback_url=None):
+        """Queue a /generate payload. Returns the job record or raises JobQueueFull."""
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex, "status": "queued", "priority": priority,
+            "created_at": now, "started_at": None, "finished_at": None,
+            "http_status": None, "result": None, "error": None,
+            "callback_url": callback_url, "callback": None,
+        }
+        self.store.save(job)
+        try:
+            self._queue.put_nowait((self.PRIORITIES[priority], next(self._sequence), job["id"], payload, time.monotonic()))
+        except queue.Full:
+            self.store.delete(job["id"])
+            with self._lock:
+                self.rejected += 1
+            metrics.inc("linkedin_jobs_total", status="rejected")
+            raise JobQueueFull(f"Job queue is full ({self.max_size} jobs waiting)")
+        with self._lock:
+            self.submitted += 1
+        self._start_workers()
+        return job
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, job_id, payload, queued_at = self._queue.get()
+            try:
+                self._run(job_id, payload, queued_at)
+            except Exception as e:
+                log_event("JOB ERROR", f"Job: {job_id}, Error: {str(e)}", job_id=job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id, payload, queued_at):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        # Log lines for the job's upstream calls carry the job ID
+        _request_id.set(job_id)
+        metrics.observe("linkedin_job_wait_seconds", time.monotonic() - queued_at, priority=job["priority"])
+        job.update(status="running", started_at=time.time())
+        self.store.save(job)
+
+        started = time.perf_counter()
+        try:
+            body, status = run_admitted(parse_generation_request(payload), wait=True)
+        except Exception as e:
+            body, status = {'error': str(e)}, 500
+        metrics.observe("linkedin_job_run_seconds", time.perf_counter() - started)
+
+        succeeded = status == 200
+        job.update(status="succeeded" if succeeded else "failed", finished_at=time.time(), http_status=status,
+                   result=body if succeeded else None, error=None if succeeded else body.get('error'))
+        with self._lock:
+            if succeeded:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        metrics.inc("linkedin_jobs_total", status=job["status"])
+        if job["callback_url"]:
+            job["callback"] = self._deliver(job)
+        self.store.save(job)
+
+    def _deliver(self, job, attempts=3):
+        """POST the finished job to its callback URL, retrying with backoff on errors and 5xx."""
+        payload = {key: value for key, value in job.items() if key != "callback"}
+        error = callback_url_error(job["callback_url"])
+        if error:
+            log_event("CALLBACK ERROR", f"Job: {job['id']}, URL: {job['callback_url']}, Result: {error}", job_id=job["id"])
+            return {"error": error, "attempts": 0}
+        last = None
+        for attempt in range(attempts):
+            try:
+                # Redirects are not followed: they could point anywhere
+                response = get_http_session().post(job["callback_url"], json=payload, allow_redirects=False,
+                                             timeout=(HTTP_CONNECT_TIMEOUT, JOB_CALLBACK_TIMEOUT))
+                last = {"status": response.status_code, "attempts": attempt + 1}
+                if response.status_code < 500:
+                    return last
+            except requests.exceptions.RequestException as e:
+                last = {"error": str(e), "attempts": attempt + 1}
+            if attempt < attempts - 1:
+                time.sleep(2 ** attempt)
+        log_event("CALLBACK ERROR", f"Job: {job['id']}, URL: {job['callback_url']}, Result: {last}", job_id=job["id"])
+        return last
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_size": self.max_size,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "store": self.store.path if isinstance(self.store, SQLiteJobStore) else "memory",
+            }
+
+job_queue = JobQueue(
+    SQLiteJobStore(JOB_STORE_PATH, JOB_TTL) if JOB_STORE_PATH else MemoryJobStore(JOB_TTL),
+    JOB_WORKERS, JOB_QUEUE_SIZE,
+)
+
+# Admission control
+# Generation routes pass through here before any work starts. Each client has a
+# token bucket (keyed by a known API key, otherwise by IP). At most
+# ADMISSION_MAX_IN_FLIGHT generations run at once; later requests wait in a
+# bounded FIFO queue until their deadline. Requests that cannot be served in
+# time are turned away at once with 429 (client over quota) or 503 (server
+# busy) and a Retry-After, instead of piling up behind upstream backoffs.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(GENERATION_WORKERS)))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", str(GENERATION_WORKERS * 2)))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# CLIENT_RATE_LIMIT_RPS = 0 turns per-client quotas off
+CLIENT_RATE_LIMIT_RPS = float(os.getenv("CLIENT_RATE_LIMIT_RPS", "0"))
+CLIENT_RATE_LIMIT_BURST = float(os.getenv("CLIENT_RATE_LIMIT_BURST", "10"))
+# X-API-Key values that identify a client for quotas; other requests are keyed by IP
+CLIENT_API_KEYS = frozenset(k.strip() for k in os.getenv("CLIENT_API_KEYS", "").split(",") if k.strip())
+# Take the client IP from the proxy: X-Real-IP (set by Vercel), else the right-most
+# X-Forwarded-For entry - the one the proxy appended. Entries to its left come from
+# the client and could be rotated to get a fresh quota.
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "1" if os.getenv("VERCEL") else "0") == "1"
+
+def client_id(headers, remote_addr):
+    """Quota key for a request: "key:<hash>" for a known API key, else "ip:<address>"."""
+    api_key = headers.get("X-API-Key")
+    if api_key and api_key in CLIENT_API_KEYS:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if TRUST_PROXY_HEADERS:
+        address = (headers.get("X-Real-IP") or "").strip() or (headers.get("X-Forwarded-For") or "").split(",")[-1].strip()
+        if address:
+            return "ip:" + address
+    return "ip:" + (remote_addr or "unknown")
+
+class ClientQuotas:
+    """Token bucket per client: `rate` requests per second with bursts up to `burst`."""
+    MAX_CLIENTS = 10000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, client):
+        """Spend one token. Returns 0 when allowed, else seconds until the next token."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_CLIENTS:
+                self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        full_after = self.burst / self.rate
+        for client in [c for c, (_, updated) in self._buckets.items() if now - updated > full_after]:
+            del self._buckets[client]
+
+class Admission:
+    """Outcome of AdmissionController.enter: admitted (status None) or rejected with a status."""
+
+    def __init__(self, controller=None, status=None, reason=None, retry_after=0):
+        self._controller = controller
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        self._started = time.monotonic()
+
+    def release(self):
+        controller, self._controller = self._controller, None
+        if controller is not None:
+            controller.release(time.monotonic() - self._started)
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(True))
+        else:
+            self.event.set()
+
+class AdmissionController:
+    """In-flight limit with a bounded FIFO wait queue and per-client quotas.
+
+    A finished request hands its slot straight to the oldest waiter. A request
+    whose estimated wait (queue position x average generation time / slots)
+    runs past its deadline is rejected on arrival rather than after waiting.
+    """
+    ALPHA = 0.2
+
+    def __init__(self, max_in_flight, queue_size, queue_timeout, quotas):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.quotas = quotas
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._service_time = None
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = {"quota": 0, "queue_full": 0, "deadline": 0, "timeout": 0}
+
+    def _reject(self, status, reason, retry_after):
+        with self._lock:
+            self.shed[reason] += 1
+        metrics.inc("linkedin_admission_total", outcome="shed", reason=reason)
+        log_event("SHED", reason=reason, status=status)
+        return Admission(status=status, reason=reason, retry_after=max(1, math.ceil(retry_after)))
+
+    def _busy_retry_after(self):
+        # Time for the current queue to drain, assuming one second per request before anything finishes
+        service = self._service_time or 1.0
+        return (len(self._waiters) + 1) * service / max(1, self.max_in_flight)
+
+    def _arrive(self, client, slot, loop=None):
+        """Returns an Admission (decided now) or a _Waiter to wait on."""
+        wait = self.quotas.take(client) if client is not None else 0
+        if wait:
+            return self._reject(429, "quota", wait)
+        if not slot or self.max_in_flight <= 0:
+            return Admission()
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                metrics.inc("linkedin_admission_total", outcome="admitted")
+                return Admission(self)
+            if len(self._waiters) >= self.queue_size:
+                reason = "queue_full"
+            elif self._service_time is not None and self._busy_retry_after() > self.queue_timeout:
+                reason = "deadline"
+            else:
+                waiter = _Waiter(loop)
+                self._waiters.append(waiter)
+                self.queued += 1
+                metrics.inc("linkedin_admission_total", outcome="queued")
+                return waiter
+            retry_after = self._busy_retry_after()
+        return self._reject(503, reason, retry_after)
+
+    def _settle(self, waiter, waited):
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                metrics.inc("linkedin_admission_total", outcome="admitted")
+                metrics.observe("linkedin_admission_wait_seconds", waited)
+                return Admission(self)
+            self._waiters.remove(waiter)
+            retry_after = self._busy_retry_after()
+        return self._reject(503, "timeout", retry_after)
+
+    def enter(self, client, slot=True):
+        """Admit a request from `client`, waiting for a slot if needed.
+
+        `slot=False` checks the quota only; `client=None` skips it (work whose
+        quota was charged when it was submitted).
+        """
+        waiter = self._arrive(client, slot)
+        if isinstance(waiter, Admission):
+            return waiter
+        started = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        return self._settle(waiter, time.monotonic() - started)
+
+    async def aenter(self, client, slot=True):
+        waiter = self._arrive(client, slot, asyncio.get_running_loop())
+        if isinstance(waiter, Admission):
+            return waiter
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._settle(waiter, time.monotonic() - started)
+
+    def release(self, seconds):
+        with self._lock:
+            self._service_time = seconds if self._service_time is None else \
+                self.ALPHA * seconds + (1 - self.ALPHA) * self._service_time
+            if self._waiters:
+                # The slot passes to the oldest waiter; in_flight stays the same
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued_now": len(self._waiters),
+                "queue_size": self.queue_size,
+                "queue_timeout": self.queue_timeout,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shed": dict(self.shed),
+                "avg_generation_seconds": round(self._service_time, 4) if self._service_time is not None else None,
+                "client_rate_limit_rps": self.quotas.rate,
+            }
+
+admission = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT,
+                                ClientQuotas(CLIENT_RATE_LIMIT_RPS, CLIENT_RATE_LIMIT_BURST))
+
+def admission_error(result):
+    """Body, status and headers for a rejected Admission."""
+    if result.status == 429:
+        message = 'Too many requests from this client - please slow down'
+    else:
+        message = 'Server is busy - please try again shortly'
+    return {'error': message, 'reason': result.reason, 'retry_after': result.retry_after}, result.status, \
+        {'Retry-After': str(result.retry_after)}
+
+def admit_request(params=None):
+    """Admission for the current Flask request. Templates need no generation slot."""
+    slot = params is not None and params['post_type'] != 'template'
+    return admission.enter(client_id(request.headers, request.remote_addr), slot)
 
 @app.route('/generate', methods=['POST', 'OPTIONS'])
 def generate():
@@ -512,49 +3949,842 @@ def generate():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
 
-        post_type = data.get('post_type', 'text')
-        topic = data.get('topic', '').strip()
-        audience = data.get('audience', 'professionals').strip() or 'professionals'
-        goal = data.get('goal', 'educate').strip() or 'educate'
-        tone = data.get('tone', 'professional')
-        length = data.get('length', 150)
-        keywords = data.get('keywords', [])
-        cta = data.get('cta', '').strip()
-
-        if isinstance(keywords, str):
-            keywords = [k.strip() for k in keywords.split(',') if k.strip()]
-        keywords_str = ', '.join(keywords) if keywords else ''
-
-        if post_type == 'text':
-            if not topic:
-                return jsonify({'error': 'Topic is required'}), 400
-            post = generate_linkedin_post(topic, audience, goal, tone, length, keywords_str, cta)
-            hooks = generate_hooks(topic)
-            hashtags = suggest_hashtags(topic)
-            return jsonify({'post': post, 'hooks': hooks, 'hashtags': hashtags, 'success': True})
-
-        elif post_type == 'carousel':
-            if not topic:
-                return jsonify({'error': 'Topic is required'}), 400
-            slides = generate_carousel(topic)
-            return jsonify({'slides': slides, 'success': True})
-
-        elif post_type == 'template':
-            template_name = data.get('template_name', 'personal_story')
-            template = get_template(template_name)
-            if template is None:
-                return jsonify({'error': f'Template "{template_name}" not found'}), 404
-            return jsonify({'template': template, 'success': True})
-
-        return jsonify({'error': 'Invalid post type'}), 400
+        params = parse_generation_request(data)
+        admitted = admit_request(params)
+        if admitted.status:
+            body, status, headers = admission_error(admitted)
+            return jsonify(body), status, headers
+        try:
+            body, status = run_generation(params)
+        finally:
+            admitted.release()
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/generate/stream', methods=['POST', 'OPTIONS'])
+def generate_stream():
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'ok'})
+
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    params = parse_generation_request(data)
+    if params['post_type'] == 'template' or params['variants'] != 1:
+        # Nothing to stream - templates are static, and drafts can only be ranked once all are in
+        return generate()
+    if params['post_type'] not in ('text', 'carousel'):
+        return jsonify({'error': 'Invalid post type'}), 400
+    if not params['topic']:
+        return jsonify({'error': 'Topic is required'}), 400
+
+    admitted = admit_request(params)
+    if admitted.status:
+        body, status, headers = admission_error(admitted)
+        return jsonify(body), status, headers
+
+    # The slot is held until the stream ends (or the client goes away)
+    def events():
+        try:
+            yield from stream_generation(params)
+        finally:
+            admitted.release()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/generate/batch', methods=['POST', 'OPTIONS'])
+def generate_batch():
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'ok'})
+
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {BATCH_MAX_ITEMS})'}), 400
+    concurrency = data.get('concurrency', BATCH_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return jsonify({'error': 'concurrency must be a positive integer'}), 400
+    # The quota is charged once for the batch; each item takes its own generation slot
+    admitted = admit_request()
+    if admitted.status:
+        body, status, headers = admission_error(admitted)
+        return jsonify(body), status, headers
+
+    # Newline-delimited JSON: one line per item as it finishes, then a summary line
+    def results():
+        started = time.monotonic()
+        failed = 0
+        for result in run_batch(items, concurrency):
+            failed += result['status'] != 200
+            yield json.dumps(result) + "\n"
+        summary = {'total': len(items), 'succeeded': len(items) - failed, 'failed': failed,
+                   'elapsed_seconds': round(time.monotonic() - started, 3)}
+        yield json.dumps({'summary': summary}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['GET', 'POST', 'OPTIONS'])
+def jobs():
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'ok'})
+    if request.method == 'GET':
+        return jsonify({'queue': job_queue.stats(), 'success': True})
+
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    priority = data.get('priority', 'normal')
+    if priority not in JobQueue.PRIORITIES:
+        return jsonify({'error': 'priority must be one of: ' + ', '.join(JobQueue.PRIORITIES)}), 400
+    callback_url = data.get('callback_url')
+    error = callback_url_error(callback_url) if callback_url is not None else None
+    if error:
+        return jsonify({'error': error}), 400
+
+    # The quota is charged on submit; the job takes a generation slot when it runs
+    admitted = admit_request()
+    if admitted.status:
+        body, status, headers = admission_error(admitted)
+        return jsonify(body), status, headers
+
+    payload = {key: value for key, value in data.items() if key not in ('priority', 'callback_url')}
+    try:
+        job = job_queue.submit(payload, priority, callback_url)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    return jsonify({'job_id': job['id'], 'status': job['status'], 'url': f"/jobs/{job['id']}", 'success': True}), 202, \
+        {'Location': f"/jobs/{job['id']}"}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job, 'success': True})
+
+def conditional_json(etag, build):
+    """JSON response validated by `etag`; `build` only runs when the client's copy is stale."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.headers.pop('Content-Type', None)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _positive_int(value, default, maximum=None):
+    if value is None or value == '':
+        return default
+    number = int(value)
+    if number < 1:
+        raise ValueError
+    return min(number, maximum) if maximum else number
+
 @app.route('/templates')
 def list_templates():
-    return jsonify({'templates': list(templates.keys()), 'success': True})
+    """Paginated template listing, filtered by `category`, `tag` (comma-separated, all must match) and `q`."""
+    try:
+        page = _positive_int(request.args.get('page'), 1)
+        per_page = _positive_int(request.args.get('per_page'), TEMPLATE_PAGE_SIZE, TEMPLATE_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be positive integers'}), 400
+    category = request.args.get('category', '').strip().lower() or None
+    tags = sorted({tag.strip().lower() for tag in request.args.get('tag', '').split(',') if tag.strip()})
+    q = request.args.get('q', '').strip() or None
+
+    index = template_store.index()
+    query = json.dumps([index.etag, category, tags, q, page, per_page])
+    etag = hashlib.sha256(query.encode("utf-8")).hexdigest()[:20]
+
+    def build():
+        names = index.query(category, tags, q)
+        selected = names[(page - 1) * per_page:page * per_page]
+        return {
+            'templates': selected,
+            'items': [{key: index.records[name][key] for key in ('name', 'category', 'tags', 'hook')} for name in selected],
+            'total': len(names),
+            'page': page,
+            'per_page': per_page,
+            'pages': (len(names) + per_page - 1) // per_page,
+            'success': True,
+        }
+    return conditional_json(etag, build)
+
+@app.route('/templates/<name>')
+def template_detail(name):
+    record = template_store.get(name)
+    if record is None:
+        return jsonify({'error': f'Template "{name}" not found'}), 404
+    return conditional_json(record['etag'], lambda: {
+        'template': {key: value for key, value in record.items() if key != 'etag'}, 'success': True})
+
+@app.route('/models')
+def model_health():
+    return jsonify({'strategy': model_router.strategy, 'configured': api_models(),
+                    'models': model_router.stats(), 'rate_limits': rate_limiter.stats(), 'success': True})
+
+@app.route('/admission')
+def admission_stats():
+    return jsonify({'admission': admission.stats(), 'success': True})
+
+@app.route('/cache')
+def cache_stats():
+    return jsonify({'cache': response_cache.stats(), 'coalescing': single_flight.stats(),
+                    'prompt_tokens': prompt_token_stats.stats(), 'hashtags': hashtag_engine.stats(),
+                    'similar_topics': similar_topics.stats(), 'success': True})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    cache = response_cache.stats()
+    gauges = [
+        ("linkedin_cache_hits_total", {}, cache["hits"] + cache["backend_hits"]),
+        ("linkedin_cache_misses_total", {}, cache["misses"]),
+        ("linkedin_cache_entries", {}, cache["entries"]),
+        ("linkedin_job_queue_depth", {}, job_queue.depth()),
+        ("linkedin_coalesced_requests_total", {}, single_flight.stats()["followers"]),
+        ("linkedin_templates", {}, len(template_store.index().names)),
+    ]
+    slots = admission.stats()
+    gauges += [
+        ("linkedin_admission_in_flight", {}, slots["in_flight"]),
+        ("linkedin_admission_queue_depth", {}, slots["queued_now"]),
+    ]
+    pool = http_pool_stats()
+    gauges += [
+        ("linkedin_http_pool_requests_total", {}, pool["requests"]),
+        ("linkedin_http_pool_connections_new_total", {}, pool["new_connections"]),
+        ("linkedin_http_pool_connections_reused_total", {}, pool["reused_connections"]),
+    ]
+    for model, state in model_router.stats().items():
+        gauges.append(("linkedin_model_circuit_open", {"model": model}, int(state["circuit"] == "open")))
+    for model, state in rate_limiter.stats().items():
+        gauges.append(("linkedin_rate_limit_rejected_total", {"model": model}, state["rejected"]))
+    return Response(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Async serving mode
+# One event loop holds many in-flight generations: upstream calls go through an
+# async HTTP client instead of pinning a worker thread each. /generate is served
+# natively; every other route is passed through to the Flask app on a thread.
+_async_clients = {}
+_async_client_turn = itertools.count()
+# httpcore scans its whole pool on every request, which gets quadratic past a few
+# dozen connections, so the connection budget is spread over small client shards
+ASYNC_POOL_SHARD = 16
+
+def async_http_client():
+    """Pooled httpx.AsyncClient for the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("Async mode requires httpx - pip install -r requirements-async.txt")
+        shard = min(ASYNC_POOL_SHARD, ASYNC_MAX_CONNECTIONS)
+        ssl_context = httpx.create_ssl_context()
+        clients = _async_clients[loop] = [
+            httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=shard, max_keepalive_connections=shard),
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                verify=ssl_context,
+            )
+            for _ in range(max(1, ASYNC_MAX_CONNECTIONS // shard))
+        ]
+    return clients[next(_async_client_turn) % len(clients)]
+
+async def close_async_clients():
+    for client in _async_clients.pop(asyncio.get_running_loop(), []):
+        await client.aclose()
+
+async def _acall_model(model, messages, max_tokens, temperature, headers, max_retries, deadline, n=1):
+    """Async version of _call_model."""
+    import httpx
+
+    client = async_http_client()
+    data = {
+        "model": model,
+        "messages": upstream_messages(model, messages),
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    if n > 1:
+        data["n"] = n
+
+    last_error = None
+    for attempt in range(max_retries):
+        if not await rate_limiter.acquire_async(model, deadline):
+            raise ModelCallError("Rate limit exceeded - please try again in a moment")
+        started = time.perf_counter()
+        try:
+            response = await client.post(API_BASE_URL, headers=headers, json=data)
+            if response.status_code != 200:
+                record_upstream_attempt(model, response.status_code, time.perf_counter() - started, attempt)
+
+            if response.status_code == 429:
+                rate_limiter.penalize(model, parse_retry_after(response.headers.get('Retry-After')))
+                last_error = "Rate limit exceeded - please try again in a moment"
+                continue
+
+            if response.status_code == 402:
+                raise ModelCallError("Credits exhausted")
+
+            if response.status_code >= 400:
+                error_detail = ""
+                try:
+                    error_json = response.json()
+                    error_detail = error_json.get("error", {}).get("message", str(error_json))
+                except:
+                    error_detail = response.text[:200]
+                log_event("API ERROR", f"Model: {model}, Status: {response.status_code}, Response: {error_detail}", model=model, status=response.status_code)
+                raise ModelCallError(f"API error {response.status_code}: {error_detail}")
+
+            rate_limiter.record_success(model)
+            result = response.json()
+            record_upstream_attempt(model, 200, time.perf_counter() - started, attempt, result.get("usage"))
+            if n > 1:
+                return [choice["message"]["content"] for choice in result["choices"]], result.get("usage")
+            return result["choices"][0]["message"]["content"], result.get("usage")
+
+        except httpx.HTTPError as e:
+            record_upstream_attempt(model, "network_error", time.perf_counter() - started, attempt)
+            log_event("NETWORK ERROR", f"Model: {model}, Error: {str(e)}", model=model)
+            last_error = f"Request failed: {str(e)}"
+            wait_time = (2 ** attempt)
+            if attempt < max_retries - 1 and time.monotonic() + wait_time < deadline:
+                record_upstream_wait(model, "backoff", wait_time)
+                await asyncio.sleep(wait_time)
+                continue
+            break
+
+    raise ModelCallError(last_error)
+
+async def _arace(tasks, deadline):
+    last_error = None
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            for task in pending:
+                task.cancel()
+            raise ModelCallError("Timed out waiting for hedged attempts")
+        for task in done:
+            try:
+                return task.result(), tasks[task]
+            except ModelCallError as e:
+                last_error = e
+    raise last_error
+
+async def _acall_models(models, attempt, deadline):
+    """Async version of _call_models, including hedging."""
+    last_error = ModelCallError("No models configured")
+    i = 0
+    while i < len(models):
+        model = models[i]
+        if ROUTER_HEDGE_AFTER > 0 and i + 1 < len(models):
+            primary = asyncio.ensure_future(attempt(model))
+            done, _ = await asyncio.wait({primary}, timeout=ROUTER_HEDGE_AFTER)
+            if done:
+                try:
+                    return primary.result(), model
+                except ModelCallError as e:
+                    last_error = e
+                    i += 1
+                    continue
+            backup = models[i + 1]
+            model_router.record_hedge(model)
+            try:
+                return await _arace({primary: model, asyncio.ensure_future(attempt(backup)): backup},
+                                    attempt_deadline(deadline))
+            except ModelCallError as e:
+                last_error = e
+                i += 2
+                continue
+        try:
+            return await attempt(model), model
+        except ModelCallError as e:
+            last_error = e
+            i += 1
+    raise last_error
+
+async def acall_api(messages, max_tokens=600, temperature=0.7, max_retries=5, endpoint=None):
+    """Async version of call_api. Shares the cache, rate limiter and router with it."""
+    headers = api_headers()
+    models = api_models()
+
+    cache_ttl = cache_ttl_for(endpoint)
+    if cache_ttl > 0:
+        cached = response_cache.lookup([cache_key(m, messages, max_tokens, temperature) for m in models])
+        if cached is not None:
+            record_cache_hit()
+            return cached
+
+    deadline = time.monotonic() + UPSTREAM_DEADLINE
+
+    async def attempt(model):
+        started = time.monotonic()
+        try:
+            result = await _acall_model(model, messages, max_tokens, temperature, headers, max_retries, deadline)
+        except ModelCallError as e:
+            model_router.record_failure(model, str(e))
+            raise
+        model_router.record_success(model, time.monotonic() - started)
+        return result
+
+    try:
+        (content, usage), model = await _acall_models(model_router.order(models), attempt, deadline)
+    except ModelCallError as e:
+        raise ValueError(f"All models failed. {e}. Please check your API key and credits.")
+
+    record_usage(usage)
+    if cache_ttl > 0 and content:
+        response_cache.set(cache_key(model, messages, max_tokens, temperature), content, cache_ttl)
+    return content
+
+async def acall_api_n(messages, n, max_tokens=600, temperature=0.7, max_retries=5):
+    """Async version of call_api_n."""
+    headers = api_headers()
+    models = model_router.order(api_models())
+    if not models or is_single_choice(models[0]):
+        return await _acall_api_each(messages, n, max_tokens, temperature, max_retries)
+
+    deadline = time.monotonic() + UPSTREAM_DEADLINE
+
+    async def attempt(model):
+        started = time.monotonic()
+        try:
+            try:
+                result = await _acall_model(model, messages, max_tokens, temperature, headers, max_retries, deadline, n=n)
+            except ModelCallError as e:
+                if n_rejected(e):
+                    _note_single_choice(model, 0)
+                    return [], None
+                if not str(e).startswith("API error 400"):
+                    raise
+                content, usage = await _acall_model(model, messages, max_tokens, temperature, headers, max_retries,
+                                                    deadline)
+                _note_single_choice(model, 0)
+                result = [content], usage
+        except ModelCallError as e:
+            model_router.record_failure(model, str(e))
+            raise
+        model_router.record_success(model, time.monotonic() - started)
+        return result
+
+    try:
+        (contents, usage), model = await _acall_models(models, attempt, deadline)
+    except ModelCallError as e:
+        raise ValueError(f"All models failed. {e}. Please check your API key and credits.")
+
+    if usage is not None:
+        record_usage(usage)
+    contents = [content for content in contents if content]
+    if len(contents) < n:
+        if contents:
+            _note_single_choice(model, len(contents))
+        contents += await _acall_api_each(messages, n - len(contents), max_tokens, temperature, max_retries)
+    return contents
+
+async def _acall_api_each(messages, n, max_tokens, temperature, max_retries):
+    results = await asyncio.gather(*(acall_api(messages, max_tokens, temperature, max_retries) for _ in range(n)),
+                                   return_exceptions=True)
+    contents = [result for result in results if isinstance(result, str)]
+    if not contents:
+        raise next(result for result in results if isinstance(result, BaseException))
+    return contents
+
+@timed_stage("post")
+async def agenerate_linkedin_post(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
+    try:
+        messages = post_messages(topic, audience, goal, tone, length, keywords, cta)
+        return finish_post(await acall_api(messages, max_tokens=600, temperature=0.7, endpoint="post"))
+    except Exception as e:
+        return f"Error generating post: {str(e)}"
+
+@timed_stage("hooks")
+async def agenerate_hooks(topic, num=5):
+    hooks = similar_topics.find("hooks", topic, num)
+    if hooks is not None:
+        return hooks
+    try:
+        content = await acall_api(hooks_messages(topic, num), max_tokens=1300, temperature=0.8, endpoint="hooks")
+        hooks = finish_hooks(content, num)
+        if hooks != ["Hook generation failed."]:
+            similar_topics.add("hooks", topic, hooks, num)
+        return hooks
+    except Exception as e:
+        return [f"Error generating hooks: {str(e)}"]
+
+@timed_stage("hashtags")
+async def asuggest_hashtags(topic):
+    hashtags = hashtag_engine.suggest(topic)
+    if hashtags is not None:
+        return hashtags
+    try:
+        content = await acall_api(hashtags_messages(topic), max_tokens=100, temperature=0.5, endpoint="hashtags")
+        hashtags = finish_hashtags(content)
+        hashtag_engine.learn(topic, hashtags)
+        return hashtags
+    except Exception as e:
+        return list(DEFAULT_HASHTAGS)
+
+@timed_stage("carousel")
+async def agenerate_carousel(topic, slides=5):
+    carousel = similar_topics.find("carousel", topic, slides)
+    if carousel is not None:
+        return carousel
+    try:
+        messages = carousel_messages(topic, slides)
+        carousel = finish_carousel(await acall_api(messages, max_tokens=800, temperature=0.7, endpoint="carousel"))
+        if carousel != "Error generating carousel content.":
+            similar_topics.add("carousel", topic, carousel, slides)
+        return carousel
+    except Exception as e:
+        return f"Error generating carousel: {str(e)}"
+
+@timed_stage("post")
+async def agenerate_post_variants(n, topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta=""):
+    try:
+        messages = post_messages(topic, audience, goal, tone, length, keywords, cta)
+        return post_variants(await acall_api_n(messages, n, max_tokens=600, temperature=0.7), length)
+    except Exception as e:
+        return [{"post": f"Error generating post: {str(e)}", "score": 0.0}]
+
+@timed_stage("carousel")
+async def agenerate_carousel_variants(n, topic, slides=5):
+    try:
+        return carousel_variants(await acall_api_n(carousel_messages(topic, slides), n, max_tokens=800, temperature=0.7), slides)
+    except Exception as e:
+        return [{"slides": f"Error generating carousel: {str(e)}", "carousel": [], "score": 0.0}]
+
+@timed_stage("combined")
+async def agenerate_combined(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta="", num_hooks=5):
+    try:
+        messages = combined_messages(topic, audience, goal, tone, length, keywords, cta, num_hooks)
+        content = await acall_api(messages, max_tokens=1400, temperature=0.7, endpoint="combined")
+    except Exception as e:
+        log_event("COMBINED ERROR", str(e))
+        return None
+    result = finish_combined(content, num_hooks)
+    if result is not None:
+        hashtag_engine.learn(topic, result[2])
+    return result
+
+async def _aresult_within(task, started, timeout, fallback):
+    remaining = max(0.0, started + timeout - time.monotonic())
+    try:
+        return await asyncio.wait_for(task, remaining)
+    except Exception:
+        return fallback
+
+@timed_stage("text_post")
+async def agenerate_text_post(topic, audience="professionals", goal="educate", tone="professional", length="150-200", keywords="", cta="", variants=1):
+    """Async version of generate_text_post. Timed-out tasks are cancelled."""
+    generate_post = functools.partial(agenerate_post_variants, variants) if variants > 1 else agenerate_linkedin_post
+    timed_out = "Error generating post: timed out"
+    if variants > 1:
+        timed_out = [{"post": timed_out, "score": 0.0}]
+
+    if not PARALLEL_GENERATION:
+        post = await generate_post(topic, audience, goal, tone, length, keywords, cta)
+        return post, await agenerate_hooks(topic), await asuggest_hashtags(topic)
+
+    started = time.monotonic()
+    post_task = asyncio.ensure_future(generate_post(topic, audience, goal, tone, length, keywords, cta))
+    hooks_task = asyncio.ensure_future(agenerate_hooks(topic))
+    hashtags_task = asyncio.ensure_future(asuggest_hashtags(topic))
+
+    post = await _aresult_within(post_task, started, GENERATION_TIMEOUT, timed_out)
+    hooks = await _aresult_within(hooks_task, started, GENERATION_TIMEOUT, ["Error generating hooks: timed out"])
+    hashtags = await _aresult_within(hashtags_task, started, HASHTAG_TIMEOUT, list(DEFAULT_HASHTAGS))
+    return post, hooks, hashtags
+
+async def arun_generation(params):
+    """Async version of run_generation."""
+    key = coalesce_key(params)
+    if key is None:
+        with fresh_sample(params['fresh']):
+            return await _arun_generation(params)
+    (body, status), shared = await single_flight.do_async(key, lambda: _arun_generation(params))
+    return (shared_result(body) if shared else body), status
+
+async def _arun_generation(params):
+    post_type = params['post_type']
+    topic = params['topic']
+    audience, goal, tone, length = params['audience'], params['goal'], params['tone'], params['length']
+    keywords_str, cta = params['keywords'], params['cta']
+    variants = params['variants']
+    if variants is None:
+        return {'error': f'variants must be a whole number from 1 to {GENERATION_MAX_VARIANTS}'}, 400
+
+    if post_type == 'text':
+        if not topic:
+            return {'error': 'Topic is required'}, 400
+        # Combined mode has no multi-draft form; variants always use separate calls
+        mode = params['mode'] if variants == 1 else 'separate'
+        with track_usage() as usage, similar_topic_scope(params):
+            result = None
+            if mode == 'combined':
+                result = await agenerate_combined(topic, audience, goal, tone, length, keywords_str, cta)
+                if result is None:
+                    mode = 'combined_fallback'
+            if result is None:
+                result = await agenerate_text_post(topic, audience, goal, tone, length, keywords_str, cta, variants)
+        post, hooks, hashtags = result
+        body = {'post': post, 'hooks': hooks, 'hashtags': hashtags, 'mode': mode,
+                'usage': usage.as_dict(), 'success': True}
+        if variants > 1:
+            body['post'], body['variants'] = post[0]['post'], post
+        return body, 200
+
+    elif post_type == 'carousel':
+        if not topic:
+            return {'error': 'Topic is required'}, 400
+        with track_usage() as usage, similar_topic_scope(params):
+            if variants > 1:
+                drafts = await agenerate_carousel_variants(variants, topic)
+                slides = drafts[0]['slides']
+            else:
+                drafts, slides = None, await agenerate_carousel(topic)
+        body = {'slides': slides, 'carousel': parse_carousel(slides), 'usage': usage.as_dict(), 'success': True}
+        if drafts is not None:
+            body['variants'] = drafts
+        return body, 200
+
+    return _run_generation(params)
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+]
+
+async def _asgi_read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def _asgi_json(send, body, status=200, headers=None):
+    # Same serialization as Flask's jsonify
+    raw = (json.dumps(body, sort_keys=True, separators=(",", ":")) + "\n").encode()
+    extra = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b'content-type', b'application/json'), (b'content-length', str(len(raw)).encode()), *CORS_HEADERS, *extra,
+        (b'x-request-id', (_request_id.get() or "").encode("latin-1"))]})
+    await send({"type": "http.response.body", "body": raw})
+    return status
+
+async def _asgi_generate(scope, receive, send):
+    """Async /generate with the same responses as the Flask route."""
+    started = time.perf_counter()
+    headers = dict(scope["headers"])
+    _request_id.set(headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex)
+    status = await _asgi_generate_response(scope, headers, await _asgi_read_body(receive), send)
+    record_request_metrics(scope["method"], "/generate", status, time.perf_counter() - started)
+
+async def _asgi_generate_response(scope, headers, body, send):
+    if scope["method"] == "OPTIONS":
+        return await _asgi_json(send, {'status': 'ok'})
+
+    try:
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if content_type.split(";")[0].strip() != "application/json":
+            raise ValueError("415 Unsupported Media Type: Did not attempt to load JSON data because the request Content-Type was not 'application/json'.")
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            raise ValueError(f"400 Bad Request: Failed to decode JSON object: {e}")
+        if not data:
+            return await _asgi_json(send, {'error': 'No data provided'}, 400)
+
+        params = parse_generation_request(data)
+        from werkzeug.datastructures import Headers
+        client = client_id(Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in headers.items()]),
+                           (scope.get("client") or ("",))[0])
+        admitted = await admission.aenter(client, params['post_type'] != 'template')
+        if admitted.status:
+            return await _asgi_json(send, *admission_error(admitted))
+        try:
+            result, status = await arun_generation(params)
+        finally:
+            admitted.release()
+        return await _asgi_json(send, result, status)
+
+    except Exception as e:
+        return await _asgi_json(send, {'error': str(e)}, 500)
+
+def _wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def _asgi_wsgi_bridge(scope, receive, send):
+    """Serve a request with the Flask app on a thread, streaming its response body."""
+    loop = asyncio.get_running_loop()
+    environ = _wsgi_environ(scope, await _asgi_read_body(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None
+
+    # The body has been read, so the next message is the client going away
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    # Every step runs in one context so streamed responses keep their Flask request context
+    ctx = contextvars.copy_context()
+    iterable = await loop.run_in_executor(None, ctx.run, app, environ, start_response)
+    watcher = asyncio.ensure_future(watch_disconnect())
+    chunks = iter(iterable)
+    done = object()
+    try:
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        while not disconnected.is_set():
+            chunk = await loop.run_in_executor(None, ctx.run, next, chunks, done)
+            if chunk is done:
+                break
+            if chunk and not disconnected.is_set():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        # Closing the body stops streamed work (batch items, generations) the client no longer wants
+        if hasattr(iterable, "close"):
+            await loop.run_in_executor(None, ctx.run, iterable.close)
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: `uvicorn index:asgi_app`."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_async_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/generate" and scope["method"] in ("POST", "OPTIONS"):
+        await _asgi_generate(scope, receive, send)
+    else:
+        await _asgi_wsgi_bridge(scope, receive, send)
+
+def batch_cli(argv):
+    """Generate a JSONL file of /generate payloads into a JSONL file of results."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="index.py batch", description=batch_cli.__doc__)
+    parser.add_argument("input", help="JSONL file, one /generate payload per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file for results ('-' for stdout)")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY, help="parallel generations")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    with source:
+        items = []
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    failed = 0
+    started = time.monotonic()
+    try:
+        for result in run_batch(items, args.concurrency):
+            failed += result['status'] != 200
+            sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+            sink.flush()
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+    elapsed = time.monotonic() - started
+    print(f"{len(items) - failed}/{len(items)} succeeded in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+def hashtags_cli(argv):
+    """Build the local hashtag index, or show what it suggests for topics."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="index.py hashtags", description=hashtags_cli.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build the index now instead of on first use")
+    build.add_argument("-o", "--output", help="index file (default: HASHTAG_INDEX_PATH or the temp directory)")
+    suggest = commands.add_parser("suggest", help="print local suggestions and their confidence")
+    suggest.add_argument("topics", nargs="+", help="topics to look up")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        path = args.output or hashtag_engine.path()
+        started = time.perf_counter()
+        info = build_hashtag_index(HASHTAG_CORPUS_PATH, HASHTAG_LEARNED_PATH, path,
+                                   hashtag_sources_signature(HASHTAG_CORPUS_PATH, HASHTAG_LEARNED_PATH))
+        print(f"{path}: {info['terms']} terms, {info['hashtags']} hashtags, {info['bytes']} bytes "
+              f"from {info['documents']} documents in {(time.perf_counter() - started) * 1000:.1f}ms", file=sys.stderr)
+        return 0
+
+    for topic in args.topics:
+        tags, confidence = hashtag_engine.lookup(topic)
+        source = "local" if tags and confidence >= hashtag_engine.min_confidence else "model"
+        print(f"{confidence:.2f} {source:5}  {' '.join(tags)}  <- {topic}")
+    return 0
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'hashtags':
+        sys.exit(hashtags_cli(sys.argv[2:]))
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,119 @@
+"""Admission control under overload, and per-client quotas.
+
+Overload: the stub upstream admits UPSTREAM_RPS calls per second and answers
+the rest with 429 and `Retry-After: 1`; each call takes 300ms. Clients offer
+text posts (three upstream calls each) at several times what the upstream can
+serve, open loop, for DURATION seconds. Without admission control every
+request is accepted and waits through rate-limit pauses. With it, at most
+MAX_IN_FLIGHT generations run, a short queue absorbs bursts, and the rest are
+shed at once with 503 and Retry-After.
+
+Quotas: with CLIENT_RATE_LIMIT_RPS=5, a noisy client sending 40 requests/s
+and a quiet one sending 2/s, identified by X-API-Key.
+
+    python benchmarks/bench_admission.py [duration] [offered_rps]
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import AppServer, load_app, summarize
+from stub_upstream import StubUpstream
+
+UPSTREAM_RPS = 60
+MAX_IN_FLIGHT = 6
+
+
+class RateLimitedStub(StubUpstream):
+    def __init__(self, rate, **kwargs):
+        super().__init__(**kwargs)
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.rejected = 0
+        self._bucket_lock = threading.Lock()
+
+    def respond(self, payload):
+        with self._bucket_lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.rejected += 1
+                return 429, {"Retry-After": "1"}, {"error": {"message": "rate limited"}}
+            self.tokens -= 1
+        return super().respond(payload)
+
+
+def offer(url, rate, duration, headers=None):
+    """Send requests at `rate` per second for `duration` seconds; returns [(status, seconds)]."""
+    results = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        started = time.perf_counter()
+        response = session.post(url, json={"topic": f"Overload test {time.monotonic_ns()} {i}"}, headers=headers)
+        with lock:
+            results.append((response.status_code, time.perf_counter() - started))
+
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=min(total, 600)) as pool:
+        started = time.monotonic()
+        for i in range(total):
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(one, i)
+    return results
+
+
+def report(label, results, elapsed):
+    ok = [seconds for status, seconds in results if status == 200]
+    shed = [seconds for status, seconds in results if status in (429, 503)]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"  {label:22} {statuses}  goodput={len(ok) / elapsed:5.1f}/s")
+    print(f"  {'':22} ok latency {summarize(ok)}")
+    if shed:
+        print(f"  {'':22} rejected in p99={summarize(shed)['p99_ms']}ms")
+
+
+def main(duration=6, offered=60):
+    with RateLimitedStub(UPSTREAM_RPS, latency=0.3) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0", GENERATION_WORKERS=256, API_MODELS="stub/model-a",
+                         CLIENT_API_KEYS="noisy,quiet")
+        with AppServer(index.app) as server:
+            url = server.url + "/generate"
+            print(f"overload: {offered} text posts/s offered for {duration}s; upstream serves {UPSTREAM_RPS} calls/s "
+                  f"(~{UPSTREAM_RPS // 3} posts/s), 300ms per call")
+            for label, max_in_flight in (("no admission control", 0), (f"max {MAX_IN_FLIGHT} in flight", MAX_IN_FLIGHT)):
+                index.admission = index.AdmissionController(max_in_flight, MAX_IN_FLIGHT * 2, 2.0, index.ClientQuotas(0, 1))
+                index.rate_limiter = index.ModelRateLimiter(0, 5, 16)
+                rejected = stub.rejected
+                started = time.monotonic()
+                results = offer(url, offered, duration)
+                report(label, results, time.monotonic() - started)
+                print(f"  {'':22} upstream 429s={stub.rejected - rejected} admission={index.admission.stats()['shed']}")
+                time.sleep(2)
+
+            print("quotas: 5 requests/s per client, burst 10")
+            index.admission = index.AdmissionController(0, 0, 2.0, index.ClientQuotas(5, 10))
+            stub.rate = 10 ** 6
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                noisy = pool.submit(offer, url, 40, duration, {"X-API-Key": "noisy"})
+                quiet = pool.submit(offer, url, 2, duration, {"X-API-Key": "quiet"})
+                report("noisy client (40/s)", noisy.result(), duration)
+                report("quiet client (2/s)", quiet.result(), duration)
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    offered = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    main(duration, offered)
@@ -0,0 +1,133 @@
+"""Concurrent /generate requests: threaded WSGI workers vs the ASGI entry point.
+
+The stub upstream answers after 500ms, so each request is almost entirely
+waiting on I/O. A WSGI server with a fixed pool of worker threads (the usual
+gunicorn/gthread setup) queues requests behind the pool; `asgi_app` under
+uvicorn keeps every request in flight on one event loop.
+
+Each server runs in its own process so peak RSS can be read from /proc.
+
+    python benchmarks/bench_asgi.py [concurrency] [wsgi_threads]
+
+Requires the packages in requirements-async.txt.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from common import API_DIR, summarize
+from stub_upstream import StubUpstream
+
+PAYLOAD = {"topic": "Remote work productivity", "audience": "Engineering managers"}
+
+
+def serve_wsgi(port, threads):
+    """Serve the Flask app with a bounded pool of worker threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+    import index
+
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    class PooledServer(ThreadingMixIn, WSGIServer):
+        request_queue_size = 1024
+
+        def process_request(self, request, client_address):
+            pool.submit(self.process_request_thread, request, client_address)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    make_server("127.0.0.1", port, index.app, server_class=PooledServer, handler_class=QuietHandler).serve_forever()
+
+
+def serve_asgi(port):
+    import uvicorn
+    uvicorn.run("index:asgi_app", host="127.0.0.1", port=port, log_level="warning", backlog=1024)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid):
+    values = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            name, _, rest = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                values[name] = int(rest.split()[0])
+    return values
+
+
+async def fire(url, concurrency):
+    # Small client shards: one httpx pool with hundreds of connections is CPU-bound itself
+    clients = [httpx.AsyncClient(timeout=120) for _ in range(0, concurrency, 10)]
+
+    async def one(client):
+        started = time.perf_counter()
+        response = await client.post(url + "/generate", json=PAYLOAD)
+        return response.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(clients[i % len(clients)]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        await client.aclose()
+    return results, elapsed
+
+
+def run(label, mode, stub, concurrency, threads):
+    port = free_port()
+    env = dict(os.environ, API_BASE_URL=stub.url, OPENROUTER_API_KEY="stub-key",
+               API_MODELS="stub/model-a,stub/model-b", RESPONSE_CACHE="0", GENERATION_MODE="combined",
+               HTTP_WARMUP="0", PYTHONPATH=API_DIR,
+               # Admission control would shed part of the burst; this compares the serving models
+               ADMISSION_MAX_IN_FLIGHT="0")
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, str(port), str(threads)],
+                              cwd=API_DIR, env=env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(url + "/templates", timeout=1)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        httpx.post(url + "/generate", json=PAYLOAD, timeout=30)  # load lazy imports and pools first
+        idle = memory_kb(server.pid)["VmRSS"]
+        results, elapsed = asyncio.run(fire(url, concurrency))
+        peak = memory_kb(server.pid)["VmHWM"]
+    finally:
+        server.terminate()
+        server.wait()
+    ok = sum(1 for status, _ in results if status == 200)
+    print(f"{label:24} ok={ok}/{concurrency} wall={elapsed:.2f}s throughput={ok / elapsed:.1f} req/s")
+    print(f"{'':24} latency {summarize([t for _, t in results])}")
+    print(f"{'':24} rss idle={idle / 1024:.1f}MB peak={peak / 1024:.1f}MB "
+          f"per in-flight request={(peak - idle) / concurrency:.1f}KB")
+
+
+def main(concurrency=200, threads=16):
+    with StubUpstream(latency=0.5) as stub:
+        print(f"{concurrency} concurrent /generate requests, upstream latency 500ms")
+        run(f"WSGI ({threads} threads)", "wsgi", stub, concurrency, threads)
+        run(f"WSGI ({concurrency} threads)", "wsgi", stub, concurrency, concurrency)
+        run("ASGI (uvicorn)", "asgi", stub, concurrency, threads)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        mode, port, threads = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        serve_wsgi(port, threads) if mode == "wsgi" else serve_asgi(port)
+    else:
+        main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,34 @@
+"""Batch throughput in topics per minute at different concurrency levels.
+
+Every text topic costs three upstream calls at 200ms each against the stub.
+
+    python benchmarks/bench_batch.py [topics]
+"""
+import json
+import sys
+import time
+
+import requests
+
+from common import AppServer, load_app
+from stub_upstream import StubUpstream
+
+
+def main(topics=60):
+    with StubUpstream(latency=0.2) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0", GENERATION_WORKERS=96)
+        with AppServer(index.app) as server:
+            for concurrency in (1, 8, 32):
+                items = [{"id": i, "topic": f"content calendar topic {i}"} for i in range(topics)]
+                calls_before = stub.calls
+                started = time.perf_counter()
+                with requests.post(f"{server.url}/generate/batch", json={"items": items, "concurrency": concurrency}, stream=True) as response:
+                    lines = [json.loads(line) for line in response.iter_lines() if line]
+                elapsed = time.perf_counter() - started
+                summary = lines[-1]["summary"]
+                print(f"concurrency={concurrency:<3} {topics / elapsed * 60:8.1f} topics/min  "
+                      f"elapsed={elapsed:.2f}s failed={summary['failed']} upstream_calls={stub.calls - calls_before}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60)
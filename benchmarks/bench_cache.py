@@ -0,0 +1,38 @@
+"""Response-cache hit rate and latency under a skewed topic distribution.
+
+Draws topics from a Zipf-like distribution (a few popular topics, a long
+tail) and generates text posts against a stub with 100ms latency, printing
+cache metrics and upstream call counts so the cache can be sized.
+
+    python benchmarks/bench_cache.py [requests] [distinct_topics] [cache_size]
+"""
+import random
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+
+def main(total=300, distinct=100, cache_size=64):
+    rng = random.Random(7)
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    topics = rng.choices([f"topic number {i}" for i in range(distinct)], weights=weights, k=total)
+
+    with StubUpstream(latency=0.1) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE_SIZE=cache_size)
+        timings = []
+        for topic in topics:
+            started = time.perf_counter()
+            index.generate_text_post(topic)
+            timings.append(time.perf_counter() - started)
+
+        print(f"requests={total} distinct_topics={distinct} cache_size={cache_size}")
+        print(f"latency         {summarize(timings)}")
+        print(f"upstream calls  {stub.calls} (uncached would be {total * 3})")
+        print(f"cache           {index.response_cache.stats()}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    main(*args)
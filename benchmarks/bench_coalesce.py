@@ -0,0 +1,61 @@
+"""Upstream calls saved by request coalescing under duplicate-heavy load.
+
+Simulates a trending topic: requests arrive over one second, drawn from a few
+topics with a Zipf-like skew (with random casing and spacing, which the
+coalescing key normalizes away). A share of them ask for a fresh sample. The
+response cache is off so only coalescing is measured.
+
+    python benchmarks/bench_coalesce.py [requests] [distinct_topics] [fresh_percent]
+"""
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+
+def payloads(total, distinct, fresh_percent, rng):
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    topics = rng.choices([f"AI agents in hiring {i}" for i in range(distinct)], weights=weights, k=total)
+    for topic in topics:
+        if rng.random() < 0.5:
+            topic = "  " + topic.upper()
+        yield {"topic": topic, "audience": "Recruiters", "fresh": rng.random() * 100 < fresh_percent}
+
+
+def run(index, stub, items):
+    before = stub.calls
+    timings = []
+    lock = threading.Lock()
+
+    def one(delay, item):
+        time.sleep(delay)
+        started = time.perf_counter()
+        body, status = index.run_generation(index.parse_generation_request(item))
+        assert status == 200, body
+        with lock:
+            timings.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=len(items)) as pool:
+        list(pool.map(one, [i / len(items) for i in range(len(items))], items))
+    return timings, stub.calls - before
+
+
+def main(total=200, distinct=5, fresh_percent=10):
+    items = list(payloads(total, distinct, fresh_percent, random.Random(11)))
+    with StubUpstream(latency=0.4) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0", GENERATION_WORKERS=128)
+        print(f"requests={total} over 1s, distinct_topics={distinct}, fresh={fresh_percent}%, upstream latency 400ms")
+        for enabled in (False, True):
+            index.COALESCE_REQUESTS = enabled
+            timings, calls = run(index, stub, items)
+            label = "coalescing on" if enabled else "coalescing off"
+            print(f"  {label:15} upstream calls={calls:4d} ({calls / total:.2f}/request) latency {summarize(timings)}")
+        print(f"  {index.single_flight.stats()}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
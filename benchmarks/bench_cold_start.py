@@ -0,0 +1,101 @@
+"""Cold start of api/index.py: import time and time to first response.
+
+Every sample is a fresh interpreter, as on a serverless cold start. The child
+imports the app, then serves its first /generate (against a local stub) and
+its first home page through the Flask test client. Both STARTUP_MODE values
+are measured:
+
+  eager - the upstream HTTP session and compressed page are built at import
+  lazy  - both are deferred to first use (the Vercel default)
+
+With --check the lazy-mode medians are compared with cold_start_budget.json.
+The budget also lists modules that must not be imported before the first
+request; that part is independent of machine speed. Exits 1 on a regression.
+
+    python benchmarks/bench_cold_start.py [samples] [--check]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import API_DIR
+from stub_upstream import StubUpstream
+
+BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cold_start_budget.json")
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+loaded = sorted(name for name, module in sys.modules.items()
+                if module is not None and type(module).__name__ != "LazyModule")
+client = index.app.test_client()
+response = client.post("/generate", json={"topic": "Remote work productivity"})
+assert response.status_code == 200, response.get_data(as_text=True)
+generated = time.perf_counter()
+response = client.get("/", headers={"Accept-Encoding": "gzip, deflate, br"})
+assert response.status_code == 200
+paged = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_generate_ms": (generated - imported) * 1000,
+    "first_page_ms": (paged - generated) * 1000,
+    "modules": loaded,
+}))
+"""
+
+
+def sample(stub, mode):
+    env = dict(os.environ, API_BASE_URL=stub.url, OPENROUTER_API_KEY="stub-key",
+               API_MODELS="stub/model-a,stub/model-b", RESPONSE_CACHE="0", STARTUP_MODE=mode,
+               PYTHONPATH=API_DIR)
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=API_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    # Interpreter start to first /generate response, as a serverless caller would see it
+    result["process_to_response_ms"] = (time.perf_counter() - started) * 1000 - result["first_page_ms"]
+    return result
+
+
+def main(samples=10, check=False):
+    # Compile the bytecode cache first so every sample starts from the same state
+    subprocess.run([sys.executable, "-m", "compileall", "-q", API_DIR], check=True)
+    metrics = ("import_ms", "first_generate_ms", "first_page_ms", "process_to_response_ms")
+    medians = {}
+    with StubUpstream() as stub:
+        print(f"{samples} cold starts per mode (median / max, ms)")
+        for mode in ("eager", "lazy"):
+            results = [sample(stub, mode) for _ in range(samples)]
+            medians[mode] = {name: statistics.median(r[name] for r in results) for name in metrics}
+            medians[mode]["modules"] = results[0]["modules"]
+            print(f"  {mode}")
+            for name in metrics:
+                values = [r[name] for r in results]
+                print(f"    {name:24} {statistics.median(values):7.1f} / {max(values):7.1f}")
+
+    if not check:
+        return 0
+    with open(BUDGET) as f:
+        budget = json.load(f)
+    failures = []
+    for name, limit in budget["lazy"].items():
+        if medians["lazy"][name] > limit:
+            failures.append(f"lazy {name} {medians['lazy'][name]:.1f}ms > budget {limit}ms")
+    imported_early = sorted(set(budget["deferred_modules"]) & set(medians["lazy"]["modules"]))
+    if imported_early:
+        failures.append(f"imported at startup in lazy mode: {', '.join(imported_early)}")
+    for failure in failures:
+        print(f"BUDGET EXCEEDED: {failure}")
+    if not failures:
+        print("within budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    sys.exit(main(*(int(arg) for arg in args[:1]), check="--check" in sys.argv))
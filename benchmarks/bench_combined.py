@@ -0,0 +1,32 @@
+"""Token usage and latency of separate vs combined text generation.
+
+Token counts come from the `usage` object /generate reports; the stub
+estimates them at four characters per token. The stub takes 200ms per call
+plus 5ms per completion word.
+
+    python benchmarks/bench_combined.py [runs]
+"""
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+
+def main(runs=5):
+    with StubUpstream(latency=0.2, chunk_interval=0.005) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0")
+        client = index.app.test_client()
+        for mode in ("separate", "combined"):
+            timings, usage = [], None
+            for i in range(runs):
+                started = time.perf_counter()
+                body = client.post("/generate", json={"topic": f"remote work {i}", "mode": mode}).get_json()
+                timings.append(time.perf_counter() - started)
+                usage = body["usage"]
+            print(f"{mode:9} mode={body['mode']:<17} usage per request={usage}")
+            print(f"{'':9} latency {summarize(timings)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
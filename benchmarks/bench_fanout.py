@@ -0,0 +1,43 @@
+"""Sequential vs concurrent text-post generation against a stubbed upstream.
+
+Each generator gets a different artificial latency (post 300ms, hooks 400ms,
+hashtags 100ms). Sequential generation should take roughly the sum (~800ms),
+the concurrent path roughly the slowest call (~400ms).
+
+    python benchmarks/bench_fanout.py [runs]
+"""
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+LATENCY_BY_MAX_TOKENS = {600: 0.3, 1300: 0.4, 100: 0.1}
+
+
+def main(runs=10):
+    with StubUpstream(latency=lambda p: LATENCY_BY_MAX_TOKENS.get(p.get("max_tokens"), 0.2)) as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0")
+        args = ("remote work tips", "managers", "educate", "professional", 150, "", "")
+
+        sequential = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            index.generate_linkedin_post(*args)
+            index.generate_hooks(args[0])
+            index.suggest_hashtags(args[0])
+            sequential.append(time.perf_counter() - started)
+
+        concurrent = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            index.generate_text_post(*args)
+            concurrent.append(time.perf_counter() - started)
+
+    print(f"runs={runs}  upstream latencies: post=300ms hooks=400ms hashtags=100ms")
+    print(f"sequential  {summarize(sequential)}")
+    print(f"concurrent  {summarize(concurrent)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,107 @@
+"""Local hashtag engine: build cost, lookup latency, and agreement with model output.
+
+hashtag_eval.json holds post topics with the hashtags the model suggests for
+them. For each confidence threshold the script reports coverage (topics the
+index answers without the model) and, over those, precision (share of local
+hashtags the model also picked) and recall (share of the model's hashtags
+found locally). Matching ignores case. The last rows time suggest_hashtags()
+end to end against a stub upstream with 150ms latency, with the engine off
+(HASHTAG_ENGINE=llm) and on (auto), counting upstream calls.
+
+With --record, reference hashtags are regenerated by the configured model
+(needs OPENROUTER_API_KEY and network access) and written back to the file.
+
+    python benchmarks/bench_hashtags.py [--rounds N] [--record]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+EVAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashtag_eval.json")
+THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+def record(path):
+    index = load_app(os.getenv("API_BASE_URL", "https://openrouter.ai/api/v1/chat/completions"), HASHTAG_ENGINE="llm")
+    with open(path) as f:
+        data = json.load(f)
+    for item in data["topics"]:
+        item["hashtags"] = index.suggest_hashtags(item["topic"])
+        print(f"{' '.join(item['hashtags'])}  <- {item['topic']}")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def agreement(engine, topics, threshold):
+    answered, hits, suggested, expected = 0, 0, 0, 0
+    for item in topics:
+        tags, confidence = engine.lookup(item["topic"])
+        if not tags or confidence < threshold:
+            continue
+        reference = {tag.lower() for tag in item["hashtags"]}
+        answered += 1
+        hits += sum(tag.lower() in reference for tag in tags)
+        suggested += len(tags)
+        expected += len(reference)
+    return answered, hits / max(suggested, 1), hits / max(expected, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=200, help="lookups per topic for the latency figures")
+    parser.add_argument("--record", action="store_true", help="regenerate reference hashtags with the live model")
+    args = parser.parse_args()
+    if args.record:
+        return record(EVAL)
+
+    with open(EVAL) as f:
+        topics = json.load(f)["topics"]
+
+    with StubUpstream(latency=0.15) as stub, tempfile.TemporaryDirectory() as tmp:
+        index = load_app(stub.url, RESPONSE_CACHE="0", HASHTAG_INDEX_PATH=os.path.join(tmp, "hashtags.idx"))
+        engine = index.HashtagEngine(index_path=os.path.join(tmp, "hashtags.idx"))
+
+        started = time.perf_counter()
+        engine.index()
+        stats = engine.stats()
+        print(f"index: {stats['terms']} terms, {stats['hashtags']} hashtags, {stats['index_bytes']} bytes, "
+              f"built and mapped in {(time.perf_counter() - started) * 1000:.1f}ms")
+        started = time.perf_counter()
+        index.HashtagEngine(index_path=os.path.join(tmp, "hashtags.idx")).index()
+        print(f"reopen existing index: {(time.perf_counter() - started) * 1000:.2f}ms")
+
+        timings = []
+        for _ in range(args.rounds):
+            for item in topics:
+                t = time.perf_counter()
+                engine.lookup(item["topic"])
+                timings.append(time.perf_counter() - t)
+        timings.sort()
+        print(f"lookup: p50={timings[len(timings) // 2] * 1e6:.1f}us p99={timings[int(len(timings) * 0.99)] * 1e6:.1f}us "
+              f"over {len(timings)} lookups")
+
+        print(f"agreement with model hashtags, {len(topics)} topics")
+        for threshold in THRESHOLDS:
+            answered, precision, recall = agreement(engine, topics, threshold)
+            print(f"  confidence >= {threshold:.1f}  local={answered:2d}/{len(topics)} ({answered / len(topics):4.0%})  "
+                  f"precision={precision:.2f}  recall={recall:.2f}")
+
+        for mode in ("llm", "auto"):
+            index.hashtag_engine = index.HashtagEngine(index_path=os.path.join(tmp, "hashtags.idx"), mode=mode)
+            calls = stub.stats()["calls"]
+            timings = []
+            for item in topics:
+                t = time.perf_counter()
+                index.suggest_hashtags(item["topic"])
+                timings.append(time.perf_counter() - t)
+            print(f"  suggest_hashtags, engine={mode:4}  {summarize(timings)}  upstream calls={stub.stats()['calls'] - calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Per-call latency of a fresh connection per request vs the pooled session.
+
+By default both sides hit the local stub, which answers immediately, so the
+difference is TCP connection setup. Pass an HTTPS URL as the second argument
+to measure against a real host, where the saving includes the TLS handshake:
+
+    python benchmarks/bench_http_pool.py [calls] [url]
+"""
+import sys
+import time
+
+import requests
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+
+def timed(send, calls):
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        send()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main(calls=200, url=None):
+    with StubUpstream(latency=0) as stub:
+        index = load_app(stub.url)
+        target = url or stub.url
+        timeout = (index.HTTP_CONNECT_TIMEOUT, index.HTTP_READ_TIMEOUT)
+
+        fresh = timed(lambda: requests.head(target, headers={"Connection": "close"}, timeout=timeout), calls)
+        pooled = timed(lambda: index.get_http_session().head(target, timeout=timeout), calls)
+        stats = index.http_pool_stats()
+
+    print(f"calls={calls} target={target}")
+    print(f"new connection per call  {summarize(fresh)}")
+    print(f"pooled keep-alive        {summarize(pooled)}")
+    print(f"pool counters            {stats}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, sys.argv[2] if len(sys.argv) > 2 else None)
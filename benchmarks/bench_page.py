@@ -0,0 +1,80 @@
+"""Bytes on the wire and server CPU per view of the home page.
+
+Compares the old handler (a new uncompressed Response per hit), compressing
+on every request, and the precompressed StaticBody: first views with gzip and
+brotli, repeat views answered 304 from the ETag, and PAGE_STATIC_ASSETS mode
+where the CSS/JS live in immutable hashed files.
+
+    python benchmarks/bench_page.py [views]
+"""
+import gzip
+import sys
+import time
+
+from common import load_app
+
+
+def wire_bytes(response):
+    """Status line, headers and body as they would be sent over HTTP/1.1."""
+    head = len(f"HTTP/1.1 {response.status}\r\n") + 2
+    head += sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+    return head + len(response.get_data())
+
+
+def view(index, handler, headers):
+    with index.app.test_request_context("/", headers=headers):
+        return index.app.process_response(handler())
+
+
+def cpu_per_view(index, handler, headers, views):
+    started = time.process_time()
+    for _ in range(views):
+        view(index, handler, headers).get_data()
+    return (time.process_time() - started) / views * 1e6
+
+
+def main(views=2000):
+    index = load_app("http://127.0.0.1:9/v1/chat/completions")
+    Response, request = index.Response, index.request
+    html, assets = index.split_page_assets(index.HTML_TEMPLATE)
+    split_page = index.StaticBody(html, "text/html", f"public, max-age={index.PAGE_MAX_AGE}")
+
+    def legacy():
+        return Response(index.HTML_TEMPLATE, mimetype="text/html")
+
+    def gzip_per_request():
+        response = Response(gzip.compress(index.HTML_TEMPLATE.encode("utf-8"), 6), mimetype="text/html")
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    browser = {"Accept-Encoding": "gzip, deflate, br"}
+    no_brotli = {"Accept-Encoding": "gzip, deflate"}
+
+    def revalidate(body):
+        etag = view(index, body.response, browser).headers["ETag"]
+        return dict(browser, **{"If-None-Match": etag})
+
+    scenarios = [
+        ("uncompressed, per request", legacy, browser),
+        ("gzip on every request", gzip_per_request, browser),
+        ("precompressed gzip", index.home_page.response, no_brotli),
+        ("precompressed brotli", index.home_page.response, browser),
+        ("repeat view (304)", index.home_page.response, revalidate(index.home_page)),
+    ]
+    print(f"home page, {len(index.HTML_TEMPLATE.encode('utf-8'))} bytes uncompressed, brotli "
+          f"{'available' if index.brotli else 'not installed'}; CPU over {views} views")
+    for label, handler, headers in scenarios:
+        size = wire_bytes(view(index, handler, headers))
+        print(f"  {label:28} {size:6d} bytes  {cpu_per_view(index, handler, headers, views):7.1f} us CPU")
+
+    first = wire_bytes(view(index, split_page.response, browser))
+    first += sum(wire_bytes(view(index, asset.response, browser)) for asset in assets.values())
+    expired = wire_bytes(view(index, split_page.response, browser))
+    print("PAGE_STATIC_ASSETS=1")
+    print(f"  {'first view (html+css+js)':28} {first:6d} bytes  {len(assets) + 1} requests")
+    print(f"  {'html expired, assets cached':28} {expired:6d} bytes  1 request")
+    print(f"  {'html revalidated (304)':28} {wire_bytes(view(index, split_page.response, revalidate(split_page))):6d} bytes  1 request")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,177 @@
+"""Output post-processing: legacy per-generator cleanup vs the compiled pipeline.
+
+Times both implementations over postprocess_corpus.json, a collection of messy
+model outputs (lead-ins, markdown, numbered hooks, quotes, carousel variants),
+then fuzzes the pipeline with random recombinations of the corpus and checks
+its invariants:
+
+  * nothing raises;
+  * cleaned posts have no lead-in, bold markers, markdown headers or blank-line runs;
+  * streaming a post in random chunks gives exactly the batch result;
+  * hooks carry no numbering, bullets or wrapping quotes and are unique;
+  * hashtags are unique, at most 7, and never digit-only;
+  * rendering parsed slides and parsing them again round-trips.
+
+    python benchmarks/bench_postprocess.py [rounds] [fuzz_cases]
+"""
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from common import load_app
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "postprocess_corpus.json")
+
+# The cleanup code as it was before the pipeline, for comparison
+LEGACY_PREFIXES = ["Here's", "Here is", "LinkedIn Post:", "Post:", "Draft:"]
+
+
+def legacy_post(post):
+    post = post.strip().lstrip()
+    for prefix in LEGACY_PREFIXES:
+        if post.lower().startswith(prefix.lower()):
+            post = post[len(prefix):].lstrip()
+            if post.startswith(":"):
+                post = post[1:].lstrip()
+    return post
+
+
+def legacy_hooks(content, num=5):
+    cleaned = []
+    for h in content.strip().split("\n"):
+        h = h.strip()
+        if h and len(h) > 2:
+            if h[0].isdigit() and h[1] in ".):":
+                h = h[2:].strip()
+            elif h[0].isdigit() and h[1].isdigit() and h[2] in ".):":
+                h = h[3:].strip()
+        if h.startswith("-") or h.startswith("•"):
+            h = h[1:].strip()
+        if h.startswith('"') and h.endswith('"'):
+            h = h[1:-1]
+        if h:
+            cleaned.append(h)
+    return cleaned[:num]
+
+
+def legacy_hashtags(content):
+    return [h for h in re.findall(r"#\w+", content) if len(h) > 1][:7]
+
+
+def legacy_carousel(content):
+    return content.strip()
+
+
+LEAD_INS = ["Here's your post:", "Here's a LinkedIn post about it:\n", "**Here is the draft:**\n\n",
+            "LinkedIn Post:", "Post #2:", "Draft:", "\"Here's the post you asked for.\"\n"]
+NOISE = ["\n---\n", "\n\n\n\n", "\n(Word count: 150)\n", "**", "  ", "\n# Header\n", "\n- bullet\n", "*"]
+HOOK_LEFT = re.compile(r"^(?:\d{1,3}[.):\]]\s|[-•·>]\s|[\"“”'].*[\"“”']$)")
+POST_LEFT = re.compile(r"\A[*\"]*(?:here(?:'s|’s| is)\b[^\n:]*\b(?:post|draft)\b|(?:linkedin )?post:|draft\b[^\n]*:)"
+                       r"|\*\*|^#+ |^-{3,}$|word count", re.IGNORECASE | re.MULTILINE)
+
+
+def dirty(kind, text, output):
+    """Whether a cleaned output still shows artifacts the pipeline is meant to remove."""
+    if kind == "posts":
+        return bool(POST_LEFT.search(output))
+    if kind == "hooks":
+        return len({h.lower() for h in output}) < len(output) or any(HOOK_LEFT.match(h) for h in output)
+    if kind == "hashtags":
+        return len({t.lower() for t in output}) < len(output) or any(t[1:].isdigit() for t in output)
+    # Carousels: output with slide headers should come back in the canonical layout
+    return bool(re.search(r"^\W*slide\s*\d", text, re.IGNORECASE | re.MULTILINE)) and not output.startswith("SLIDE 1: ")
+
+
+def chunked(text, rng):
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 12)
+        yield text[i:i + step]
+        i += step
+
+
+def fuzz_post(index, text, rng):
+    # Noise goes after the first line so lead-ins in the corpus stay intact
+    first, _, rest = text.partition("\n")
+    pieces = rest.split(" ")
+    for _ in range(rng.randint(0, 4)):
+        pieces.insert(rng.randint(0, len(pieces)), rng.choice(NOISE))
+    text = first + "\n" + " ".join(pieces)
+    lead_in = rng.choice(LEAD_INS) if rng.random() < 0.5 else ""
+    text = lead_in + " " + text
+    batch = index.normalize_post(text)
+    cleaner = index.PostStreamCleaner()
+    streamed = "".join(cleaner.feed(chunk) for chunk in chunked(text, rng)) + cleaner.finish()
+    assert streamed == batch, (text, streamed, batch)
+    assert "**" not in batch and "\n\n\n" not in batch, (text, batch)
+    assert not (lead_in and batch.startswith(lead_in.strip(' *"\n'))), (text, batch)
+    assert not any(line.startswith("# ") for line in batch.split("\n")), (text, batch)
+
+
+def fuzz_hooks(index, text, rng):
+    lines = text.split("\n")
+    rng.shuffle(lines)
+    hooks = index.normalize_hooks(lines, rng.randint(1, 8))
+    assert len({h.lower() for h in hooks}) == len(hooks), hooks
+    assert not any(HOOK_LEFT.match(h) for h in hooks), hooks
+
+
+def fuzz_hashtags(index, text, rng):
+    text = " ".join(rng.sample(text.split(" "), k=len(text.split(" "))))
+    tags = index.extract_hashtags(text)
+    assert len(tags) <= 7 and len({t.lower() for t in tags}) == len(tags), tags
+    assert all(t.startswith("#") and not t[1:].isdigit() for t in tags), tags
+
+
+def fuzz_carousel(index, text, rng):
+    blocks = text.split("\n\n")
+    rng.shuffle(blocks)
+    slides = index.parse_carousel("\n\n".join(blocks))
+    assert index.parse_carousel(index.render_carousel(slides)) == slides, slides
+
+
+def main(rounds=200, fuzz_cases=5000):
+    index = load_app("http://127.0.0.1:9/v1/chat/completions")
+    with open(CORPUS, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    pairs = [
+        ("posts", legacy_post, index.finish_post.__wrapped__),
+        ("hooks", legacy_hooks, index.finish_hooks.__wrapped__),
+        ("hashtags", legacy_hashtags, index.finish_hashtags.__wrapped__),
+        ("carousels", legacy_carousel, index.finish_carousel.__wrapped__),
+    ]
+    print(f"corpus: {', '.join(f'{len(corpus[kind])} {kind}' for kind, _, _ in pairs)}; {rounds} rounds")
+    for kind, legacy, pipeline in pairs:
+        for label, fn in (("legacy", legacy), ("pipeline", pipeline)):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                for text in corpus[kind]:
+                    fn(text)
+            per_item = (time.perf_counter() - started) / (rounds * len(corpus[kind])) * 1e6
+            left = sum(dirty(kind, text, fn(text)) for text in corpus[kind] if text.strip())
+            print(f"  {kind:10} {label:9} {per_item:7.2f} us/output  {left:2d} outputs left with artifacts")
+
+    post = corpus["posts"][0] * 4
+    started = time.perf_counter()
+    for _ in range(rounds):
+        cleaner = index.PostStreamCleaner()
+        for i in range(0, len(post), 4):
+            cleaner.feed(post[i:i + 4])
+        cleaner.finish()
+    print(f"  {'streaming':10} {'pipeline':9} {(time.perf_counter() - started) / rounds * 1e6:7.2f} us/post "
+          f"({len(post) // 4} deltas of 4 chars)")
+
+    rng = random.Random(7)
+    fuzzers = [(fuzz_post, "posts"), (fuzz_hooks, "hooks"), (fuzz_hashtags, "hashtags"), (fuzz_carousel, "carousels")]
+    for _ in range(fuzz_cases):
+        fuzzer, kind = rng.choice(fuzzers)
+        fuzzer(index, rng.choice(corpus[kind]), rng)
+    print(f"fuzz: {fuzz_cases} cases passed")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
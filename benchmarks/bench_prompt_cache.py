@@ -0,0 +1,65 @@
+"""Prompt tokens per request with shared prefix blocks, cache hints and compact prompts.
+
+The stub caches system prefixes the way Anthropic does: only blocks marked
+with cache_control, per model, reported in usage.prompt_tokens_details. Every
+uncached prompt token adds simulated prefill time. Text posts (three upstream
+calls each) and carousels are generated on fresh topics with the response
+cache off, for each combination of PROMPT_STYLE and cache hints.
+
+Providers only cache prefixes above a minimum length (1024 tokens for most
+Anthropic models), so the table of prefix sizes shows which prompts would be
+cached outside the stub.
+
+    python benchmarks/bench_prompt_cache.py [requests]
+"""
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream, _tokens
+
+MODEL = "anthropic/claude-3.5-haiku"
+PROVIDER_MIN_TOKENS = 1024
+
+
+def run(index, total, post_type):
+    timings, usage = [], {"prompt_tokens": 0, "cached_prompt_tokens": 0, "upstream_calls": 0}
+    for i in range(total):
+        item = {"topic": f"Prompt caching test {time.monotonic_ns()} {i}", "post_type": post_type}
+        started = time.perf_counter()
+        body, status = index.run_generation(index.parse_generation_request(item))
+        timings.append(time.perf_counter() - started)
+        assert status == 200, body
+        for key in usage:
+            usage[key] += body["usage"][key]
+    return timings, usage
+
+
+def main(total=40):
+    with StubUpstream(latency=0.05, prompt_cache="explicit", prefill_per_token=0.0002) as stub:
+        index = load_app(stub.url, API_MODELS=MODEL, RESPONSE_CACHE="0", GENERATION_MODE="separate")
+
+        print(f"system prefix tokens (stub estimate; cached by the provider from {PROVIDER_MIN_TOKENS})")
+        for prefix in (index.POST_PROMPT, index.HOOKS_PROMPT, index.HASHTAGS_PROMPT, index.CAROUSEL_PROMPT, index.COMBINED_PROMPT):
+            sizes = {style: _tokens(text) for style, text in prefix.texts.items()}
+            print(f"  {prefix.name:9} full={sizes['full']:4d}  compact={sizes['compact']:4d}")
+
+        print(f"{total} requests per row, model {MODEL}, 0.2ms simulated prefill per uncached prompt token")
+        for style in ("full", "compact"):
+            for hints in (False, True):
+                index.PROMPT_STYLE = style
+                index.PROMPT_CACHE_HINTS = ("anthropic/",) if hints else ()
+                for post_type in ("text", "carousel"):
+                    stub.configure(latency=0.05, prompt_cache="explicit", prefill_per_token=0.0002)
+                    run(index, 1, post_type)  # first call writes the cache entry
+                    timings, usage = run(index, total, post_type)
+                    prompt = usage["prompt_tokens"] / total
+                    cached = usage["cached_prompt_tokens"] / total
+                    label = f"{style}, {'hints' if hints else 'no hints'}"
+                    print(f"  {label:19} {post_type:8} prompt={prompt:6.1f} cached={cached:6.1f} "
+                          f"uncached={prompt - cached:6.1f} tokens/request  p50={summarize(timings)['p50_ms']:6.1f}ms")
+        print(f"per model: {index.prompt_token_stats.stats()}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 40)
@@ -0,0 +1,105 @@
+"""Throughput and tail latency against a rate-limited upstream.
+
+The stub admits RATE requests per second (token bucket) and answers the rest
+with 429 and `Retry-After: 1`. CLIENTS threads call the upstream back to back
+for DURATION seconds, first with the original per-request retry loop (each
+request sleeps 1, 2, 4, 8s on its own) and then with call_api and the shared
+per-model limiter.
+
+    python benchmarks/bench_rate_limit.py [duration] [clients] [rate]
+"""
+import sys
+import threading
+import time
+
+import requests
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+class RateLimitedStub(StubUpstream):
+    def __init__(self, rate, **kwargs):
+        super().__init__(**kwargs)
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.rejected = 0
+        self._bucket_lock = threading.Lock()
+
+    def respond(self, payload):
+        with self._bucket_lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.rejected += 1
+                return 429, {"Retry-After": "1"}, {"error": {"message": "rate limited"}}
+            self.tokens -= 1
+        return super().respond(payload)
+
+
+def legacy_call(url, max_retries=5):
+    """The retry loop call_api used before the shared limiter."""
+    for attempt in range(max_retries):
+        response = requests.post(url, json={"model": "stub/model-a", "messages": MESSAGES})
+        if response.status_code == 429:
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt
+                retry_after = response.headers.get("Retry-After")
+                if retry_after:
+                    wait_time = max(wait_time, int(retry_after))
+                time.sleep(wait_time)
+                continue
+            raise ValueError("Rate limit exceeded")
+        return response.json()["choices"][0]["message"]["content"]
+
+
+def drive(call, duration, clients):
+    latencies, failures = [], []
+    stop_at = time.monotonic() + duration
+    lock = threading.Lock()
+
+    def worker():
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            try:
+                call()
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                (latencies if ok else failures).append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, failures
+
+
+def main(duration=10, clients=16, rate=20):
+    for name in ("legacy retry loop", "shared limiter"):
+        with RateLimitedStub(rate) as stub:
+            if name == "legacy retry loop":
+                call = lambda: legacy_call(stub.url)
+            else:
+                index = load_app(stub.url, API_MODELS="stub/model-a", RESPONSE_CACHE="0",
+                                 RATE_LIMIT_RPS=rate, RATE_LIMIT_BURST=rate)
+                call = lambda: index.call_api(MESSAGES, endpoint=None)
+            started = time.monotonic()
+            latencies, failures = drive(call, duration, clients)
+            elapsed = time.monotonic() - started
+            print(f"{name:18} ok={len(latencies)} failed={len(failures)} "
+                  f"throughput={len(latencies) / elapsed:.1f}/s upstream 429s={stub.rejected}")
+            print(f"{'':18} latency {summarize(latencies)}")
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    rate = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    main(duration, clients, rate)
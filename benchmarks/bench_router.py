@@ -0,0 +1,72 @@
+"""Model routing against a chain whose first model is unhealthy.
+
+Scenario 1: `stub/model-a` answers every call with 402 (out of credits).
+The fixed-order chain pays for that failed call on every request; with the
+circuit breaker open, requests go straight to `stub/model-b`.
+
+Scenario 2: `stub/model-a` is slow (1.5s) on a third of calls. Hedging starts
+`stub/model-b` after 300ms, cutting the tail.
+
+    python benchmarks/bench_router.py [requests]
+"""
+import json
+import random
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+class ChainStub(StubUpstream):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.broken = set()
+        self.calls_by_model = {}
+
+    def respond(self, payload):
+        model = payload.get("model")
+        self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+        if model in self.broken:
+            return 402, {}, {"error": {"message": "Insufficient credits"}}
+        return super().respond(payload)
+
+
+def run(index, stub, total):
+    before = stub.calls
+    timings = []
+    for _ in range(total):
+        started = time.perf_counter()
+        index.call_api(MESSAGES)
+        timings.append(time.perf_counter() - started)
+    return timings, stub.calls - before
+
+
+def main(total=50):
+    rng = random.Random(3)
+    slow = lambda p: 1.5 if p.get("model") == "stub/model-a" and rng.random() < 1 / 3 else 0.05
+    with ChainStub(latency=0.05) as stub:
+        index = load_app(stub.url, API_MODELS="stub/model-a,stub/model-b", RESPONSE_CACHE="0")
+
+        print("scenario 1: stub/model-a returns 402")
+        stub.broken = {"stub/model-a"}
+        for label, threshold in (("fixed order", 10 ** 9), ("circuit breaker", 3)):
+            index.model_router.__init__("ordered", threshold, 30)
+            timings, calls = run(index, stub, total)
+            print(f"  {label:16} upstream calls/request={calls / total:.2f} latency {summarize(timings)}")
+        print("  router state", json.dumps(index.model_router.stats()["stub/model-a"]))
+
+        print("scenario 2: stub/model-a slow on a third of calls")
+        stub.broken = set()
+        stub.latency = slow
+        for label, hedge in (("no hedging", 0), ("hedge at 300ms", 0.3)):
+            index.model_router.__init__("ordered", 3, 30)
+            index.ROUTER_HEDGE_AFTER = hedge
+            timings, calls = run(index, stub, total)
+            print(f"  {label:16} upstream calls/request={calls / total:.2f} latency {summarize(timings)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,116 @@
+"""Near-duplicate topic reuse: lookup latency, hit rate and false matches.
+
+Traffic is drawn from SUBJECTS, each asked for in several phrasings ("remote
+work tips", "Tips for remote working", ...), mixed with the same subjects asked
+from a different angle ("remote work mistakes"), which must not reuse each
+other's output.
+
+Index: SIMILAR_TOPIC_SIZE filler topics are stored first, so lookups run
+against a full index. Each threshold reports the hit rate over the phrasing
+stream, the share of hits that matched a different subject or angle (false
+matches), and lookup latency.
+
+End to end: carousels and text posts for the same stream against a stub
+upstream with 200ms latency, with the similar-topic index off and on (the
+response cache is on in both), counting upstream calls.
+
+    python benchmarks/bench_similar_topics.py [requests]
+"""
+import random
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+SUBJECTS = [
+    "remote work", "hiring engineers", "personal branding", "cold email outreach", "startup fundraising",
+    "public speaking", "code review", "burnout recovery", "salary negotiation", "product roadmap",
+    "customer onboarding", "pricing strategy", "team offsite", "performance review", "career change",
+    "technical debt", "sales prospecting", "content marketing", "data privacy", "async communication",
+]
+ANGLES = {
+    "tips": ["{s} tips", "Tips for {s}", "My best {s} tips", "tips on {s}", "The tips that improved our {s}"],
+    "mistakes": ["{s} mistakes", "Mistakes in {s}", "The biggest mistakes I made in {s}"],
+}
+FILLER_WORDS = ("quarterly", "planning", "agile", "design", "budget", "vendor", "culture", "podcast", "metric",
+                "funnel", "mentor", "pipeline", "security", "cloud", "launch", "retention", "brand", "webinar",
+                "dashboard", "partner", "hiring", "leadership", "feedback", "interview", "growth", "churn")
+
+
+def stream(total, seed=7):
+    """[(subject, angle, topic)] with repeated subjects in varied phrasings."""
+    rng = random.Random(seed)
+    items = []
+    for _ in range(total):
+        subject = rng.choice(SUBJECTS)
+        angle = "tips" if rng.random() < 0.8 else "mistakes"
+        items.append((subject, angle, rng.choice(ANGLES[angle]).format(s=subject)))
+    return items
+
+
+def fill(index, engine, count, seed=11):
+    rng = random.Random(seed)
+    for i in range(count):
+        topic = " ".join(rng.sample(FILLER_WORDS, 3)) + f" {i}"
+        engine.add("carousel", topic, ["filler"], 5)
+
+
+def lookups(index, threshold, items, size):
+    engine = index.SimilarTopicIndex(threshold=threshold, size=size + len(items), ttl=3600, enabled=True)
+    params = {"audience": "professionals", "goal": "educate", "tone": "professional"}
+    timings, hits, false_hits = [], 0, 0
+    with index.similar_topic_scope(params):
+        fill(index, engine, size)
+        for subject, angle, topic in items:
+            started = time.perf_counter()
+            found = engine.find("carousel", topic, 5)
+            timings.append(time.perf_counter() - started)
+            if found is None:
+                engine.add("carousel", topic, [subject, angle], 5)
+                continue
+            hits += 1
+            false_hits += found != [subject, angle]
+    return hits, false_hits, timings
+
+
+def generate(index, items, post_type):
+    timings, calls = [], 0
+    for _, _, topic in items:
+        started = time.perf_counter()
+        body, status = index.run_generation(index.parse_generation_request({"topic": topic, "post_type": post_type}))
+        timings.append(time.perf_counter() - started)
+        assert status == 200, body
+        calls += body["usage"]["upstream_calls"]
+    return calls, timings
+
+
+def main(total=400):
+    items = stream(total)
+    distinct = len({topic for _, _, topic in items})
+    reusable = len({(subject, angle) for subject, angle, _ in items})
+    print(f"{total} requests, {distinct} distinct topics, {reusable} subject/angle pairs")
+    with StubUpstream(latency=0.2) as stub:
+        index = load_app(stub.url, API_MODELS="stub/model-a", HASHTAG_ENGINE="local")
+        size = index.SIMILAR_TOPIC_SIZE
+        print(f"lookups against {size} stored filler topics plus the stream")
+        for threshold in (0.5, 0.6, 0.75, 0.9, 1.0):
+            hits, false_hits, timings = lookups(index, threshold, items, size)
+            timings.sort()
+            print(f"  threshold {threshold:4.2f}  hit rate {hits / total:5.1%}  false matches {false_hits:3d}  "
+                  f"lookup p50={timings[len(timings) // 2] * 1e6:6.1f}us p99={timings[int(len(timings) * 0.99)] * 1e6:6.1f}us")
+
+        print(f"end to end, stub upstream 200ms, threshold {index.SIMILAR_TOPIC_THRESHOLD}")
+        for post_type in ("carousel", "text"):
+            for enabled in (False, True):
+                index.response_cache = index.ResponseCache(index.RESPONSE_CACHE_SIZE)
+                index.similar_topics = index.SimilarTopicIndex(enabled=enabled)
+                calls, timings = generate(index, items, post_type)
+                stats = index.similar_topics.stats()
+                print(f"  {post_type:8} similar topics {'on ' if enabled else 'off'}  upstream calls={calls:4d}  "
+                      f"hit rate={stats['hit_rate']:.1%}  p50={summarize(timings)['p50_ms']:6.1f}ms  "
+                      f"mean={summarize(timings)['mean_ms']:6.1f}ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 400)
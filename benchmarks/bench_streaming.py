@@ -0,0 +1,47 @@
+"""Time to first byte of /generate vs /generate/stream.
+
+The stub takes 200ms to the first token and 20ms per word afterwards, so a
+non-streamed post arrives after the whole generation while the streamed one
+starts rendering after roughly the first-token latency.
+
+    python benchmarks/bench_streaming.py [runs]
+"""
+import sys
+import time
+
+import requests
+
+from common import AppServer, load_app, summarize
+from stub_upstream import StubUpstream
+
+PAYLOAD = {"post_type": "text", "topic": "remote work tips"}
+
+
+def measure(url, runs, stream):
+    first_byte, total = [], []
+    for i in range(runs):
+        # Vary the topic so the response cache never answers
+        payload = dict(PAYLOAD, topic=f"{PAYLOAD['topic']} {i} {stream}")
+        started = time.perf_counter()
+        with requests.post(url, json=payload, stream=True) as response:
+            chunks = response.iter_content(chunk_size=None)
+            next(chunks)
+            first_byte.append(time.perf_counter() - started)
+            for _ in chunks:
+                pass
+        total.append(time.perf_counter() - started)
+    return first_byte, total
+
+
+def main(runs=5):
+    with StubUpstream(latency=0.2, chunk_interval=0.02) as stub:
+        index = load_app(stub.url)
+        with AppServer(index.app) as server:
+            for name, path, stream in (("/generate", "/generate", False), ("/generate/stream", "/generate/stream", True)):
+                first_byte, total = measure(server.url + path, runs, stream)
+                print(f"{name:18} ttfb {summarize(first_byte)}")
+                print(f"{'':18} total {summarize(total)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
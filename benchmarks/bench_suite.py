@@ -0,0 +1,202 @@
+"""Scenario load tests against a configurable stub upstream, with a stored baseline.
+
+Serves the app on a local port and drives it over HTTP from a pool of client
+threads, one scenario at a time. Scenarios live in suite_scenarios.json; each
+names an endpoint, a payload, a request count, a concurrency and the stub's
+behaviour (latency distribution, streaming chunk timing, injected 429/402/5xx
+errors and Retry-After). In payloads, query strings and paths, "{i}" is
+replaced by the request number and lists are rotated through, so requests stay
+distinct and the response cache is off.
+
+For each scenario the suite records p50/p95/p99 latency and time to first
+byte, throughput, non-200 responses and upstream calls (total, per request and
+by status), prints them and writes them to a JSON file.
+
+With --check the results are compared with a baseline (suite_baseline.json by
+default) using the tolerances in the scenario file, and the script exits 1 on
+a regression. --save-baseline stores the results as the new baseline.
+
+    python benchmarks/bench_suite.py [--only name,...] [--out results.json] [--check | --save-baseline]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import AppServer, load_app, summarize
+from stub_upstream import StubUpstream
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = os.path.join(HERE, "suite_scenarios.json")
+BASELINE = os.path.join(HERE, "suite_baseline.json")
+
+
+def vary(value, i):
+    """Request i's copy of a scenario value: "{i}" filled in, lists rotated."""
+    if isinstance(value, list):
+        return vary(value[i % len(value)], i)
+    if isinstance(value, dict):
+        return {key: vary(item, i) for key, item in value.items()}
+    if isinstance(value, str):
+        return value.replace("{i}", str(i))
+    return value
+
+
+def reset_app(index):
+    """Fresh circuit breakers and rate-limit buckets, so scenarios don't affect each other."""
+    index.model_router = index.ModelRouter(index.ROUTER_STRATEGY, index.CIRCUIT_FAILURE_THRESHOLD, index.CIRCUIT_COOLDOWN)
+    index.rate_limiter = index.ModelRateLimiter(index.RATE_LIMIT_RPS, index.RATE_LIMIT_BURST, index.RATE_LIMIT_MAX_BACKOFF)
+
+
+def run_scenario(base_url, stub, scenario):
+    stub.configure(**scenario.get("upstream", {}))
+    total, concurrency = scenario["requests"], scenario["concurrency"]
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, ttfbs, statuses = [], [], {}
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        response = session.request(scenario["method"], base_url + vary(scenario["path"], i),
+                                   params=vary(scenario.get("query"), i), json=vary(scenario.get("payload"), i),
+                                   stream=True)
+        first = None
+        body = b""
+        for chunk in response.iter_content(chunk_size=None):
+            if first is None:
+                first = time.perf_counter()
+            body += chunk
+        finished = time.perf_counter()
+        status = response.status_code
+        if status == 200 and scenario["path"] == "/generate/stream" and b"event: done" not in body:
+            status = "stream_error"
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(finished - started)
+                ttfbs.append((first or finished) - started)
+
+    before = stub.stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    after = stub.stats()
+
+    upstream_statuses = {str(status): count - before["statuses"].get(status, 0)
+                         for status, count in after["statuses"].items() if count > before["statuses"].get(status, 0)}
+    calls = after["calls"] - before["calls"]
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "ok": statuses.get(200, 0),
+        "success_rate": round(statuses.get(200, 0) / total, 4),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(statuses.get(200, 0) / elapsed, 2),
+        "latency": summarize(latencies),
+        "ttfb": summarize(ttfbs),
+        "upstream": {
+            "calls": calls,
+            "per_request": round(calls / total, 3),
+            "statuses": upstream_statuses,
+        },
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline, as readable strings."""
+    failures = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            limit = before["latency"][key] * (1 + tolerance["latency"]) + tolerance["latency_slack_ms"]
+            if current["latency"][key] > limit:
+                failures.append(f"{name}: latency {key} {current['latency'][key]}ms > {limit:.1f}ms "
+                                f"(baseline {before['latency'][key]}ms)")
+        floor = before["throughput_rps"] * (1 - tolerance["throughput"])
+        if current["throughput_rps"] < floor:
+            failures.append(f"{name}: throughput {current['throughput_rps']}/s < {floor:.1f}/s "
+                            f"(baseline {before['throughput_rps']}/s)")
+        ceiling = before["upstream"]["per_request"] * (1 + tolerance["upstream_per_request"])
+        if current["upstream"]["per_request"] > ceiling + 1e-9:
+            failures.append(f"{name}: upstream calls/request {current['upstream']['per_request']} > {ceiling:.3f} "
+                            f"(baseline {before['upstream']['per_request']})")
+        if current["success_rate"] < before["success_rate"] - tolerance["success_rate"]:
+            failures.append(f"{name}: success rate {current['success_rate']} < baseline {before['success_rate']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenarios", default=SCENARIOS, help="scenario file")
+    parser.add_argument("--only", help="comma-separated scenario names to run")
+    parser.add_argument("--out", default=os.path.join(HERE, "suite_results.json"), help="where to write the results")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file for --check / --save-baseline")
+    parser.add_argument("--check", action="store_true", help="compare with the baseline; exit 1 on a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    args = parser.parse_args()
+
+    with open(args.scenarios) as f:
+        config = json.load(f)
+    scenarios = config["scenarios"]
+    if args.only:
+        wanted = set(args.only.split(","))
+        scenarios = [s for s in scenarios if s["name"] in wanted]
+
+    results = {}
+    with StubUpstream() as stub:
+        index = load_app(stub.url, RESPONSE_CACHE="0")
+        with AppServer(index.app) as server:
+            for scenario in scenarios:
+                reset_app(index)
+                result = results[scenario["name"]] = run_scenario(server.url, stub, scenario)
+                latency, upstream = result["latency"], result["upstream"]
+                print(f"{scenario['name']:28} ok={result['ok']:4d}/{result['requests']:<4d} "
+                      f"{result['throughput_rps']:8.1f} req/s  p50={latency['p50_ms']:7.1f} p95={latency['p95_ms']:7.1f} "
+                      f"p99={latency['p99_ms']:7.1f}ms  ttfb p50={result['ttfb']['p50_ms']:6.1f}ms  "
+                      f"upstream {upstream['calls']} ({upstream['per_request']}/req) {upstream['statuses']}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not args.check:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["scenarios"]
+    failures = compare(results, baseline, config["tolerance"])
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if not failures:
+        print(f"no regressions against {args.baseline}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
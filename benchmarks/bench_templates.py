@@ -0,0 +1,144 @@
+"""Template store at scale: loading, lookup, filtered listing and reloads.
+
+Generates N templates (default 10,000) across 40 categories and 200 tags, once
+as JSON files and once in SQLite, and measures:
+
+  * the first (lazy) load and index build;
+  * get() by name, and GET /templates/<name> with and without a matching ETag;
+  * GET /templates pages, unfiltered and filtered by category, tags and q,
+    next to the same filters done by scanning every record;
+  * the periodic change check when nothing changed, and the reload after one
+    file is edited.
+
+    python benchmarks/bench_templates.py [templates] [iterations]
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import load_app, summarize
+
+CATEGORIES = [f"category-{i}" for i in range(40)]
+TAGS = [f"tag-{i}" for i in range(200)]
+
+
+def make_templates(count, rng):
+    for i in range(count):
+        yield {
+            "name": f"template_{i:05d}",
+            "category": rng.choice(CATEGORIES),
+            "tags": rng.sample(TAGS, 3),
+            "hook": f"Hook number {i}: what {rng.choice(['founders', 'engineers', 'recruiters'])} get wrong",
+            "body": "Context: [Describe the situation]\nLesson: [What I learned]",
+            "cta": "What would you add?",
+        }
+
+
+def write_files(directory, items):
+    for item in items:
+        with open(os.path.join(directory, item["name"] + ".json"), "w") as f:
+            json.dump(item, f)
+
+
+def write_sqlite(path, items):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE templates (name TEXT PRIMARY KEY, category TEXT, tags TEXT, "
+                 "hook TEXT NOT NULL, body TEXT NOT NULL, cta TEXT NOT NULL)")
+    conn.executemany("INSERT INTO templates VALUES (?, ?, ?, ?, ?, ?)",
+                     [(t["name"], t["category"], json.dumps(t["tags"]), t["hook"], t["body"], t["cta"]) for t in items])
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def scan(records, category=None, tags=(), q=None):
+    """The filters applied the simple way: a pass over every record."""
+    return sorted(name for name, r in records.items()
+                  if (not category or r["category"] == category)
+                  and all(tag in r["tags"] for tag in tags)
+                  and (not q or q in name.lower() or q in r["hook"].lower()))
+
+
+def main(count=10000, iterations=500):
+    index = load_app("http://127.0.0.1:9/v1/chat/completions")
+    client = index.app.test_client()
+    rng = random.Random(3)
+    items = list(make_templates(count, rng))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "templates")
+        os.mkdir(directory)
+        write_files(directory, items)
+        db_path = os.path.join(tmp, "templates.db")
+        write_sqlite(db_path, items)
+
+        print(f"{count} templates, {len(CATEGORIES)} categories, {len(TAGS)} tags; {iterations} iterations")
+        for label, make_source in (("files", lambda: index.FileTemplateSource(directory)),
+                                   ("sqlite", lambda: index.SQLiteTemplateSource(db_path))):
+            store = index.TemplateStore(make_source(), reload_interval=0)
+            started = time.perf_counter()
+            store.index()
+            print(f"  first load ({label:6})        {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+        store = index.template_store = index.TemplateStore(index.FileTemplateSource(directory), reload_interval=3600)
+        records = store.index().records
+        names = [item["name"] for item in items]
+        etag = client.get("/templates/template_00042").headers["ETag"]
+
+        print("lookups")
+        started = time.perf_counter()
+        for name in names:
+            store.get(name)
+        print(f"  store.get                   {(time.perf_counter() - started) / len(names) * 1e6:.2f} us")
+        print(f"  GET /templates/<name>       {timed(lambda: client.get('/templates/' + rng.choice(names)), iterations)}")
+        print(f"  same, If-None-Match (304)   "
+              f"{timed(lambda: client.get('/templates/template_00042', headers={'If-None-Match': etag}), iterations)}")
+
+        sample = items[7]
+        queries = [
+            ("page 1, no filter", {}, {}),
+            ("page 50, no filter", {"page": 50}, {}),
+            ("category", {"category": sample["category"]}, {"category": sample["category"]}),
+            ("category + 2 tags", {"category": sample["category"], "tag": ",".join(sample["tags"][:2])},
+             {"category": sample["category"], "tags": tuple(sample["tags"][:2])}),
+            ("tag + q", {"tag": "tag-11", "q": "founders"}, {"tags": ("tag-11",), "q": "founders"}),
+        ]
+        print("GET /templates (index)                      vs full scan of the records")
+        for label, params, filters in queries:
+            http = timed(lambda: client.get("/templates", query_string=params), iterations)
+            scanned = timed(lambda: scan(records, **filters), max(1, iterations // 10))
+            total = client.get("/templates", query_string=params).get_json()["total"]
+            print(f"  {label:20} total={total:5d}  p50={http['p50_ms']:6.2f}ms p99={http['p99_ms']:6.2f}ms"
+                  f"   scan p50={scanned['p50_ms']:6.2f}ms")
+        response = client.get("/templates", query_string={"category": sample["category"]})
+        revalidate = timed(lambda: client.get("/templates", query_string={"category": sample["category"]},
+                                              headers={"If-None-Match": response.headers["ETag"]}), iterations)
+        print(f"  {'category, 304':20}             p50={revalidate['p50_ms']:6.2f}ms p99={revalidate['p99_ms']:6.2f}ms")
+
+        print("reloads (run on a worker thread; requests keep the current index meanwhile)")
+        print(f"  change check, nothing changed  {timed(store.refresh, 20)}")
+        path = os.path.join(directory, "template_00042.json")
+        edited = dict(items[42], hook="Edited hook")
+        with open(path, "w") as f:
+            json.dump(edited, f)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        started = time.perf_counter()
+        store.refresh()
+        print(f"  reload after editing one file   {(time.perf_counter() - started) * 1000:.1f} ms "
+              f"(hook now {store.get('template_00042')['hook']!r})")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
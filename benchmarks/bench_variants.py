@@ -0,0 +1,91 @@
+"""Multi-draft generation: one `variants` request against N sequential requests.
+
+For each post type and draft count N the same topics are generated three ways
+against a stub upstream (300ms to first token, 10ms per word) whose posts and
+carousels come in several drafts:
+
+  sequential   N /generate requests with "fresh": true, one after another
+  n-sampling   one request with "variants": N; the stub honours `n`
+  concurrent   one request with "variants": N; the stub ignores `n`, so the
+               missing drafts are requested with concurrent single calls
+
+Reported per topic: wall time, upstream calls, prompt and completion tokens,
+distinct drafts returned and the mean score of the best one.
+
+    python benchmarks/bench_variants.py [topics]
+"""
+import statistics
+import sys
+import time
+
+from common import load_app, summarize
+from stub_upstream import StubUpstream
+
+TOPICS = [
+    "Remote work habits that keep engineering teams aligned", "Hiring mistakes first-time founders make",
+    "Building a personal brand on LinkedIn", "Cold email prospecting tips for SDRs",
+    "Reducing churn in a SaaS business", "Raising a seed round in a down market",
+    "Paying down technical debt without stopping feature work", "Recognizing burnout before it hits your team",
+    "How to negotiate your first salary offer", "Agile sprint planning that actually works",
+    "Value-based pricing for SaaS products", "Lessons from my biggest career failure",
+]
+
+
+def sequential(index, topic, post_type, n):
+    drafts, usage = [], []
+    for _ in range(n):
+        body, status = index.run_generation(index.parse_generation_request(
+            {"topic": topic, "post_type": post_type, "fresh": True}))
+        assert status == 200, body
+        usage.append(body["usage"])
+        draft = body["post"] if post_type == "text" else body["slides"]
+        score = index.score_post(draft) if post_type == "text" else index.score_carousel(draft)
+        if all(" ".join(draft.split()) != " ".join(d.split()) for d, _ in drafts):
+            drafts.append((draft, score))
+    return len(drafts), max(score for _, score in drafts), usage
+
+
+def variants(index, topic, post_type, n):
+    body, status = index.run_generation(index.parse_generation_request(
+        {"topic": topic, "post_type": post_type, "variants": n}))
+    assert status == 200, body
+    return len(body["variants"]), body["variants"][0]["score"], [body["usage"]]
+
+
+def run(index, strategy, post_type, n, topics):
+    timings, calls, prompt, completion, distinct, best = [], 0, 0, 0, [], []
+    for topic in topics:
+        started = time.perf_counter()
+        count, score, usage = strategy(index, topic, post_type, n)
+        timings.append(time.perf_counter() - started)
+        calls += sum(u["upstream_calls"] for u in usage)
+        prompt += sum(u["prompt_tokens"] for u in usage)
+        completion += sum(u["completion_tokens"] for u in usage)
+        distinct.append(count)
+        best.append(score)
+    per = len(topics)
+    return (f"p50={summarize(timings)['p50_ms']:7.1f}ms mean={summarize(timings)['mean_ms']:7.1f}ms  "
+            f"calls={calls / per:4.1f}  prompt tokens={prompt / per:6.0f}  completion tokens={completion / per:5.0f}  "
+            f"drafts={statistics.mean(distinct):3.1f}  best score={statistics.mean(best):.2f}")
+
+
+def main(count=len(TOPICS)):
+    topics = (TOPICS * (count // len(TOPICS) + 1))[:count]
+    with StubUpstream(latency=0.3, chunk_interval=0.01, samples=4) as stub:
+        index = load_app(stub.url, API_MODELS="stub/model-a", RESPONSE_CACHE="0", SIMILAR_TOPICS="0",
+                         HASHTAG_ENGINE="local")
+        print(f"{len(topics)} topics, stub upstream 300ms + 10ms/word, figures per topic")
+        for post_type in ("text", "carousel"):
+            for n in (3, 5):
+                print(f"{post_type}, {n} drafts")
+                stub.configure(latency=0.3, chunk_interval=0.01, samples=4)
+                index.single_choice_models.clear()
+                print(f"  sequential  {run(index, sequential, post_type, n, topics)}")
+                print(f"  n-sampling  {run(index, variants, post_type, n, topics)}")
+                stub.configure(latency=0.3, chunk_interval=0.01, samples=4, n_models=False)
+                index.single_choice_models.clear()
+                print(f"  concurrent  {run(index, variants, post_type, n, topics)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else len(TOPICS))
@@ -0,0 +1,64 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import statistics
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api")
+
+
+def load_app(upstream_url, **env):
+    """Import api/index.py configured to talk to a local stub upstream.
+
+    Configuration is read at import time, so the environment is set first.
+    """
+    os.environ["API_BASE_URL"] = upstream_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "stub-key")
+    os.environ.setdefault("API_MODELS", "stub/model-a,stub/model-b")
+    for name, value in env.items():
+        os.environ[name] = str(value)
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    import index
+    return index
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(samples):
+    """Return mean/p50/p95/p99 in milliseconds for a list of second timings."""
+    return {
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+
+class AppServer:
+    """Serve the Flask app on a local port in a background thread."""
+
+    def __init__(self, app):
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self._server = make_server("127.0.0.1", 0, app, threaded=True)
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        import threading
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
@@ -0,0 +1,354 @@
+"""Local OpenAI-compatible chat-completions stub used by the benchmarks.
+
+Runs an HTTP/1.1 keep-alive server on localhost that answers POST requests with
+a canned chat completion after an artificial delay, so benchmarks can measure
+the app without API keys or network access.
+"""
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+POST_DRAFTS = [
+    "Here's your post: Remote work isn't about where you sit.\n\n"
+    "It's about how you communicate.\n\n"
+    "→ Write things down\n→ Default to async\n→ Protect deep work\n\n"
+    "What's your best remote habit?\n\n#RemoteWork #Productivity #Leadership",
+
+    "I used to think remote work was about tools.\n\n"
+    "Then our team shipped twice as fast with fewer of them.\n\n"
+    "Here's what changed:\n\n"
+    "→ Decisions live in writing, not in meetings\n→ Every update is async by default\n"
+    "→ Deep work blocks are protected on every calendar\n→ Managers review outcomes, not online status\n\n"
+    "Fewer meetings. Clearer ownership. Calmer engineers who finally get to finish what they start.\n\n"
+    "None of it cost a cent, and all of it started with one written team agreement.\n\n"
+    "Which of these would help your team most?\n\n#RemoteWork #Productivity #Leadership #AsyncWork",
+
+    "**Remote Work Tips**\n\n"
+    "Remote work is one of the biggest changes to how companies operate that we have seen in decades, and the "
+    "teams that do it well tend to share a few habits that everyone else can learn from, like writing things "
+    "down, defaulting to asynchronous updates and protecting time for focused work on every calendar.\n\n"
+    "#RemoteWork",
+
+    "Our best remote quarter had the fewest meetings.\n\n"
+    "Not by accident. We wrote a one-page team agreement:\n\n"
+    "✓ Questions go in writing first\n✓ Meetings need an agenda and an owner\n✓ Two no-meeting days a week\n\n"
+    "Output went up. Stress went down.\n\n"
+    "Agreements like this take an afternoon to write and save hundreds of hours a year.\n\n"
+    "What's one rule your remote team swears by?\n\n#RemoteWork #Teamwork #Productivity",
+]
+
+CAROUSEL_DRAFTS = [
+    "\n\n".join(f"SLIDE {i}: Headline {i}\n• Point one\n• Point two" for i in range(1, 6)),
+    "\n\n".join(f"SLIDE {i}: Headline number {i}\n• First point for slide {i}\n• Second point\n• Third point"
+                 for i in range(1, 6)),
+    "\n\n".join(f"SLIDE {i}: A much longer headline that runs well past the ten word limit\n• Only point"
+                 for i in range(1, 4)),
+]
+
+
+def canned_content(payload, sample=0):
+    """Return a plausible completion for whichever generator sent the request.
+
+    Posts and carousels come in several drafts; `sample` picks one.
+    """
+    system = ""
+    for message in payload.get("messages", []):
+        if message.get("role") == "system":
+            system = message.get("content", "")
+            break
+    system = system.lower() if isinstance(system, str) else json.dumps(system).lower()
+    if "single json object" in system:
+        return json.dumps({
+            "post": "Remote work isn't about where you sit.\n\nIt's about how you communicate.\n\n"
+                    "→ Write things down\n→ Default to async\n\nWhat's your best remote habit?\n\n#RemoteWork #Productivity",
+            "hooks": ["Most remote teams fail for one boring reason.", "Async beats meetings. Here's the proof."],
+            "hashtags": ["#RemoteWork", "#Productivity", "#FutureOfWork", "#Leadership", "#WorkLifeBalance"],
+        })
+    if "hashtag strategist" in system:
+        return "#RemoteWork #Productivity #FutureOfWork #Leadership #WorkLifeBalance"
+    if "hook specialist" in system:
+        return "\n".join([
+            "1. Most remote teams fail for one boring reason.",
+            "2. I stopped tracking hours and output doubled.",
+            "3. Your calendar is lying to you about productivity.",
+            "4. Async beats meetings. Here's the proof.",
+            "5. The best remote hire I made had zero experience.",
+        ])
+    if "carousel" in system:
+        return CAROUSEL_DRAFTS[sample % len(CAROUSEL_DRAFTS)]
+    return POST_DRAFTS[sample % len(POST_DRAFTS)]
+
+
+def distribution(spec, rng=None):
+    """Turn a latency spec into a callable taking the request payload and returning seconds.
+
+    `spec` is a number of seconds, a callable (returned as is), or a dict:
+
+      {"dist": "constant", "seconds": 0.2}
+      {"dist": "uniform", "low": 0.1, "high": 0.4}
+      {"dist": "normal", "mean": 0.2, "stddev": 0.05}       (clipped at 0)
+      {"dist": "lognormal", "median": 0.2, "sigma": 0.5}
+      {"dist": "exponential", "mean": 0.2}
+
+    Any dict may add "max" to cap the samples.
+    """
+    if callable(spec):
+        return spec
+    if not isinstance(spec, dict):
+        seconds = float(spec or 0)
+        return lambda payload: seconds
+    rng = rng or random.Random()
+    kind = spec.get("dist", "constant")
+    if kind == "constant":
+        seconds = float(spec.get("seconds", 0))
+        sample = lambda: seconds
+    elif kind == "uniform":
+        sample = lambda: rng.uniform(spec["low"], spec["high"])
+    elif kind == "normal":
+        sample = lambda: max(0.0, rng.gauss(spec["mean"], spec["stddev"]))
+    elif kind == "lognormal":
+        mu = math.log(spec["median"])
+        sample = lambda: rng.lognormvariate(mu, spec["sigma"])
+    elif kind == "exponential":
+        sample = lambda: rng.expovariate(1.0 / spec["mean"])
+    else:
+        raise ValueError(f"unknown latency distribution {kind!r}")
+    cap = spec.get("max")
+    return (lambda payload: min(cap, sample())) if cap is not None else (lambda payload: sample())
+
+
+def _tokens(content):
+    """Rough token count of a message's content, a string or a list of text parts."""
+    if isinstance(content, list):
+        return sum(len(json.dumps(part.get("text", ""))) for part in content) // 4
+    return len(json.dumps(content)) // 4
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class StubUpstream:
+    """Threaded stub server.
+
+    `latency` is the wait before the first token: seconds, a callable taking the
+    decoded request payload, or a distribution dict (see `distribution`).
+    `chunk_interval` simulates generation speed and takes the same forms: each
+    word of the completion takes one sample, streamed as one SSE chunk when the
+    request asks for `stream: true` and added to the total wait otherwise.
+
+    `faults` injects errors: {429: 0.05, 503: 0.02} answers 5% of calls with
+    429 and 2% with 503, optionally only for the models in `fault_models`.
+    Injected errors are answered at once. 429 and 503 carry a `Retry-After` of
+    `retry_after` seconds, or a random whole number in a (low, high) range.
+    Random draws come from one generator seeded with `seed`.
+
+    `prompt_cache` simulates provider prompt caching of the system message:
+    "auto" caches every system prefix (OpenAI-style), "explicit" only those
+    marked with cache_control (Anthropic-style). Prefixes shorter than
+    `prompt_cache_min_tokens` are never cached. Repeats of a cached prefix for
+    the same model are reported in `usage.prompt_tokens_details.cached_tokens`.
+    `prefill_per_token` adds that many seconds per uncached prompt token.
+
+    `samples` > 1 makes post and carousel completions rotate through that many
+    drafts, as sampling would (1 always answers the first). A request's `n` gets that many
+    choices, billed as that many completions, for the models in `n_models`
+    (True for all, False for none); other models answer with one choice.
+    """
+
+    def __init__(self, latency=0.0, chunk_interval=0.0, faults=None, retry_after=1, fault_models=None,
+                 seed=0, prompt_cache=None, prompt_cache_min_tokens=0, prefill_per_token=0.0, samples=1,
+                 n_models=True, host="127.0.0.1", port=0):
+        self.calls = 0
+        self.statuses = {}
+        self.models = {}
+        self._lock = threading.Lock()
+        self.configure(latency=latency, chunk_interval=chunk_interval, faults=faults,
+                       retry_after=retry_after, fault_models=fault_models, seed=seed, prompt_cache=prompt_cache,
+                       prompt_cache_min_tokens=prompt_cache_min_tokens, prefill_per_token=prefill_per_token,
+                       samples=samples, n_models=n_models)
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    def configure(self, latency=0.0, chunk_interval=0.0, faults=None, retry_after=1, fault_models=None, seed=0,
+                  prompt_cache=None, prompt_cache_min_tokens=0, prefill_per_token=0.0, samples=1, n_models=True):
+        """Replace the latency, chunk timing, fault, prompt-cache and sampling settings (e.g. between scenarios)."""
+        self.rng = random.Random(seed)
+        self.latency = distribution(latency, self.rng)
+        self.chunk_interval = distribution(chunk_interval, self.rng)
+        self.faults = {int(status): float(rate) for status, rate in (faults or {}).items()}
+        self.retry_after = retry_after
+        self.fault_models = set(fault_models) if fault_models else None
+        self.prompt_cache = prompt_cache
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self.prefill_per_token = prefill_per_token
+        self.samples = max(1, samples)
+        self._draws = 0
+        self.n_models = n_models if isinstance(n_models, bool) else set(n_models)
+        self._cached_prefixes = set()
+
+    def stats(self):
+        """Calls so far, by response status and by model."""
+        with self._lock:
+            return {"calls": self.calls, "statuses": dict(self.statuses), "models": dict(self.models)}
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def delay_for(self, payload):
+        return self.latency(payload)
+
+    def fault_for(self, payload):
+        """The injected error status for this call, or None."""
+        if not self.faults or (self.fault_models is not None and payload.get("model") not in self.fault_models):
+            return None
+        roll = self.rng.random()
+        for status, rate in self.faults.items():
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def fault_response(self, status):
+        headers = {}
+        if status in (429, 503) and self.retry_after is not None:
+            low, high = self.retry_after if isinstance(self.retry_after, (list, tuple)) else (self.retry_after,) * 2
+            headers["Retry-After"] = str(self.rng.randint(int(low), int(high)))
+        messages = {429: "Rate limit exceeded", 402: "Insufficient credits"}
+        return status, headers, {"error": {"message": messages.get(status, "Upstream error"), "code": status}}
+
+    def choices_for(self, payload):
+        """How many choices to answer with: the request's `n` if the model supports it."""
+        supported = self.n_models if isinstance(self.n_models, bool) else payload.get("model") in self.n_models
+        return max(1, int(payload.get("n") or 1)) if supported else 1
+
+    def respond(self, payload):
+        """Build (status, headers, body) for a request. Subclasses may override."""
+        choices = self.choices_for(payload)
+        with self._lock:
+            first, self._draws = self._draws, self._draws + choices
+        contents = [canned_content(payload, (first + i) % self.samples) for i in range(choices)]
+        messages = payload.get("messages", [])
+        prompt_tokens = sum(_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = sum(len(content) // 4 for content in contents)
+        cached_tokens = self.cached_tokens(payload.get("model"), messages)
+        if self.prefill_per_token:
+            time.sleep((prompt_tokens - cached_tokens) * self.prefill_per_token)
+        body = {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                        for i, content in enumerate(contents)],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+        return 200, {}, body
+
+    def cached_tokens(self, model, messages):
+        """Prompt tokens served from the simulated prompt cache for this call."""
+        if not self.prompt_cache or not messages or messages[0].get("role") != "system":
+            return 0
+        content = messages[0].get("content", "")
+        marked = isinstance(content, list) and any("cache_control" in part for part in content)
+        tokens = _tokens(content)
+        if (self.prompt_cache == "explicit" and not marked) or tokens < self.prompt_cache_min_tokens:
+            return 0
+        key = (model, json.dumps(content if isinstance(content, str) else [part.get("text") for part in content]))
+        with self._lock:
+            if key in self._cached_prefixes:
+                return tokens
+            self._cached_prefixes.add(key)
+        return 0
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                fault = stub.fault_for(payload)
+                if fault is None:
+                    time.sleep(stub.delay_for(payload))
+                    status, headers, body = stub.respond(payload)
+                else:
+                    status, headers, body = stub.fault_response(fault)
+                with stub._lock:
+                    stub.calls += 1
+                    stub.statuses[status] = stub.statuses.get(status, 0) + 1
+                    model = payload.get("model", "")
+                    stub.models[model] = stub.models.get(model, 0) + 1
+                if status == 200 and payload.get("stream"):
+                    self.stream(payload, body["choices"][0]["message"]["content"], body["usage"])
+                    return
+                if status == 200:
+                    # Choices are generated side by side: the longest one sets the pace
+                    words = max((choice["message"]["content"].split(" ") for choice in body["choices"]), key=len)
+                    wait = sum(stub.chunk_interval(payload) for _ in words)
+                    if wait:
+                        time.sleep(wait)
+                raw = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def stream(self, payload, content, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = content.split(" ")
+                for i, word in enumerate(words):
+                    piece = word if i == len(words) - 1 else word + " "
+                    chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                    self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                    time.sleep(stub.chunk_interval(payload))
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    chunk = {"choices": [], "usage": usage}
+                    self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,38 @@
+"""Shared fixtures: the app module, configured against the benchmarks' stub upstream."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from stub_upstream import StubUpstream  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stub():
+    with StubUpstream() as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def index(stub):
+    """api/index.py, imported once with the stub as its only upstream."""
+    os.environ.update({
+        "API_BASE_URL": stub.url,
+        "OPENROUTER_API_KEY": "test-key",
+        "API_MODELS": "stub/model-a",
+        "RESPONSE_CACHE": "0",
+        "SIMILAR_TOPICS": "0",
+        "HASHTAG_ENGINE": "local",
+    })
+    sys.path.insert(0, os.path.join(ROOT, "api"))
+    import index as module
+    return module
+
+
+@pytest.fixture(autouse=True)
+def reset_stub(stub):
+    stub.configure()
+    yield
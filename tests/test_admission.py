@@ -0,0 +1,82 @@
+"""Batch items and jobs hold generation slots; /metrics reads admission through stats()."""
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def limited(index, monkeypatch):
+    """A fresh controller with two slots, recording the peak number in flight."""
+    controller = index.AdmissionController(2, 1, 5, index.ClientQuotas(0, 1))
+    peak = [0]
+    lock = threading.Lock()
+    enter = controller.enter
+
+    def tracking_enter(client, slot=True):
+        admitted = enter(client, slot)
+        with lock:
+            peak[0] = max(peak[0], controller.in_flight)
+        return admitted
+
+    monkeypatch.setattr(controller, "enter", tracking_enter)
+    monkeypatch.setattr(index, "admission", controller)
+    controller.peak = peak
+    return controller
+
+
+def topics(count):
+    return [{"topic": f"Topic {i}", "post_type": "text", "fresh": True} for i in range(count)]
+
+
+def test_batch_items_share_the_in_flight_limit(index, stub, limited):
+    stub.configure(latency=0.05)
+    limited.queue_size = 8
+    results = list(index.run_batch(topics(6), concurrency=6))
+    assert sorted(r["status"] for r in results) == [200] * 6
+    assert limited.peak[0] == 2
+    assert limited.stats()["admitted"] == 6
+    assert limited.in_flight == 0
+
+
+def test_batch_item_without_a_slot_gets_503(index, stub, limited):
+    stub.configure(latency=0.2)
+    limited.queue_size = 0
+    results = list(index.run_batch(topics(3), concurrency=3))
+    assert sorted(r["status"] for r in results) == [200, 200, 503]
+    assert limited.stats()["shed"]["queue_full"] == 1
+
+
+def test_job_waits_for_a_slot(index, stub, limited):
+    stub.configure(latency=0.05)
+    limited.queue_size = 0
+    held = limited.enter(None), limited.enter(None)
+    threading.Timer(0.1, lambda: [admitted.release() for admitted in held]).start()
+    body, status = index.run_admitted(index.parse_generation_request(topics(1)[0]), wait=True)
+    assert status == 200, body
+    assert limited.stats()["shed"]["queue_full"] == 1
+    assert limited.in_flight == 0
+
+
+def test_metrics_report_admission_stats(index, limited):
+    held = limited.enter(None)
+    try:
+        text = index.app.test_client().get("/metrics").get_data(as_text=True)
+    finally:
+        held.release()
+    assert "linkedin_admission_in_flight 1" in text
+    assert "linkedin_admission_queue_depth 0" in text
+
+
+def test_client_id_uses_the_proxy_added_address(index, monkeypatch):
+    monkeypatch.setattr(index, "TRUST_PROXY_HEADERS", True)
+    spoofed = {"X-Forwarded-For": "1.2.3.4, 203.0.113.7"}
+    assert index.client_id(spoofed, "10.0.0.1") == "ip:203.0.113.7"
+    rotated = {"X-Forwarded-For": "5.6.7.8, 203.0.113.7"}
+    assert index.client_id(rotated, "10.0.0.1") == index.client_id(spoofed, "10.0.0.1")
+    assert index.client_id({"X-Real-IP": "198.51.100.2", **spoofed}, "10.0.0.1") == "ip:198.51.100.2"
+    assert index.client_id({}, "10.0.0.1") == "ip:10.0.0.1"
+
+
+def test_client_id_ignores_proxy_headers_unless_trusted(index, monkeypatch):
+    monkeypatch.setattr(index, "TRUST_PROXY_HEADERS", False)
+    assert index.client_id({"X-Forwarded-For": "1.2.3.4", "X-Real-IP": "1.2.3.4"}, "10.0.0.1") == "ip:10.0.0.1"
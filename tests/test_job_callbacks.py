@@ -0,0 +1,117 @@
+"""Job callback URLs: only public addresses (or allowlisted hosts) receive results."""
+import socket
+
+import pytest
+
+
+def resolve_to(monkeypatch, index, address):
+    def getaddrinfo(host, port, *args, **kwargs):
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, port))]
+    monkeypatch.setattr(index.socket, "getaddrinfo", getaddrinfo)
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:8080/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://172.16.0.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://100.64.0.1/hook",
+    "http://0.0.0.0/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://[fe80::1]/hook",
+    "http://224.0.0.1/hook",
+])
+def test_private_addresses_are_rejected(index, url):
+    assert index.callback_url_error(url) == "callback_url must resolve to a public address"
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "example.com/hook", "http:///hook", 42])
+def test_non_http_urls_are_rejected(index, url):
+    assert index.callback_url_error(url) == "callback_url must be an http(s) URL"
+
+
+def test_host_resolving_to_private_address_is_rejected(index, monkeypatch):
+    resolve_to(monkeypatch, index, "10.1.2.3")
+    assert index.callback_url_error("https://hooks.example.com/done") == "callback_url must resolve to a public address"
+
+
+def test_public_addresses_are_accepted(index, monkeypatch):
+    assert index.callback_url_error("http://93.184.216.34/hook") is None
+    resolve_to(monkeypatch, index, "93.184.216.34")
+    assert index.callback_url_error("https://hooks.example.com:8443/done") is None
+
+
+def test_unresolvable_host_is_rejected(index, monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror("no such host")
+    monkeypatch.setattr(index.socket, "getaddrinfo", getaddrinfo)
+    assert index.callback_url_error("https://nowhere.invalid/hook") == "callback_url host could not be resolved"
+
+
+def test_allowlist_replaces_address_check(index, monkeypatch):
+    monkeypatch.setattr(index, "CALLBACK_ALLOWED_HOSTS", frozenset({"internal.example"}))
+    assert index.callback_url_error("http://internal.example/hook") is None
+    assert index.callback_url_error("http://93.184.216.34/hook") == "callback_url host is not in CALLBACK_ALLOWED_HOSTS"
+
+
+class FakeQueue:
+    PRIORITIES = ("high", "normal", "low")
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, payload, priority="normal", callback_url=None):
+        self.submitted.append(callback_url)
+        return {"id": "job-1", "status": "queued"}
+
+
+def test_jobs_route_rejects_private_callback(index, monkeypatch):
+    queue = FakeQueue()
+    monkeypatch.setattr(index, "job_queue", queue)
+    response = index.app.test_client().post("/jobs", json={"topic": "x", "callback_url": "http://169.254.169.254/"})
+    assert response.status_code == 400
+    assert response.json["error"] == "callback_url must resolve to a public address"
+    assert queue.submitted == []
+
+
+def test_jobs_route_accepts_public_callback(index, monkeypatch):
+    queue = FakeQueue()
+    monkeypatch.setattr(index, "job_queue", queue)
+    response = index.app.test_client().post("/jobs", json={"topic": "x", "callback_url": "http://93.184.216.34/hook"})
+    assert response.status_code == 202
+    assert queue.submitted == ["http://93.184.216.34/hook"]
+
+
+class FakeSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append((url, kwargs))
+        return type("Response", (), {"status_code": 204})()
+
+
+def test_delivery_rechecks_the_address(index, monkeypatch):
+    """A host that resolved publicly at submit time but privately later gets nothing."""
+    session = FakeSession()
+    monkeypatch.setattr(index, "get_http_session", lambda: session)
+    resolve_to(monkeypatch, index, "127.0.0.1")
+    job = {"id": "job-1", "callback_url": "https://hooks.example.com/done", "callback": None}
+    result = index.job_queue._deliver(job)
+    assert result == {"error": "callback_url must resolve to a public address", "attempts": 0}
+    assert session.posts == []
+
+
+def test_delivery_to_public_address(index, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(index, "get_http_session", lambda: session)
+    resolve_to(monkeypatch, index, "93.184.216.34")
+    job = {"id": "job-1", "callback_url": "https://hooks.example.com/done", "callback": None}
+    assert index.job_queue._deliver(job) == {"status": 204, "attempts": 1}
+    url, kwargs = session.posts[0]
+    assert url == "https://hooks.example.com/done"
+    assert kwargs["allow_redirects"] is False
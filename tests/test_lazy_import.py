@@ -0,0 +1,54 @@
+"""lazy_import: module code runs once, on first use, even when threads race for it."""
+import sys
+import threading
+import types
+
+
+def write_module(tmp_path, monkeypatch, name):
+    """A module that takes a while to run and records each run; returns the record."""
+    record = types.ModuleType("lazy_probe_runs")
+    record.RUNS = []
+    monkeypatch.setitem(sys.modules, "lazy_probe_runs", record)
+    (tmp_path / f"{name}.py").write_text(
+        "import time\n"
+        "import lazy_probe_runs\n"
+        "lazy_probe_runs.RUNS.append(1)\n"
+        "time.sleep(0.2)\n"
+        "VALUE = 42\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    return record.RUNS
+
+
+def test_module_runs_on_first_access(index, tmp_path, monkeypatch):
+    runs = write_module(tmp_path, monkeypatch, "lazy_probe_first")
+    module = index.lazy_import("lazy_probe_first")
+    assert runs == []
+    assert module.VALUE == 42
+    assert runs == [1]
+    assert type(module) is type(sys)
+    assert index.lazy_import("lazy_probe_first") is module
+
+
+def test_concurrent_first_access_waits_for_the_load(index, tmp_path, monkeypatch):
+    runs = write_module(tmp_path, monkeypatch, "lazy_probe_race")
+    module = index.lazy_import("lazy_probe_race")
+    start = threading.Barrier(8)
+    values, errors = [], []
+
+    def read():
+        start.wait()
+        try:
+            values.append(module.VALUE)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert values == [42] * 8
+    assert runs == [1]
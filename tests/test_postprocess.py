@@ -0,0 +1,31 @@
+"""Post-processing rules, including lines that take the no-regex fast path."""
+
+
+def test_normalize_post_rewrites_and_drops_lines(index):
+    text = ("Here's your LinkedIn post:\n\n## Why it matters\n- first point\n"
+            "Word count: 180\n(180 words)\n---\n\n\nWe **shipped** it.\nCharacters matter.")
+    assert index.normalize_post(text) == "Why it matters\n• first point\n\nWe shipped it.\nCharacters matter."
+
+
+def test_stream_cleaner_matches_batch(index):
+    text = "**Draft 2:**\n1 2 3 words\nPlain prose.\n\n# - point\n150 words"
+    cleaner = index.PostStreamCleaner()
+    streamed = "".join(cleaner.feed(text[i:i + 3]) for i in range(0, len(text), 3)) + cleaner.finish()
+    assert streamed == index.normalize_post(text) == "1 2 3 words\nPlain prose.\n\n• point"
+
+
+def test_normalize_hooks(index):
+    lines = ["Here are 3 hooks:", "1. **Stop** guessing", "Hook 2: \"Ask why\"", "(3) Stop guessing",
+             "- Ship it", "How I doubled my hooks:", "Plain hook", "5 - Five habits",
+             "5-minute habits that changed my career", "10-day sprint recap", "4—day weeks work"]
+    assert index.normalize_hooks(lines) == ["Stop guessing", "Ask why", "Ship it", "Plain hook", "Five habits",
+                                            "5-minute habits that changed my career", "10-day sprint recap",
+                                            "4—day weeks work"]
+
+
+def test_parse_carousel_points(index):
+    text = "**SLIDE 1: Intro**\n- one\n2) two\nthree\n2.5 hours saved daily\nSlide 2\nTitle: Next\n✓ done"
+    assert index.parse_carousel(text) == [
+        {"number": 1, "title": "Intro", "points": ["one", "two", "three", "2.5 hours saved daily"]},
+        {"number": 2, "title": "Next", "points": ["done"]},
+    ]
@@ -0,0 +1,31 @@
+"""The response cache answers repeats; "fresh" (sent by the form on regenerate) gets a new sample."""
+import pytest
+
+PAYLOAD = {"topic": "Remote work habits", "post_type": "text"}
+
+
+@pytest.fixture
+def cached(index, monkeypatch):
+    monkeypatch.setattr(index, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(index, "response_cache", index.ResponseCache(64, None))
+
+
+def upstream_calls(index, payload):
+    response = index.app.test_client().post("/generate", json=payload)
+    assert response.status_code == 200, response.json
+    return response.json["usage"]["upstream_calls"]
+
+
+def test_repeat_is_served_from_cache(index, stub, cached):
+    assert upstream_calls(index, PAYLOAD) > 0
+    assert upstream_calls(index, PAYLOAD) == 0
+
+
+def test_fresh_request_skips_the_cache(index, stub, cached):
+    upstream_calls(index, PAYLOAD)
+    assert upstream_calls(index, {**PAYLOAD, "fresh": True}) > 0
+
+
+def test_form_marks_unchanged_resubmits_fresh(index):
+    page = index.app.test_client().get("/").get_data(as_text=True)
+    assert "if(request===state.lastRequest)data.fresh=true" in page
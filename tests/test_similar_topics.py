@@ -0,0 +1,36 @@
+"""Similar-topic reuse: paraphrases match, opposite takes on a topic do not."""
+import pytest
+
+SCOPE = {"audience": "professionals", "goal": "educate", "tone": "professional"}
+
+
+@pytest.fixture
+def topics(index):
+    engine = index.SimilarTopicIndex(threshold=0.75, size=64, ttl=3600, enabled=True)
+    with index.similar_topic_scope(SCOPE):
+        yield engine
+
+
+def test_paraphrase_reuses_stored_output(topics):
+    topics.add("hooks", "remote work tips", ["stored"], 5)
+    assert topics.find("hooks", "Tips for remote working", 5) == ["stored"]
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Remote work is productive", "Remote work is not productive"),
+    ("Remote work is productive", "Remote work isn't productive"),
+    ("always skip code review", "never skip code review"),
+    ("meetings with an agenda", "meetings without an agenda"),
+    ("remote work tips", "best remote work tips"),
+])
+def test_opposite_stance_does_not_match(index, topics, stored, asked):
+    assert index.topic_shingles(stored)[0] == index.topic_shingles(asked)[0]
+    topics.add("hooks", stored, ["stored"], 5)
+    assert topics.find("hooks", asked, 5) is None
+
+
+def test_adapt_to_topic_replaces_whole_words_only(index):
+    hooks = ["AI will not maintain your code", "What AI said about AIR travel", "Why AI matters"]
+    assert index.adapt_to_topic(hooks, "AI", "Robotics") == [
+        "Robotics will not maintain your code", "What Robotics said about AIR travel", "Why Robotics matters"]
+    assert index.adapt_to_topic("C++ tips for C++ teams", "C++", "Rust") == "Rust tips for Rust teams"
@@ -0,0 +1,14 @@
+"""StaticBody: one strong ETag per distinct representation."""
+import pytest
+
+
+def test_brotli_etag_names_the_quality(index):
+    if index.brotli is None:
+        pytest.skip("brotli is not installed")
+    body = "<p>" + "LinkedIn post generator " * 200 + "</p>"
+    lazy = index.StaticBody(body, "text/html", "no-cache", lazy=True)
+    eager = index.StaticBody(body, "text/html", "no-cache")
+    assert lazy.variant("br") != eager.variant("br")
+    assert lazy.etag("br").endswith("-br5") and eager.etag("br").endswith("-br11")
+    assert lazy.etag("gzip") == eager.etag("gzip")
+    assert lazy.etag("identity") == eager.etag("identity")
@@ -0,0 +1,33 @@
+"""Template reloads run in the background on the store's own thread, one at a time."""
+import threading
+
+
+class SlowSource:
+    def __init__(self):
+        self.threads = []
+        self.running = 0
+        self.overlapped = False
+        self.release = threading.Event()
+
+    def refresh(self):
+        self.running += 1
+        self.overlapped |= self.running > 1
+        self.threads.append(threading.current_thread().name)
+        if len(self.threads) > 1:
+            self.release.wait(5)
+        self.running -= 1
+        return {}
+
+
+def test_background_reload_uses_its_own_thread(index):
+    source = SlowSource()
+    store = index.TemplateStore(source, reload_interval=0)
+    store.index()
+    for _ in range(20):
+        store.index()
+    source.release.set()
+    store._reload.result(5)
+    assert len(source.threads) == 2
+    assert source.threads[1].startswith("templates")
+    assert not source.overlapped
+    assert store.stats()["templates"] > 0
@@ -0,0 +1,123 @@
+"""call_api_n: one `n` request when the model supports it, single calls to fill in when it doesn't."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+MESSAGES = [{"role": "system", "content": "You write LinkedIn posts."},
+            {"role": "user", "content": "Write a LinkedIn post about remote work"}]
+MODEL = "stub/model-a"
+
+
+@pytest.fixture(autouse=True)
+def fresh(index, monkeypatch):
+    monkeypatch.setattr(index, "model_router", index.ModelRouter("ordered", 3, 30))
+    monkeypatch.setattr(index, "single_choice_models", {})
+
+
+def calls(stub):
+    with stub._lock:
+        return stub.calls
+
+
+def reject_n(stub, monkeypatch, message):
+    """Make the stub answer requests that carry `n` with a 400 saying `message`."""
+    respond = stub.respond
+
+    def respond_without_n(payload):
+        if payload.get("n"):
+            return 400, {}, {"error": {"message": message, "code": 400}}
+        return respond(payload)
+
+    monkeypatch.setattr(stub, "respond", respond_without_n)
+
+
+def test_model_returning_n_choices(index, stub):
+    stub.configure(samples=4)
+    before = calls(stub)
+    contents = index.call_api_n(MESSAGES, 3)
+    assert len(contents) == 3 and len(set(contents)) == 3
+    assert calls(stub) - before == 1
+    assert not index.is_single_choice(MODEL)
+
+
+def test_model_returning_fewer_choices_is_filled_in(index, stub):
+    stub.configure(samples=4, n_models=False)
+    before = calls(stub)
+    assert len(index.call_api_n(MESSAGES, 3)) == 3
+    # One `n` request answered with one choice, then two single calls
+    assert calls(stub) - before == 3
+    assert index.is_single_choice(MODEL)
+
+    before = calls(stub)
+    assert len(index.call_api_n(MESSAGES, 3)) == 3
+    assert calls(stub) - before == 3
+
+
+def test_single_choice_mark_expires(index, stub):
+    stub.configure(samples=4)
+    index.single_choice_models[MODEL] = index.time.monotonic() - 1
+    before = calls(stub)
+    assert len(index.call_api_n(MESSAGES, 3)) == 3
+    assert calls(stub) - before == 1
+    assert MODEL not in index.single_choice_models
+
+
+def test_400_naming_n_marks_the_model(index, stub, monkeypatch):
+    stub.configure(samples=4)
+    reject_n(stub, monkeypatch, "Unsupported parameter: 'n'")
+    assert len(index.call_api_n(MESSAGES, 3)) == 3
+    assert index.is_single_choice(MODEL)
+    assert index.model_router.stats()[MODEL]["failures"] == 0
+
+
+def test_other_400_that_works_without_n_marks_the_model(index, stub, monkeypatch):
+    stub.configure(samples=4)
+    reject_n(stub, monkeypatch, "Invalid request")
+    before = calls(stub)
+    assert len(index.call_api_n(MESSAGES, 3)) == 3
+    # The rejected `n` request, the same request without `n`, then two single calls
+    assert calls(stub) - before == 4
+    assert index.is_single_choice(MODEL)
+
+
+def test_400_not_about_n_is_a_model_failure(index, stub, monkeypatch):
+    def bad_request(payload):
+        return 400, {}, {"error": {"message": "This model's maximum context length is 8192 tokens", "code": 400}}
+
+    monkeypatch.setattr(stub, "respond", bad_request)
+    with pytest.raises(ValueError, match="maximum context length"):
+        index.call_api_n(MESSAGES, 3)
+    assert not index.is_single_choice(MODEL)
+    assert index.model_router.stats()[MODEL]["failures"] == 1
+
+
+def test_hedging_with_variants_does_not_exhaust_the_pools(index, stub, monkeypatch):
+    """Variant samples hedge their own calls; with small pools the old shared pool deadlocked."""
+    stub.configure(latency=0.1, samples=4, n_models=False)
+    monkeypatch.setattr(index, "ROUTER_HEDGE_AFTER", 0.02)
+    monkeypatch.setattr(index, "api_models", lambda: [MODEL, "stub/model-b"])
+    hedge_pool, variant_pool = ThreadPoolExecutor(2), ThreadPoolExecutor(2)
+    monkeypatch.setattr(index, "hedge_executor", hedge_pool)
+    monkeypatch.setattr(index, "variant_executor", variant_pool)
+    result = []
+    worker = threading.Thread(target=lambda: result.append(index.call_api_n(MESSAGES, 5)), daemon=True)
+    worker.start()
+    worker.join(10)
+    assert not worker.is_alive(), "call_api_n did not finish"
+    assert len(result[0]) == 5
+    assert sum(state["hedged"] for state in index.model_router.stats().values()) > 0
+    hedge_pool.shutdown(wait=True)
+    variant_pool.shutdown(wait=True)
+
+
+def test_race_gives_up_at_the_deadline(index):
+    pool = ThreadPoolExecutor(1)
+    stop = threading.Event()
+    future = pool.submit(stop.wait)
+    try:
+        with pytest.raises(index.ModelCallError, match="Timed out"):
+            index._race({future: MODEL}, index.time.monotonic() + 0.05)
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)